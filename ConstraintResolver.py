@@ -1,8 +1,11 @@
 from simulator_errors import Errors
 import random
-from typing import Union, List, Tuple
-from constants import OFFSET, PAGE_SHIFT
+from typing import Dict, Union, List, Set, Tuple
+from constants import OFFSET, PAGE_SHIFT, PTE_PLACEMENTS
 from core_types import PA, PTE, SATP, VA
+from layouts import layout
+from allocator import FrameAllocator
+from indexes import TableIndex
 
 NullableInt = Union[int, None]
 
@@ -12,10 +15,6 @@ def mask(n: int) -> int:
     return 2**n - 1
 
 
-def _randbits(n: int) -> int:
-    return random.randint(0, 2**n - 1)
-
-
 def equate(x: int, y: int, backing_value: int) -> Tuple[int, int]:
     ''' Check x and y and fill constrained, setting to backing value (chosen by memory context aware generator) if both are undefined. '''
     if x is None and y is None:
@@ -43,71 +42,90 @@ class ConstraintResolver:
 
     Change: support memory bounds
     Change: support additional bounds for the PTE range
+    Change: optionally restrict the root table slots (VPN of the top level) that random VAs use
+    Change: draw from self.rng (the Context's seeded stream) instead of the global random
+    Change: new tables and leaf pages are placed in free memory (self.allocator)
+    Change: optionally pack new walks into the existing page tables (pte_placement = 'packed', self.tables)
+    Change: check a walk's pinned fields against each other before drawing anything (check), and only draw
+    VPNs that lead to PTEs the walk can go through (fits), so a walk either resolves or fails up front
+    Change: the sizes of the mode are plain attributes, from its layout (layouts.py), instead of properties
     '''
-    def __init__(self, mode: int, memory_size: int, lower_bound: int = 0, pte_min: int = None, pte_max: int = None):
+    def __init__(self, mode: int, memory_size: int, lower_bound: int = 0, pte_min: int = None, pte_max: int = None, pte_placement: str = 'random'):
+        if pte_placement not in PTE_PLACEMENTS:
+            raise Errors.InvalidConstraints(f'Unknown pte_placement {pte_placement!r}, expected one of {PTE_PLACEMENTS}')
         self.mode = mode
         self.memory_size = memory_size
         self.lower_bound = lower_bound
         self.pte_min = pte_min
         self.pte_max = pte_max - 1 if type(pte_max) == int else pte_max
+        # Inclusive range for PTE addresses: the memory range intersected with the PTE range
+        self.pte_low = max(self.lower_bound, self.pte_min or 0)
+        self.pte_high = min(self.memory_size - 1, self.pte_max or self.memory_size)
+        self.layout = layout(mode)
+        # The sizes of this mode, from its layout
+        self.pte_ppn_widths: List[int] = list(self.layout.ppn_widths)
+        self.address_size: int = self.layout.pa_bits
+        self.satp_ppn_width: int = self.layout.ppn_bits
+        self.va_bits: int = self.layout.slot_bits  # of a VPN
+        self.PTESIZE: int = self.layout.pte_size
+        self.ALIGNMENT_BITS: int = self.layout.alignment_bits
+        self.top_level = self.layout.top_level
+        self.allocator = FrameAllocator(mode)  # where the tables and leaf pages are, so new ones go in free space
+        # If set, random VAs only take their top VPN from this list (used to keep shards apart)
+        self.root_vpns: Union[List[int], None] = None
+        self.rng: random.Random = random  # the Context replaces this with its own seeded stream
+        # The page tables so far, kept (by the Context) for the packed placement only
+        self.tables: Union[TableIndex, None] = TableIndex(self.va_bits, self.ALIGNMENT_BITS) if pte_placement == 'packed' else None
+        self.ptes: Dict[int, PTE] = {}  # the PTEs defined so far by address (the Context shares its own)
+        self.faulting: Set[int] = set()  # addresses of the PTEs invalid walks fault on
+        # (table, leaf level, VPN bits above it) with no way down for VA = PA: tables only fill up, so it stays that way
+        self.identity_dead: Set[Tuple[int, int, int]] = set()
+        self.stats = None  # the Context's profiling.Stats, when it's profiled
 
-    @property
-    def pte_ppn_widths(self) -> List[int]:
-        if self.mode == 32:
-            return [10, 12]
-        elif self.mode == 39:
-            return [9, 9, 26]
-        elif self.mode == 48:
-            return [9, 9, 9, 17]
-        return []
-
-    @property
-    def address_size(self) -> int:
-        return 34 if self.mode == 32 else 56
-
-    @property
-    def satp_ppn_width(self) -> int:
-        return 22 if self.mode == 32 else 44
+    def _random_pa_address(self) -> int:
+        ''' Get a random PA in the memory range (not checked for being free, see _new_leaf_address) '''
+        return self.rng.randint(self.lower_bound, self.memory_size - 1)
 
-    @property
-    def va_bits(self) -> int:
-        return 10 if self.mode == 32 else 9
+    def _random_pte_address(self) -> int:
+        ''' Get a random PTE address in the memory range as well as the PTE range (not checked for being free, see _new_table_address) '''
+        return self.rng.randint(self.pte_low, self.pte_high)
 
-    @property
-    def PTESIZE(self) -> int:
-        return 4 if self.mode == 32 else 8
+    def drop_pending(self):
+        ''' Release what's held for the walk being resolved (see FrameAllocator and TableIndex) '''
+        self.allocator.drop_pending()
+        if self.tables is not None:
+            self.tables.drop_pending()
 
-    @property
-    def ALIGNMENT_BITS(self) -> int:
-        return 2 if self.mode == 32 else 3
+    def _new_table_address(self) -> int:
+        ''' A free page for a new page table in the PTE range, held for the walk being resolved (see FrameAllocator) '''
+        return self.allocator.draw_table(self.pte_low, self.pte_high + 1, self.rng)
 
-    def _random_pa_address(self) -> int:
-        ''' Get a random PA in the memory range '''
-        # TODO: maybe incorporate check that it is free?
-        return random.randint(self.lower_bound, self.memory_size - 1)
+    def _new_leaf_address(self, final_level: int) -> int:
+        ''' A free page for a new leaf at final_level in the memory range, held for the walk being resolved '''
+        return self.allocator.draw_leaf(self.allocator.level_shift(final_level), self.lower_bound, self.memory_size, self.rng)
 
-    def _random_pte_address(self) -> int:
-        ''' Get a random PTE address in the memory range as well as the PTE range '''
-        # TODO: maybe incorporate check that it is free?
-        low = max(self.lower_bound, self.pte_min or 0)
-        high = min(self.memory_size - 1, self.pte_max or self.memory_size)
-        return random.randint(low, high)
+    def _packed_vpn(self, table: int, level: int, final_level: int) -> NullableInt:
+        '''
+        Packed placement: the slot to take in the table at this level. Above the leaf, one pointing to
+        a table with room left, so the walk goes on in there. Otherwise (or if there's none), a free slot.
+        None if the table is full.
+        '''
+        allowed = self.root_vpns if level == self.top_level else None
+        if level > final_level:
+            vpn = self.tables.open_child(table, allowed, self.rng)
+            if vpn is not None:
+                return vpn
+        return self.tables.free_slot(table, allowed, self.rng)
 
     def _chunk_address(self, address: NullableInt, trim_offset: bool = True) -> Union[List[int], List[None]]:
         ''' Break up the number to a list according to the PTE PPN widths '''
         if address is None:
             return [None] * len(self.pte_ppn_widths)
 
-        if trim_offset:
-            address >>= OFFSET
-
-        chunked = []
-        for width in self.pte_ppn_widths:
-            this_value = address & mask(width)
-            chunked.append(this_value)
-            address >>= width  # shift off the bits that have been assigned
+        if not trim_offset:
+            address <<= OFFSET
 
-        return chunked
+        return [(address >> shift) & field_mask for shift, field_mask in self.layout.pa_fields]
 
     def _chunk_random_pa_address(self, pte_aligned: bool = True) -> List[int]:
         ''' Use the known PTE field widths to break out a random PA address to an array accordingly '''
@@ -120,21 +138,222 @@ class ConstraintResolver:
 
         return self._chunk_address(value, trim_offset=True)
 
-    def _chunk_random_pte_address(self, pte_aligned: bool = True) -> List[int]:
-        ''' Use the known PTE field widths to break out a random PA address to an array accordingly '''
-        value = self._random_pte_address()  # random bounded PTE PA
+    def _chunk_random_pte_address(self) -> List[int]:
+        ''' Use the known PTE field widths to break out the address of a new (free) page table to an array accordingly '''
+        return self._chunk_address(self._new_table_address(), trim_offset=True)
 
-        # if we need it PTE aligned, then clear the bits needed for that with a shift-unshift
-        if pte_aligned:
-            value >>= self.ALIGNMENT_BITS
-            value <<= self.ALIGNMENT_BITS
-
-        return self._chunk_address(value, trim_offset=True)
+    def draw_batch(self, n: int, final_level: int) -> Tuple[List, ...]:
+        '''
+        Draw the addresses n unconstrained walks ending at final_level need, in one go.
+        Returns columns, one item per walk:
+        VPNs (list per level), new table addresses (list per pointer stage, top first, page aligned),
+        leaf PA source, low PA bits source, offset.
+        The distributions match what the stage by stage resolve draws. The flags are left to PTE.finalize, as there.
+        '''
+        rng = self.rng
+        levels = len(self.pte_ppn_widths)
+        va_bits = self.va_bits
+        n_tables = levels - 1 - final_level
+        page_mask = ~((1 << PAGE_SHIFT) - 1)
+        vpns = [[rng.getrandbits(va_bits) for _ in range(levels)] for _ in range(n)]
+        if self.root_vpns:
+            for vpn in vpns:
+                vpn[-1] = rng.choice(self.root_vpns)
+        tables = [[self._random_pte_address() & page_mask for _ in range(n_tables)] for _ in range(n)]
+        pa_hi = [self._random_pa_address() for _ in range(n)]
+        pa_lo = [self._random_pa_address() for _ in range(n)]
+        offsets = [rng.getrandbits(PAGE_SHIFT) for _ in range(n)]
+        return vpns, tables, pa_hi, pa_lo, offsets
+
+    def faults(self, pte: PTE, leaf: bool) -> bool:
+        ''' Whether a walk would fault on the existing PTE as its leaf (or a pointer): V = 0, W = 1 without R, or an invalid walk's '''
+        if pte.known & 1 and not pte.bits & 1 or pte.address in self.faulting:  # V = 0
+            return True
+        return leaf and pte.bits & 0b110 == 0b100  # W = 1, R = 0
+
+    def fits(self, pte: PTE, level: int, end_level: int, va: VA, pa: Union[PA, None] = None, next_address: NullableInt = None) -> bool:
+        '''
+        Whether a walk ending at end_level can go through the existing PTE at level: it's in the slot the VA's VPN selects
+        (if that's pinned), a pointer with its PPN set (to the table of the next PTE, if that one's address is pinned),
+        or the leaf, with its PPN agreeing with the PA's (if pinned, pa=None to skip that) and cleared below the level.
+        Never one the walk would fault on (see faults).
+        '''
+        vpn = va.vpn[level]
+        if vpn is not None and vpn != (pte.address & mask(OFFSET)) >> self.ALIGNMENT_BITS:
+            return False
+        if level > end_level:
+            ppn = pte.get_ppn()
+            if pte.leaf or ppn is None or next_address is not None and next_address >> PAGE_SHIFT != ppn:
+                return False
+            return not self.faults(pte, False)
+        if not pte.leaf:
+            return False
+        ppn = pte.ppn.copy()
+        if any(ppn[:level]):
+            return False
+        if pa is not None and not all(x is None or x == y for x, y in zip(pa.ppn[level:], ppn[level:])):
+            return False
+        return not self.faults(pte, True)
+
+    def check(self, satp: SATP, va: VA, pa: PA, ptes: List[PTE], start_level: int, end_level: int, valid: bool = True):
+        '''
+        The pre-pass: check the walk's pinned fields (and the existing PTEs at pinned addresses) against each other,
+        before anything is drawn. Raises InvalidConstraints with what doesn't fit.
+        For an invalid walk (valid=False), the leaf isn't checked: breaking it is the point.
+        '''
+        parent: Union[PTE, SATP] = satp  # as it will be once resolved
+        for i, pte in enumerate(ptes):
+            level = start_level - i
+            leaf = level == end_level
+            address = pte.address
+            if address is not None:
+                if address % self.PTESIZE:
+                    raise Errors.InvalidConstraints(f'PTE address {address:#x} is not aligned')
+                parent_ppn = parent.ppn if parent is satp else parent.get_ppn()
+                if parent_ppn is not None and parent_ppn != address >> PAGE_SHIFT:
+                    where = 'the SATP' if parent is satp else f'the PTE at {parent.address:#x}'
+                    raise Errors.InvalidConstraints(f'The level {level} PTE at {address:#x} is not in the table {where} points to ({parent_ppn << PAGE_SHIFT:#x})')
+                vpn = va.vpn[level]
+                if vpn is not None and vpn != (address & mask(OFFSET)) >> self.ALIGNMENT_BITS:
+                    raise Errors.InvalidConstraints(f'VPN{level} of the VA ({vpn:#x}) does not select the level {level} PTE at {address:#x}')
+                pte = self.ptes.get(address, pte)
+                if (valid or not leaf) and address in self.ptes and self.faults(pte, leaf):
+                    raise Errors.InvalidConstraints(f'The PTE at {address:#x} faults, the walk can not go through it')
+            if leaf and not valid:
+                break
+            if pte.leaf != leaf and (pte.leaf or pte.known & 0b1110 == 0b1110):  # XWR say which it is
+                role, needed = ('leaf', 'pointer') if pte.leaf else ('pointer', 'leaf')
+                where = f'The PTE at {address:#x}' if address is not None else f'The level {level} PTE'
+                raise Errors.InvalidConstraints(f'{where} is a {role}, the walk needs a {needed} at level {level}')
+            if leaf:
+                ppn = pte.ppn.copy()
+                for j in range(len(ppn)):
+                    if j < level and ppn[j]:
+                        raise Errors.InvalidConstraints(f'PPN{j} of the level {level} leaf is set, it must be 0 below the leaf level')
+                    if j >= level and ppn[j] is not None and pa.ppn[j] is not None and ppn[j] != pa.ppn[j]:
+                        raise Errors.InvalidConstraints(f'PPN{j} of the leaf ({ppn[j]:#x}) and of the PA ({pa.ppn[j]:#x}) differ')
+            parent = pte
+        # Below the leaf, the VA carries on into the PA
+        if va.offset is not None and pa.offset is not None and va.offset != pa.offset:
+            raise Errors.InvalidConstraints(f'The VA offset ({va.offset:#x}) and the PA offset ({pa.offset:#x}) differ')
+        for j in range(end_level):
+            if va.vpn[j] is not None and pa.ppn[j] is not None and va.vpn[j] != pa.ppn[j]:
+                raise Errors.InvalidConstraints(f'VPN{j} of the VA and PPN{j} of the PA differ, below a level {end_level} leaf they are the same')
+
+    def identity_address(self, table: NullableInt, end_level: int, address: int, root_slot: NullableInt = None) -> int:
+        '''
+        An address for VA = PA (same_va_pa) that a walk ending at end_level can take from the root table at table (None for
+        a new one). The drawn address, as long as the walk can go through the PTEs along it (see fits). Where it can't, a
+        VPN it can go through instead (with an address in the memory range), and on down from there -- back to another
+        slot of the table above when a table further down has no way through.
+        root_slot = the top VPN it must have (the slot of a reused PTE). Raises InvalidConstraints if there's no way down.
+        '''
+        low, high = self.lower_bound, min(self.memory_size, self.layout.va_mask + 1) - 1
+        prefix, moved = self._identity_path(table, end_level, address, root_slot, self.rng)
+        if prefix is None:
+            where = f' from the root table at {table:#x}' if table is not None else ''
+            raise Errors.InvalidConstraints(f'No VA = PA address has a way through the page tables{where}')
+        shift = self.layout.vpn_fields[end_level][0]
+        result = prefix | address & mask(shift)
+        if moved and self.stats is not None:
+            self.stats.count('identity_moves')
+        if moved and not low <= result <= high:  # the page is on the edge of the range: stay in it
+            result = self.rng.randint(max(low, prefix), min(high, prefix | mask(shift)))
+        return result
+
+    def has_identity_path(self, table: NullableInt, end_level: int, root_slot: NullableInt = None) -> bool:
+        ''' Whether identity_address has a way down (from the root slot, if given), checked without drawing anything '''
+        return self._identity_path(table, end_level, 0, root_slot, None)[0] is not None
+
+    def _identity_path(self, table: NullableInt, end_level: int, address: int, root_slot: NullableInt,
+                       rng: Union[random.Random, None]) -> Tuple[NullableInt, bool]:
+        '''
+        The VPNs of a way down for identity_address (as the address bits above the page offset, None if there's none),
+        and whether it's off the drawn address. Depth first: the drawn slot, then the others it can go through,
+        picked with rng (None: free slots first, in order). Tables with no way down are remembered (see identity_dead).
+        '''
+        low, high = self.lower_bound, min(self.memory_size, self.layout.va_mask + 1) - 1
+        dead = self.identity_dead
+        moved = False
+
+        def existing(table: NullableInt, slot: int) -> Union[PTE, None]:
+            return self.ptes.get(table | slot << self.ALIGNMENT_BITS) if table is not None else None
+
+        def usable(table: NullableInt, level: int, prefix: int, slot: int) -> bool:
+            pte = existing(table, slot)
+            if pte is None:
+                return True
+            shift = self.layout.vpn_fields[level][0]
+            if level > end_level:
+                return (self.fits(pte, level, end_level, VA(mode=self.mode))
+                        and (pte.get_ppn() << PAGE_SHIFT, end_level, prefix | slot << shift) not in dead)
+            # fits for the leaf, with the PA of the slot: the PPN is the address above the page, zero below the level
+            return pte.leaf and pte.get_ppn() == (prefix | slot << shift) >> PAGE_SHIFT and not self.faults(pte, True)
+
+        def down(table: NullableInt, level: int, prefix: int) -> NullableInt:
+            nonlocal moved
+            if level < end_level:
+                return prefix
+            shift, field = self.layout.vpn_fields[level]
+
+            def through(slot: int) -> NullableInt:
+                if not usable(table, level, prefix, slot):
+                    return None
+                pte = existing(table, slot)
+                below = pte.get_ppn() << PAGE_SHIFT if pte is not None and level > end_level else None
+                return down(below, level - 1, prefix | slot << shift)
+
+            pinned = level == self.top_level and root_slot is not None
+            slot = root_slot if pinned else (address >> shift) & field
+            found = through(slot)
+            if found is not None or pinned:
+                return found
+            others = [s for s in range(field + 1) if s != slot and prefix | s << shift <= high and prefix | (s + 1) << shift > low]
+            if rng is None:
+                others.sort(key=lambda s: existing(table, s) is not None)  # a free slot is a way down
+            else:
+                others = [s for s in others if usable(table, level, prefix, s)]
+            while others:
+                slot = rng.choice(others) if rng is not None else others[0]
+                found = through(slot)
+                if found is not None:
+                    moved = True
+                    return found
+                others.remove(slot)
+            if table is not None:
+                dead.add((table, end_level, prefix))
+            return None
+
+        return down(table, self.top_level, 0), moved
+
+    def _fitting_slot(self, table: int, level: int, slot: int, end_level: int, va: VA, pa: PA, next_address: NullableInt,
+                      shared: bool = True) -> int:
+        '''
+        The drawn slot of the table for a walk's PTE at level, if the walk can go through what's there (see fits).
+        Otherwise a random one among the free slots and the ones it can go through.
+        shared=False: free slots only (an invalid walk's leaf, which its error goes on).
+        '''
+        existing = self.ptes.get(table | slot << self.ALIGNMENT_BITS)
+        if existing is None or shared and self.fits(existing, level, end_level, va, pa, next_address):
+            return slot
+        if self.stats is not None:
+            self.stats.count('slot_redraws')
+        allowed = self.root_vpns if level == self.top_level and self.root_vpns else range(1 << self.va_bits)
+        candidates = []
+        for slot in allowed:
+            existing = self.ptes.get(table | slot << self.ALIGNMENT_BITS)
+            if existing is None or shared and self.fits(existing, level, end_level, va, pa, next_address):
+                candidates.append(slot)
+        if not candidates:
+            role = 'leaf' if level == end_level else 'pointer'
+            raise Errors.InvalidConstraints(f'No slot of the level {level} table at {table:#x} can take the walk\'s {role}')
+        return self.rng.choice(candidates)
 
     def _resolve_satp_addr(self, satp: SATP, addr: int) -> int:
         ''' Modify the SATP to fit the constraints '''
         addr = (addr >> PAGE_SHIFT) if addr != None else None
-        satp.ppn, addr = equate(satp.ppn, addr, self._random_pte_address() >> PAGE_SHIFT)
+        backing_value = self._new_table_address() >> PAGE_SHIFT if satp.ppn is None and addr is None else None
+        satp.ppn, addr = equate(satp.ppn, addr, backing_value)
         return addr << PAGE_SHIFT
 
     def _resolve_pte_addr(self, pte: PTE, addr: int, start_level: int = 0) -> int:
@@ -146,11 +365,17 @@ class ConstraintResolver:
         offset = 0
         result_address = 0
         # addr = addr >> PAGE_SHIFT if addr != None else None
-        for i, (bits, addr_val, randomized_value) in enumerate(
-                zip(pte.widths, self._chunk_address(addr), self._chunk_random_pte_address())):
-            pte.ppn[i], addr_val = equate(pte.ppn[i], addr_val, randomized_value)
+        ppn = pte.ppn.copy()  # work on a list, and write it back in one go
+        chunked = self._chunk_address(addr)
+        if any(x is None and y is None for x, y in zip(ppn, chunked)):  # only draw a new table when it's needed
+            backing_values = self._chunk_random_pte_address()
+        else:
+            backing_values = chunked
+        for i, (bits, addr_val, randomized_value) in enumerate(zip(pte.widths, chunked, backing_values)):
+            ppn[i], addr_val = equate(ppn[i], addr_val, randomized_value)
             result_address |= (addr_val << offset)
             offset += bits
+        pte.ppn = ppn
         return result_address << PAGE_SHIFT
 
     def _resolve_pte_pa(self, pte: PTE, pa: PA, final_level):
@@ -159,32 +384,53 @@ class ConstraintResolver:
                 raise Errors.SuperPageNotCleared()
             pte.ppn[i] = 0  # must be zero!
         ''' Modify the PTE and PA for the last stage '''
-        backing_values = self._chunk_random_pa_address()
+        pte_ppn, pa_ppn = pte.ppn.copy(), pa.ppn.copy()
+        if any(pte_ppn[i] is None and pa_ppn[i] is None for i in range(final_level, len(pte.widths))):
+            backing_values = self._chunk_address(self._new_leaf_address(final_level))
+        else:
+            backing_values = pte_ppn
         for i in range(final_level, len(pte.widths)):
-            pte.ppn[i], pa.ppn[i] = equate(pte.ppn[i], pa.ppn[i], backing_values[i])
+            pte_ppn[i], pa_ppn[i] = equate(pte_ppn[i], pa_ppn[i], backing_values[i])
+        pte.ppn, pa.ppn = pte_ppn, pa_ppn
 
-    def _resolve_va_addr(self, va: VA, addr: int, vpn_no: int) -> int:
+    def _resolve_va_addr(self, va: VA, addr: int, vpn_no: int, table: NullableInt = None, final_level: int = 0, walk=None) -> int:
         '''
         Get the VA address on place, the integer segment will be returned.
         Requires the # of the VPN Segment as an argument.
+        The table (base address) the PTE is in and the level of the leaf are used by the packed placement.
+        With the walk being resolved, a drawn VPN only selects an existing PTE if the walk can go through it.
         Returns the low segment of the resulting address.
         '''
         addr_val = addr & mask(OFFSET) if addr != None else None
         if addr_val and addr_val % self.PTESIZE:
             return Errors.UnalignedAddress('VA Address not aligned')
         addr_val = addr_val >> self.ALIGNMENT_BITS if addr_val != None else None
-        va.vpn[vpn_no], addr_val = equate(va.vpn[vpn_no], addr_val, random.getrandbits(va.widths[vpn_no]))
+        backing_value = None
+        if self.tables is not None and table is not None:
+            backing_value = self._packed_vpn(table, vpn_no, final_level)
+        if backing_value is None:
+            if vpn_no == self.top_level and self.root_vpns:
+                backing_value = self.rng.choice(self.root_vpns)
+            else:
+                backing_value = self.rng.getrandbits(va.widths[vpn_no])
+        if walk is not None and table is not None and addr_val is None and va.vpn[vpn_no] is None:
+            next_address = walk.ptes[walk.startLevel - vpn_no + 1].address if vpn_no > walk.endLevel else None
+            shared = walk.valid or vpn_no > walk.endLevel
+            backing_value = self._fitting_slot(table, vpn_no, backing_value, walk.endLevel, va, walk.pa, next_address, shared)
+        va.vpn[vpn_no], addr_val = equate(va.vpn[vpn_no], addr_val, backing_value)
         return addr_val << self.ALIGNMENT_BITS
 
     def _resolve_va_pa_final(self, va: VA, pa: PA, max_page_vpn: int = -1):
         ''' For the final pa := va part, accounting for bigpages. Use -1 for smallest page size (range inclusive) '''
-        va.offset, pa.offset = equate(va.offset, pa.offset, random.getrandbits(12))  # offset always 12 bits
+        va.offset, pa.offset = equate(va.offset, pa.offset, self.rng.getrandbits(12))  # offset always 12 bits
         # BOUNDS CHECK: I think this could be bigger than the physical memory (e.g. a 512GB page in Sv48) so we will use a PA bounded source here
         backing_values = self._chunk_random_pa_address()
+        vpn, ppn = va.vpn.copy(), pa.ppn.copy()
         for i in range(max_page_vpn + 1):
-            va.vpn[i], pa.ppn[i] = equate(va.vpn[i], pa.ppn[i], backing_values[i])
+            vpn[i], ppn[i] = equate(vpn[i], ppn[i], backing_values[i])
+        va.vpn, pa.ppn = vpn, ppn
 
-    def _resolve_stage(self, pte: Union[PTE, SATP], va: VA, resulting_address: int, vpn_no: int, PTESIZE: int) -> int:
+    def _resolve_stage(self, pte: Union[PTE, SATP], va: VA, resulting_address: int, vpn_no: int, PTESIZE: int, final_level: int = 0, walk=None) -> int:
         '''
         New approach: high and low parts in parallel. We compare the resulting address
         through it being tied to the specific fields in parallel.
@@ -193,7 +439,7 @@ class ConstraintResolver:
             hi_result = self._resolve_pte_addr(pte, resulting_address)
         else:
             hi_result = self._resolve_satp_addr(pte, resulting_address)
-        lo_result = self._resolve_va_addr(va, resulting_address, vpn_no)
+        lo_result = self._resolve_va_addr(va, resulting_address, vpn_no, hi_result, final_level, walk)
         return hi_result | lo_result
 
     def _resolve_stage_leaf(self, pte: PTE, va: VA, pa: PA, final_level: int):
@@ -205,9 +451,12 @@ class ConstraintResolver:
         self._resolve_va_pa_final(va, pa, final_level - 1)
 
     # Non leaf pages
-    def resolve(self, pte: Union[PTE, SATP], va: VA, resulting_address: int, vpn_no: int) -> int:
-        ''' Returns the address, changes the rest inplace. '''
-        return self._resolve_stage(pte, va, resulting_address, vpn_no, self.PTESIZE)
+    def resolve(self, pte: Union[PTE, SATP], va: VA, resulting_address: int, vpn_no: int, final_level: int = 0, walk=None) -> int:
+        '''
+        Returns the address, changes the rest inplace. final_level = how far down the packed placement can go (the leaf level)
+        walk = the TranslationWalk being resolved, to keep the drawn VPNs away from existing PTEs it can't go through
+        '''
+        return self._resolve_stage(pte, va, resulting_address, vpn_no, self.PTESIZE, final_level, walk)
 
     def resolve_leaf(self, pte: PTE, va: VA, pa: PA, level: int):
         self._resolve_stage_leaf(pte, va, pa, level)
@@ -4,18 +4,22 @@ Manages the testing context -- e.g. how much memory we have, keeping track of PT
 '''
 
 import random
-from typing import List, Tuple, Union, Dict
+from typing import List, Tuple, Union, Dict, Iterator, Sequence, Set
 from collections import defaultdict
-import json5
+import fastjson5
 import json
 from sty import fg, bg, ef, RgbBg, rs
 
 from simulator_errors import Errors
 from utils import safe_to_bin, safe_to_hex, rsetattr, rgetattr, addr_to_memsize, num_hex_digits
-from typeutils import resolve_flag, resolve_int
 from core_types import PA, PTE, SATP, VA
-from constants import PT_LEVEL_MAP, MAX_PA_MAP, MODE_PAGESIZE_LEVEL_MAP, PA_BITS, PAGESIZE_INT_MAP
+from indexes import PAGE_OFFSET_MASK, PAIndex, ReuseIndex
+from layouts import layout, shape
+from constants import PT_LEVEL_MAP, MAX_PA_MAP, MODE_PAGESIZE_LEVEL_MAP, PA_BITS, PAGESIZE_INT_MAP, PAGE_SHIFT
 from Translator import TranslationWalk, InvalidTranslationWalk
+from plans import CHOICE, FIXED, CasePlan, draw
+from profiling import Stats, attach
+from walk_store import WalkStore
 
 from ConstraintResolver import ConstraintResolver
 
@@ -23,8 +27,10 @@ NullableInt = Union[int, None]
 
 bg.set_style('orange', RgbBg(255, 150, 50))
 
-PTE_REUSE_MAX_ATTEMPTS = 5
-ADD_CASE_MAX_ATTEMPTS = 5
+RANDOM_BATCH_SIZE = 4096  # walks per add_random_walks call for unconstrained test cases
+
+# A test case with only these keys (and a single pagesize) is fully random, and goes through add_random_walks
+PLAIN_CASE_KEYS = {'repeats', 'pagesize', 'special'}
 
 
 class Context:
@@ -32,21 +38,31 @@ class Context:
     Hold our data, and make special & probabilistic test cases
     '''
     def random_address(self):
-        return random.randint(self.lower_bound, self.memory_size - 1)
+        return self.rng.randint(self.lower_bound, self.memory_size - 1)
+
+    def use_substream(self, *key):
+        '''
+        Switch to the random stream for key (e.g. a test case index), derived from the seed.
+        Lets a single test case (or a shard) be regenerated without replaying the ones before it.
+        The leaf pages drawn from it start their own groups, for the same reason (see FrameAllocator.new_leaf_groups).
+        '''
+        self.rng = random.Random('/'.join(str(x) for x in (self.seed, *key)))
+        self.CR.rng = self.rng
+        self.CR.allocator.new_leaf_groups()
 
     def valid_address(self, value):
         return value < self.memory_size
 
     def num_ptes(self, pagesize: str) -> int:
         ''' Return the number of PTES for a walk with the given page size '''
-        return self.levels - MODE_PAGESIZE_LEVEL_MAP[self.mode][pagesize]
+        return shape(self.mode, pagesize).num_ptes
 
     def _format_va(self, va_addr: int, colorterm=True):
         if va_addr is None:
             return '***'
         va_digits = num_hex_digits(self.mode)
         va_str = f'{va_addr:#0{va_digits}x}'
-        if colorterm and self.va_reference_counter[va_addr] > 1:
+        if colorterm and self.va_reference_counter.get(va_addr, 0) > 1:
             return fg.red + va_str + fg.rs
         return va_str
 
@@ -55,7 +71,7 @@ class Context:
             return '***'
         pa_digits = num_hex_digits(PA_BITS[self.mode])
         pa_str = f'{pa_addr:#0{pa_digits}x}'
-        if colorterm and self.reference_counter[pa_addr] > 1:
+        if colorterm and self.reference_counter.get(pa_addr, 0) > 1:
             return fg.red + pa_str + fg.rs
         return pa_str
 
@@ -84,9 +100,10 @@ class Context:
         if type(walk) == InvalidTranslationWalk:
             return self._tw_ministring_err(walk, color)
         ppn_width = num_hex_digits(walk.satp.ppn_width)
-        pa_str = self._format_pa(walk.pa.data(), color)
-        va_str = self._format_va(walk.va.data(), color)
-        if color and walk.pa.data() == walk.va.data(): # Color PA = VA blue bg
+        va, pa = walk.va.data(), walk.pa.data()
+        pa_str = self._format_pa(pa, color)
+        va_str = self._format_va(va, color)
+        if color and pa == va: # Color PA = VA blue bg
             pa_str = bg.cyan + pa_str + bg.rs
             va_str = bg.cyan + va_str + bg.rs
         pte_entries = ' '.join([self._format_pa(x.address, color) for x in walk.ptes])
@@ -95,141 +112,413 @@ class Context:
         base = f'SATP: {walk.satp.ppn:#0{ppn_width}x} VA: {va_str} -> [{pte_str}] -> {pa_str}'
         return base
 
-    def __init__(self, memory_size: Union[int, None], mode: int, lower_bound: int = 0, pte_min: int = 0, pte_max: int = None, global_satp: SATP = None):
+    def __init__(self, memory_size: Union[int, None], mode: int, lower_bound: int = 0, pte_min: int = 0, pte_max: int = None, global_satp: SATP = None, keep_walks: bool = True, seed: Union[int, str, None] = None, pte_placement: str = 'random'):
         ''' Initialize a ContextManager.
         params:
         size of memory (= the max physical address allowed in the simulation + 1)
         mode = 32 / 39 / 48.
         pte_min and pte_max (int, bounds the PTE areas)
-        global_satp = default SATP, will randomize if None 
+        global_satp = default SATP, will randomize if None
+        keep_walks = hold on to the walks. If False, only the lookup tables needed for
+        reuse & aliasing are kept, and the caller consumes the walks as they're made (streaming)
+        seed = seed for all of the random choices. A random one is picked (and kept in self.seed) if None
+        pte_placement = 'random' or 'packed' (new walks go into the existing page tables where they can)
         '''
         # TODO: add stuff to classes for bounded randomness issues.
         self.memory_size = memory_size or MAX_PA_MAP[mode]  # 0 is not supported here (duh)
         self.lower_bound = lower_bound
         self.mode = mode
-        self.address_table = {
-        }  # we'll use this to keep track of PTEs & PAs that have already been allocated and their physical addresses
-        self.vas = {}
-        self.pas = {}
+        # The VAs and PAs of the walks so far, in order (dicts as ordered sets): the walks hold the VA / PA objects,
+        # so these only need the addresses, and a streaming Context doesn't keep every VA and PA alive
+        self.vas: Dict[int, None] = {}
+        self.pas: Dict[int, None] = {}
+        self.pa_index = PAIndex()  # the PAs of self.pas, to pick from for aliasing
         self.ptes: Dict[int, PTE] = {}
         # self.leaves = {}
-        self.walks: List[TranslationWalk] = []
+        self.walks = WalkStore(mode)  # a list of the walks, normalized (see walk_store.py)
+        self.keep_walks = keep_walks
         self.levels = PT_LEVEL_MAP[mode]
-        self.satps: List[SATP] = []
+        # The PTEs of the valid walks, to pick from for reuse_pte without holding the walks
+        self.reuse = ReuseIndex(self.levels - 1)
         self.reference_counter = defaultdict(int)
         self.va_reference_counter = defaultdict(int)
+        self.pte_placement = pte_placement
         self.pte_min = pte_min
         self.pte_max = pte_max or self.memory_size
-        self.CR = ConstraintResolver(mode=mode, memory_size=self.memory_size, lower_bound=self.lower_bound, pte_min=pte_min, pte_max=pte_max)
+        self.CR = ConstraintResolver(mode=mode, memory_size=self.memory_size, lower_bound=self.lower_bound, pte_min=pte_min, pte_max=pte_max, pte_placement=pte_placement)
+        self.CR.ptes = self.ptes
+        self.stats: Union[Stats, None] = None  # see profile
+        self.seed = random.SystemRandom().getrandbits(64) if seed is None else seed
+        self.use_substream()
         
         # Create a default SATP if not past parametrically. To quote RISC-V docs: This register holds the physical page number (PPN)
         # of the root page table, i.e., its supervisor physical address divided by 4 KiB. Equivalent to >> (12 = PAGESIZE)
-        self.global_satp = global_satp or SATP(self.mode, asid=0, ppn=(self.CR._random_pte_address() // 4096))
+        self.global_satp = global_satp or SATP(self.mode, asid=0, ppn=(self.CR._new_table_address() // 4096))
+        if self.global_satp.ppn is not None:
+            self.CR.allocator.mark(self.global_satp.ppn << PAGE_SHIFT, PAGE_SHIFT)
+
+
+    @property
+    def satps(self) -> List[SATP]:
+        ''' The SATPs of the kept walks, each once '''
+        return self.walks.satps
 
+    def profile(self) -> Stats:
+        ''' Time the stages of the generation and count its fallbacks from now on (see profiling.py). Returns the stats '''
+        if self.stats is None:
+            self.stats = self.CR.stats = Stats()
+            attach(self, self.stats)
+        return self.stats
 
-    def add_walk(self, pagesize: str, va: VA, pa: PA, ptes: List[PTE], satp: SATP):
+    def _keep(self, walk: TranslationWalk):
+        ''' Record a resolved walk, unless streaming '''
+        if self.keep_walks:
+            self.walks.append(walk)
+
+    def add_walk(self, pagesize: str, va: VA, pa: PA, ptes: List[PTE], satp: SATP) -> TranslationWalk:
         '''
         Add a translation walk to the context.
         Meant for when it's been specced out already.
         Registers the relevant components in all the relevant lookup tables.
+        Returns the resolved walk.
         '''
         walk = TranslationWalk(self.mode, pagesize, satp, va, pa, ptes)
+        self.CR.drop_pending()  # anything held by an earlier walk that failed
+        self.CR.check(satp, va, pa, ptes, walk.startLevel, walk.endLevel)
         walk.resolve(CR=self.CR, pte_hashmap=self.ptes)
-        self.vas[va.data()] = va
-        self.address_table[pa.data()] = pa
-        self.pas[pa.data()] = pa
-        self.satps.append(satp)
-        for pte in ptes:
-            self.address_table[pte.address] = pte
+        self._register(walk)
+        return walk
+
+    def _register(self, walk: TranslationWalk):
+        ''' Register the components of a resolved (valid) walk in the lookup tables '''
+        va, pa = walk.va, walk.pa
+        allocator = self.CR.allocator
+        self.vas[va.data()] = None
+        self.pas[pa.data()] = None
+        self.pa_index.add(pa.data(), walk.endLevel)
+        level = walk.startLevel
+        for pte in walk.ptes:
+            if pte.address not in self.ptes:  # a shared one's table page is marked already
+                allocator.mark(pte.address, PAGE_SHIFT)  # the table page it's in
             self.ptes[pte.address] = pte
             self.reference_counter[pte.address] += 1
+            self.reuse.add(pte.address, level, level == walk.endLevel, pa.data())
+            level -= 1
+        allocator.mark(pa.data(), allocator.level_shift(walk.endLevel))
+        self.CR.drop_pending()
+        self._index_tables(walk.ptes)
         # The last one is a leaf, mark that
         # self.leaves[pte.address] = pte
-        self.walks.append(walk)
+        self._keep(walk)
         self.reference_counter[pa.data()] += 1
         self.va_reference_counter[va.data()] += 1
-    
-    def add_invalid_walk(self, pagesize: str, va: VA, pa: PA, ptes: List[PTE], satp: SATP):
+
+    def _index_tables(self, ptes: List[PTE], valid: bool = True):
+        '''
+        Record the slots a walk's PTEs take, for the packed placement. For a valid walk, also the tables
+        its pointers lead to (new walks aren't sent down an invalid one).
+        '''
+        tables = self.CR.tables
+        if tables is None:
+            return
+        for i, pte in enumerate(ptes):
+            ppn = pte.get_ppn() if valid and i < len(ptes) - 1 else None
+            tables.add(pte.address, ppn << PAGE_SHIFT if ppn is not None else None)
+
+    def add_random_walks(self, n: int, pagesize: str = '4K', pas: Union[Sequence[int], None] = None,
+                         vas: Union[Sequence[int], None] = None) -> List[Union[TranslationWalk, None]]:
+        '''
+        Add n fully random walks (nothing pinned, global SATP) of the given page size, as a batch.
+        The addresses are drawn up front (see ConstraintResolver.draw_batch), and the walks are put together
+        directly instead of going through the resolver stage by stage. Their PTEs are made with the same PTE
+        methods the resolver ends on (broadcast_ppn, set_pointer, finalize), so the two paths make the same entries.
+        pas / vas = the PA / VA of each walk instead (page ranges). Walks in a row with the same VPNs above the leaf
+        (e.g. contiguous VAs) go down the same pointers, found once for the lot.
+        Returns the walks in order. A walk that runs into an existing PTE it can't share is left as None,
+        for the caller to make on the regular path.
+        The drawn table and leaf page addresses are only used if they're free (see FrameAllocator.take_leaf / take_table).
+        With the packed placement, the VPNs are picked from the existing tables as the walk goes down instead.
+        '''
+        walk_shape, mode_layout = shape(self.mode, pagesize), layout(self.mode)
+        end_level, top, levels = walk_shape.end_level, walk_shape.start_level, walk_shape.levels
+        draws = self.CR.draw_batch(n, end_level)
+        satp = self.global_satp
+        align = mode_layout.alignment_bits
+        vpn_fields = mode_layout.vpn_fields
+        vpn_shifts = [shift for shift, _ in vpn_fields]
+        pa_shift = walk_shape.page_shift  # the page offset bits
+        page_mask = walk_shape.page_mask
+        allocator, rng = self.CR.allocator, self.rng
+        pte_range = (self.CR.pte_low, self.CR.pte_high + 1)
+        packed = self.CR.tables is not None and vas is None
+        table_index, known = self.CR.tables, self.ptes
+        path_key, path = None, None  # the pointers of the last walk, by its VPNs above the leaf
+
+        walks, made = [], []
+        for k, (vpns, tables, pa_hi, pa_lo, offset) in enumerate(zip(*draws)):
+            if vas is not None:
+                vpns = [(vas[k] >> shift) & field for shift, field in vpn_fields]
+            base = satp.ppn << PAGE_SHIFT
+            ptes = []
+            first = top
+            if path and path_key == vpns[end_level + 1:]:
+                ptes = list(path)
+                base = ptes[-1].get_ppn() << PAGE_SHIFT
+                first = end_level
+            for i, level in enumerate(levels[top - first:], top - first):
+                if packed:
+                    vpn = self.CR._packed_vpn(base, level, end_level)
+                    if vpn is not None:
+                        vpns[level] = vpn
+                address = base | (vpns[level] << align)
+                pte = self.ptes.get(address)
+                if level == end_level:
+                    if pte is not None:  # the slot already has a leaf (or pointer) in it
+                        break
+                    pte = PTE(mode=self.mode)
+                    pte.address = address
+                    if pas is None:
+                        pa_hi = allocator.take_leaf(pa_hi, pa_shift, self.lower_bound, self.memory_size, rng)
+                    else:
+                        pa_hi = pas[k] & ~page_mask
+                    pte.broadcast_ppn(pa_hi >> pa_shift, end_level)
+                    pte.finalize(rng)
+                elif pte is not None:  # share the existing pointer, like the resolver would
+                    if pte.leaf or pte.get_ppn() is None or self.CR.faults(pte, False):
+                        break
+                    base = pte.get_ppn() << PAGE_SHIFT
+                else:
+                    pte = PTE(mode=self.mode)
+                    pte.address = address
+                    base = allocator.take_table(tables[i], *pte_range, rng)
+                    pte.broadcast_ppn(base >> PAGE_SHIFT)
+                    pte.set_pointer()
+                    pte.finalize(rng)
+                ptes.append(pte)
+            else:
+                if pas is None:
+                    pa_data = pa_hi | (pa_lo & page_mask & ~0xFFF) | offset
+                else:
+                    pa_data = pas[k]
+                if vas is None:
+                    # below the leaf, the VA bits carry on into the PA
+                    va_data = pa_data & page_mask
+                    for level in range(end_level, self.levels):
+                        va_data |= vpns[level] << vpn_shifts[level]
+                else:
+                    va_data = vas[k]
+                    path_key, path = vpns[end_level + 1:], ptes[:-1]
+                pa = PA(mode=self.mode)
+                pa.set(pa_data)
+                walk = TranslationWalk(self.mode, pagesize, satp, VA(va_data, self.mode), pa, ptes)
+                # What the next walks of the batch look at is registered now, the rest once for the batch
+                for pte in ptes:
+                    known.setdefault(pte.address, pte)
+                allocator.pending = []  # its new tables and leaf page, which makes them taken
+                if pas is not None:
+                    allocator.mark(pa_data, pa_shift)
+                if table_index is not None:
+                    self._index_tables(ptes)
+                    table_index.drop_pending()
+                made.append((walk, va_data, pa_data))
+                walks.append(walk)
+                continue
+            self.CR.drop_pending()
+            walks.append(None)
+        self._register_batch(made, end_level)
+        return walks
+
+    def _register_batch(self, made: List[Tuple[TranslationWalk, int, int]], end_level: int):
+        '''
+        The rest of _register for the walks add_random_walks made (with their VA and PA), in order:
+        the lookup tables and indexes nothing reads while the batch is made.
+        '''
+        vas, pas = self.vas, self.pas
+        counter, va_counter = self.reference_counter, self.va_reference_counter
+        reuse_add, pa_add, keep = self.reuse.add, self.pa_index.add, self._keep
+        for walk, va_data, pa_data in made:
+            vas[va_data] = None
+            pas[pa_data] = None
+            pa_add(pa_data, end_level)
+            level = walk.startLevel
+            for pte in walk.ptes:
+                counter[pte.address] += 1
+                reuse_add(pte.address, level, level == end_level, pa_data)
+                level -= 1
+            keep(walk)
+            counter[pa_data] += 1
+            va_counter[va_data] += 1
+
+    def add_invalid_walk(self, pagesize: str, va: VA, pa: PA, ptes: List[PTE], satp: SATP) -> InvalidTranslationWalk:
         '''
         Add a translation walk to the context.
         Meant for when it's been specced out already.
         Registers the relevant components in all the relevant lookup tables.
+        Returns the resolved walk.
         '''
         walk = InvalidTranslationWalk(self.mode, pagesize, satp, va, pa, ptes)
+        self.CR.drop_pending()
+        self.CR.check(satp, va, pa, ptes, walk.startLevel, walk.endLevel, valid=False)
         walk.resolve(CR=self.CR, pte_hashmap=self.ptes)
+        leaf = walk.ptes[-1]
+        if leaf.address is not None and self.ptes.get(leaf.address) is leaf:  # e.g. a pinned VA onto an existing leaf
+            raise Errors.InvalidConstraints(f'The invalid walk ends on the leaf at {leaf.address:#x}, which earlier walks go through')
         if va.data():
-            self.vas[va.data()] = va
+            self.vas[va.data()] = None
             self.va_reference_counter[va.data()] += 1
-        # self.address_table[pa.data()] = pa
-        # self.pas[pa.data()] = pa
-        self.satps.append(satp)
         for pte in ptes:
             if pte.address:
                 # may need more checks in terms of marking things
-                self.address_table[pte.address] = pte 
                 self.ptes[pte.address] = pte
                 self.reference_counter[pte.address] += 1
+                self.CR.allocator.mark(pte.address, PAGE_SHIFT)
+        if pa.data() is not None:
+            self.CR.allocator.mark(pa.data(), self.CR.allocator.level_shift(walk.endLevel))
+        self.CR.drop_pending()
+        placed = [pte for pte in ptes if pte.address is not None]
+        if placed:
+            self.CR.faulting.add(placed[-1].address)  # where it stopped: no valid walk goes through that one
+        self._index_tables(placed, valid=False)
         # The last one is a leaf, mark that
         # self.leaves[pte.address] = pte
-        self.walks.append(walk)
+        self._keep(walk)
         # self.reference_counter[pa.data()] += 1
+        return walk
 
-    def add_test_case(self, same_va_pa: float = 0, reuse_pte: float = 0, aliasing: float = 0, pagesize='4K', va=None, pa=None, **kwargs):
+    def _reuse_pools(self, pagesize: str, satp: SATP, drawn_va_pa: bool = False, weight: str = 'uniform',
+                     leaf: bool = True) -> List[List[int]]:
+        '''
+        The PTEs reuse_pte can pick for a walk of the page size, by their index in the walk, to draw from with the
+        weight (see ReuseIndex). drawn_va_pa: only the root table's pointers (see _pick_reuse).
+        leaf=False: no leaves (the walk gets an error on its leaf, which must be its own).
+        '''
+        end_level = MODE_PAGESIZE_LEVEL_MAP[self.mode][pagesize]
+        root = satp.ppn << PAGE_SHIFT if satp.ppn is not None else None
+        keys = [(level, level == end_level, root if level == self.levels - 1 else None) for level in range(self.levels - 1, end_level - 1, -1)]
+        if drawn_va_pa:
+            keys = keys[:1] if len(keys) > 1 else []
+        if not leaf:
+            keys = [key for key in keys if not key[1]]
+        return self.reuse.lists(keys, weight)
+
+    def _pick_reuse(self, pagesize: str, satp: SATP, va: VA, pa: PA, aliasing: bool, drawn_va_pa: bool = False,
+                    weight: str = 'uniform', leaf: bool = True) -> Tuple[int, PTE]:
+        '''
+        For reuse_pte: a PTE of the valid walks so far, and its index in a walk of the page size. The PTEs at the levels
+        the walk goes through, in the same role (pointer or leaf), are weighted as given (see indexes.REUSE_WEIGHTS) --
+        at the top level, the ones in the walk's root table. One draw, unless the VA or PA pinned so far rule the drawn
+        one out: then the pick is among the ones that fit (see ConstraintResolver.fits), weighted the same.
+        With aliasing, a reused leaf brings its PA along.
+        drawn_va_pa = VA = PA is drawn after the pick, through the reused PTE (see ConstraintResolver.identity_address).
+        Any address can start with the pointers of the root table, so the pick is among the ones with addresses in the memory range
+        and a way down (see ConstraintResolver.has_identity_path).
+        leaf=False: pointers only (see _reuse_pools).
+        '''
+        end_level = MODE_PAGESIZE_LEVEL_MAP[self.mode][pagesize]
+        top = self.levels - 1
+        pools = self._reuse_pools(pagesize, satp, drawn_va_pa, weight, leaf)
+        total = sum(len(pool) for pool in pools)
+        if not total:
+            if drawn_va_pa:
+                raise Errors.InvalidConstraints(f'No root table pointer of the walks so far can be reused in a {pagesize} walk with VA = PA')
+            if not leaf:
+                raise Errors.InvalidConstraints(f'No pointer of the walks so far can be reused in a {pagesize} walk with an error on its leaf')
+            raise Errors.InvalidConstraints(f'No PTE of the walks so far can be reused in a {pagesize} walk')
+        shift = layout(self.mode).vpn_fields[top][0]
+
+        def fits(index: int, address: int) -> bool:
+            if drawn_va_pa:
+                slot = (address & PAGE_OFFSET_MASK) >> self.CR.ALIGNMENT_BITS
+                first = slot << shift
+                if first >= self.memory_size or first + (1 << shift) <= self.lower_bound:
+                    return False
+                if not self.CR.has_identity_path(address & ~PAGE_OFFSET_MASK, end_level, slot):
+                    return False
+            return self.CR.fits(self.ptes[address], top - index, end_level, va, None if aliasing else pa)
+
+        pick = self.rng.randrange(total)
+        for index, pool in enumerate(pools):
+            if pick < len(pool):
+                break
+            pick -= len(pool)
+        address = pool[pick]
+        if not fits(index, address):
+            if self.stats is not None:
+                self.stats.count('reuse_fallbacks')
+            if weight != 'uniform':  # each PTE once, for its count to weigh it
+                pools = self._reuse_pools(pagesize, satp, drawn_va_pa, leaf=leaf)
+            candidates = [(i, address) for i, pool in enumerate(pools) for address in pool if fits(i, address)]
+            if not candidates:
+                if drawn_va_pa:
+                    raise Errors.InvalidConstraints(f'No root table pointer of the walks so far covers VA = PA addresses in the memory range')
+                raise Errors.InvalidConstraints(f'None of the PTEs of the walks so far fit the VA / PA of this {pagesize} walk')
+            counts = self.reuse.counts
+            if weight == 'hot':
+                index, address = self.rng.choices(candidates, weights=[counts[address] for _, address in candidates])[0]
+            else:
+                if weight == 'cold':
+                    lowest = min(counts[address] for _, address in candidates)
+                    candidates = [(i, address) for i, address in candidates if counts[address] == lowest]
+                index, address = self.rng.choice(candidates)
+        return index, self.ptes[address]
+
+    def add_test_case(self, same_va_pa: float = 0, reuse_pte: float = 0, aliasing: float = 0, pagesize='4K', va=None, pa=None, **kwargs) -> TranslationWalk:
         '''
         Add a test case, with probabilistic usage of 'Testing Knowledge' cases.
         Made in a way that in the future passing JSON into it will be easy. (Through the kwargs)
         Probabilities from 0 to 1 (float).
+        Returns the resulting walk.
 
-        TODO: Clean this up a bit. Not much that can be eliminated, but stuff should be able to be moved around and parcelled out.
+        Compiles the test case each call: to add the same one many times, compile it once and use add_planned.
         '''
+        case = {'same_va_pa': same_va_pa, 'reuse_pte': reuse_pte, 'aliasing': aliasing, 'pagesize': pagesize, 'va': va, 'pa': pa, **kwargs}
+        return self.add_planned(CasePlan(case, self.mode))
 
-        # Work out our flags
-        same_va_pa: int = resolve_flag(same_va_pa)
-        aliasing: int = resolve_flag(aliasing)
-        reuse_pte: int = resolve_flag(reuse_pte)
-
-        # Change (Jun26) -- clean up the SATP usage.
-        # Reuse should no longer be necessary since it's the default
-        satp_data = kwargs.get('satp', {})
-        if type(satp_data) == int:
-            satp_data = { 'ppn' : satp_data }
+    def add_planned(self, plan: CasePlan, pa=None, va=None) -> TranslationWalk:
+        '''
+        Add a walk of a compiled test case (see plans.py). pa / va override the plan's PA / VA (e.g. for page ranges).
+        Returns the resulting walk.
+        '''
+        rng = self.rng
 
-        if ppn := kwargs.get('satp.ppn'):
-            satp_data['ppn'] = ppn
+        # Work out our flags
+        same_va_pa: int = draw(plan.same_va_pa, rng)
+        aliasing: int = draw(plan.aliasing, rng)
+        reuse_pte: int = draw(plan.reuse_pte, rng)
+        errors = plan.draw_errors(rng) or (None, ) * 4
+        err = any(errors)  # the leaf gets an error: reuse_pte doesn't pick a leaf then
 
-        if not satp_data:
+        if plan.satp is None:
             satp = self.global_satp
         else:
-            ppn = satp_data.get('ppn')
-            asid = kwargs.get('satp.asid') or satp_data.get('asid') or 0
-            satp = SATP(mode=self.mode, asid=asid, ppn=ppn)        
-
+            satp = SATP(mode=self.mode, asid=plan.satp[1], ppn=plan.satp[0])
 
         # Step one: create and load everything from the test case
-        if type(pa) == dict:
-            _pa = PA(mode=self.mode)
-            _pa.offset = pa.get('offset') # unpack reflexive
-            _pa.ppn = pa.get('ppn') # unpack reflexive
-            pa = _pa
-        if type(va) == dict:
-            _va = VA(mode=self.mode)
-            _va.offset = va.get('offset')
-
-            # VA VPN causes potential issues with array copy when defined. Adjusting for that here
-            _va.vpn = va.get('vpn', []).copy()
-            va = _va
-
-        if (type(pagesize) == list):
-            pagesize = random.choice(pagesize)
-        
+        if pa is None:
+            pa = plan.pa if plan.pa_template is None else plan.pa_template.clone()
+        if va is None:
+            va = plan.va if plan.va_template is None else plan.va_template.clone()
+
+        if reuse_pte and plan.pagesize[0] == CHOICE:
+            # Only the page sizes with PTEs to reuse
+            drawn_va_pa = same_va_pa and not aliasing and not (pa.data() if type(pa) == PA else pa)
+            pagesizes = [pagesize for pagesize in plan.pagesize[1] if any(self._reuse_pools(pagesize, satp, drawn_va_pa, leaf=not err))]
+            pagesize = rng.choice(pagesizes or plan.pagesize[1])
+        else:
+            pagesize = draw(plan.pagesize, rng)
+
         if type(pa) == PA:
             pass
         elif aliasing:  # reuse an existing PA in the system
             # -- can cause issues when used with PTE reuse, so that gets a special treatment
-            pa_addr = random.sample(self.pas.keys(), 1)[0]
-            pa = self.pas[pa_addr]
-        elif pa in self.pas.keys():
-            pa = self.pas[pa]
+            region = plan.alias_region
+            if same_va_pa:  # the VA is the PA: only the PAs a VA can hold
+                va_end = self.CR.layout.va_mask + 1
+                region = (region[0], min(region[1], va_end)) if region else (0, va_end)
+            pa_addr = self.pa_index.pick(rng, plan.alias_level, region)
+            if pa_addr is None:
+                raise Errors.InvalidConstraints('No PA of the walks so far to alias' + (' with the given alias_pagesize / alias_region' if plan.alias_level is not None or plan.alias_region else ''))
+            pa = PA(mode=self.mode, data=pa_addr)
         else:
             pa = PA(mode=self.mode, data=pa)
 
@@ -238,149 +527,151 @@ class Context:
         else:
             if same_va_pa and pa.data():
                 va = pa.data()
-            if va in self.vas.keys():
-                va = self.vas[va]
-            else:
-                va = VA(mode=self.mode, data=va)
-
-        if same_va_pa:  # same VA and PA
-            if pa.data() and va.data():
-                pass
-            elif pa.data():
-                va.set(pa.data())
-            else: # TODO: bounds checking!
-                va.set(self.random_address())
-                pa.set(va.data())
-        
-
+            va = VA(mode=self.mode, data=va)
 
         ptes = [None] * self.num_ptes(pagesize)
-        if reuse_pte:  # for now: not allowed with specifying PTE data
-            
-            # Two issues here:
-            # (1) it has to be handled as a leaf or non-leaf accordingly
-            # (2) it needs to be reachable through the SATP if it's the first level
-            for i in range(PTE_REUSE_MAX_ATTEMPTS):
-                random_walk = random.choice(self.walks)
-                rwalk_ptes = random_walk.ptes
-
-
-                max_pte_walk = len(rwalk_ptes) - 1
-                leaf_index = self.num_ptes(pagesize) - 1
-                selection_index = random.randint(0, max_pte_walk)
-
-                if selection_index == max_pte_walk:
-                    if max_pte_walk == leaf_index:
-                        placed_location_index = leaf_index
-                        if aliasing:
-                            pa_addr = random_walk.pa.data() # fallback for picking a leaf
-                            pa = self.pas[pa_addr]
-                    else:
-                        continue
-                elif leaf_index == 0:
-                    continue
-                else:
-                    placed_location_index = random.randint(0, leaf_index - 1)
+        # same VA and PA: with no PA yet, both are drawn below (with reuse_pte, after the pick, to go through it)
+        drawn_va_pa = same_va_pa and not pa.data()
+        if same_va_pa and pa.data() and not va.data():
+            va.set(pa.data())
 
-                random_pte_addr = rwalk_ptes[selection_index].address
-                ptes[placed_location_index] = self.ptes[random_pte_addr]
-                break
-            else:
-                raise Errors.InvalidConstraints('Could not find a suitable PTE for reuse!')
-        
-        elif kwargs.get('ptes'):
-            for i, pte_attrs in enumerate(kwargs.get('ptes')):
-                address = resolve_int(pte_attrs.get('address'))
+        if reuse_pte:  # for now: not allowed with specifying PTE data
+            index, pte = self._pick_reuse(pagesize, satp, va, pa, aliasing, drawn_va_pa, plan.reuse_weight, leaf=not err)
+            ptes[index] = pte
+            if aliasing and index == len(ptes) - 1:
+                pa = PA(mode=self.mode, data=self.reuse.leaf_pas[pte.address])  # a reused leaf brings its PA along
+
+        if drawn_va_pa:  # TODO: bounds checking!
+            root_slot = (ptes[0].address & PAGE_OFFSET_MASK) >> self.CR.ALIGNMENT_BITS if reuse_pte else None
+            root = satp.ppn << PAGE_SHIFT if satp.ppn is not None else None
+            address = self.random_address()
+            va.set(self.CR.identity_address(root, MODE_PAGESIZE_LEVEL_MAP[self.mode][pagesize], address, root_slot))
+            pa.set(va.data())
+
+        if plan.ptes and not reuse_pte:
+            for i, template in enumerate(plan.ptes):
+                address = draw(template.address, rng)
                 if address in self.ptes.keys(): # check to make sure that we reuse, and don't double define
                     ptes[i] = self.ptes[address]
                 else:
                     ptes[i] = PTE(mode=self.mode)
                     ptes[i].address = address
-                    if ppns := pte_attrs.get('ppns'):
-                        ptes[i].ppn = ppns
-
-                flags = pte_attrs.get('attributes', {})
-
-                for flag, value in flags.items():
-                    setattr(ptes[i].attributes, flag, resolve_flag(value))
+                    if template.ppns:
+                        ptes[i].ppn = template.ppns
+                template.apply_flags(ptes[i], rng)
 
         # inialize all remaining undefined PTEs
         for i in range(len(ptes)):
             if ptes[i] == None:
                 ptes[i] = PTE(mode=self.mode)
 
-        if errs := kwargs.get('errors'):
-            use_errs = {}
-            prob = errs.get('p')
-            err = False
-            if prob:
-                if resolve_flag(prob): # Do a distribution choice
-                    errtype = random.choices(errs.get('types'), errs.get('weights'), k=1)[0]
-                    for error in ('mark_invalid', 'write_no_read', 'leaf_as_pointer', 'uncleared_superpage'):
-                        use_errs[error] = 0
-                    use_errs[errtype] = 1
-            else:
-                use_errs = errs
-            # V = 0
-
-            # TODO: flex locations of bad PTE
-            if resolve_flag(use_errs.get('mark_invalid')):
-                err = True
-                ptes[-1].attributes.V = 0
-            # W=1, R=0, on the leaf
-            if resolve_flag(use_errs.get('write_no_read')):
-                err = True
-                ptes[-1].attributes.R = 0 
-                ptes[-1].attributes.W = 1
-            # Global mapping followed by G=0
-            # if resolve_flag(use_errs.get('global_nonglobal')):
-            #     err = True
-            #     ptes[-2].attributes.G = 1 
-            #     ptes[-1].attributes.G = 0
-            # Leaf marked as pointer
-            if resolve_flag(use_errs.get('leaf_as_pointer')):
-                err = True
-                ptes[-1].attributes.X = 0
-                ptes[-1].attributes.W = 0
-                ptes[-1].attributes.R = 0 
-            # Superpage has data set
-            if resolve_flag(use_errs.get('uncleared_superpage')):
-                err = True
-                ptes[-1].ppn[0] = random.randint(10, 200)
-            
-            if err:
-                self.add_invalid_walk(pagesize, va, pa, ptes, satp)
-            else:
-                self.add_walk(pagesize, va, pa, ptes, satp)
-        else:
-            self.add_walk(pagesize, va, pa, ptes, satp)
-        
+        mark_invalid, write_no_read, leaf_as_pointer, uncleared_superpage = errors
+        if err and self.ptes.get(ptes[-1].address) is ptes[-1]:
+            raise Errors.InvalidConstraints(f'The error would go on the leaf at {ptes[-1].address:#x}, which earlier walks go through')
+        # V = 0
+        # TODO: flex locations of bad PTE
+        if mark_invalid:
+            ptes[-1].attributes.V = 0
+        # W=1, R=0, on the leaf
+        if write_no_read:
+            ptes[-1].attributes.R = 0
+            ptes[-1].attributes.W = 1
+        # Global mapping followed by G=0
+        # if global_nonglobal:
+        #     err = True
+        #     ptes[-2].attributes.G = 1
+        #     ptes[-1].attributes.G = 0
+        # Leaf marked as pointer
+        if leaf_as_pointer:
+            ptes[-1].attributes.X = 0
+            ptes[-1].attributes.W = 0
+            ptes[-1].attributes.R = 0
+        # Superpage has data set
+        if uncleared_superpage:
+            ptes[-1].ppn[0] = rng.randint(10, 200)
+
+        if err:
+            return self.add_invalid_walk(pagesize, va, pa, ptes, satp)
+        return self.add_walk(pagesize, va, pa, ptes, satp)
+
+    def lookup_tables(self) -> dict:
+        '''
+        What merge takes from a Context: the lookup tables, reference counters and placement state,
+        without the walks or the rest of the resolver. This is what a shard sends back to the parent.
+        '''
+        return {
+            'ptes': self.ptes,
+            'vas': self.vas,
+            'pas': self.pas,
+            'pa_index': self.pa_index,
+            'reference_counter': self.reference_counter,
+            'va_reference_counter': self.va_reference_counter,
+            'allocator': self.CR.allocator,
+            'faulting': self.CR.faulting,
+            'tables': self.CR.tables,
+            'reuse': self.reuse,
+        }
+
+    def merge(self, other: dict):
+        '''
+        Merge in the lookup_tables() of a Context generated separately (a shard) over the same SATPs.
+        The walks themselves are not added -- use _keep in the wanted order.
+        Raises InvalidConstraints if both define a PTE at the same address with different contents.
+        '''
+        for address, pte in other['ptes'].items():
+            mine = self.ptes.get(address)
+            if mine is None:
+                self.ptes[address] = pte
+            elif mine is not pte and mine.data() != pte.data():
+                raise Errors.InvalidConstraints(f'Shards defined conflicting PTEs at {address:#x}')
+        self.vas.update(other['vas'])
+        self.pas.update(other['pas'])
+        self.pa_index.merge(other['pa_index'])
+        for address, count in other['reference_counter'].items():
+            self.reference_counter[address] += count
+        for address, count in other['va_reference_counter'].items():
+            self.va_reference_counter[address] += count
+        self.CR.allocator.merge(other['allocator'])
+        self.CR.faulting |= other['faulting']
+        if self.CR.tables is not None and other['tables'] is not None:
+            self.CR.tables.merge(other['tables'])
+        self.reuse.merge(other['reuse'])
+
     def dump(self, filename: str):
         ''' Export the full things to a JSON '''
         with open(filename, 'w') as f:
-            json.dump(self, f, default=lambda x: x.__dict__)
+            json.dump(self, f, default=_dump_default)
 
-    def jsonify(self) -> dict:
-        ''' Return a minimal JSON friendly thingy'''
+    def jsonify_header(self) -> dict:
+        ''' The context level fields of the JSON output (everything except the walks) '''
         return {
             'mode': self.mode,
+            'seed': self.seed,
             'lower_bound': self.lower_bound,
             'memory_size': self.memory_size,
             'pte_min': self.pte_min, 
             'pte_max': self.pte_max, 
             'global_satp': self.global_satp.jsonify(),
-            'walks': [walk.jsonify() for walk in self.walks]
         }
 
+    def jsonify(self) -> dict:
+        ''' Return a minimal JSON friendly thingy. Walks going through the same PTE share its dict '''
+        pte_memo = {}
+        return {
+            **self.jsonify_header(),
+            'walks': [walk.jsonify(pte_memo) for walk in self.walks]
+        }
+
+    def jsonify_normalized(self) -> dict:
+        ''' jsonify, with every PTE and SATP once and the walks referring to them by index (see WalkStore.jsonify) '''
+        return {**self.jsonify_header(), **self.walks.jsonify()}
+
     def jsonify_color(self) -> dict:
+        pte_memo = {}
+        va_counter, pa_counter = self.va_reference_counter, self.reference_counter
         return {
-            'mode': self.mode,
-            'lower_bound': self.lower_bound,
-            'memory_size': self.memory_size,
-            'pte_min': self.pte_min, 
-            'pte_max': self.pte_max,
-            'global_satp': self.global_satp.jsonify(),
-            'walks': [walk.jsonify_color(self.va_reference_counter, self.reference_counter) for walk in self.walks]
+            **self.jsonify_header(),
+            'walks': [walk.jsonify_color(va_counter, pa_counter, pte_memo) for walk in self.walks]
         }
 
     def __repr__(self):
@@ -390,6 +681,7 @@ class Context:
         satp_digits = num_hex_digits(44 if self.mode != 32 else 22) + 2
 
         print('ContextManager Trace')
+        print(f'Seed: {self.seed}')
         print(
             f'Mode: {self.mode}, MemSize: {self.memory_size:#x} (={addr_to_memsize(self.memory_size)}). Max VA = {2**self.mode - 1:#0x}'
         )
@@ -423,15 +715,28 @@ class Context:
         print()
 
 
-def ContextFromJSON(json_data: Union[str, dict]) -> Context:
-    ''' Load a JSON5 test config '''
+def _dump_default(obj):
+    ''' Fallback for Context.dump: the slotted types have no __dict__, they go through jsonify or their slots '''
+    if isinstance(obj, (set, frozenset)):  # the allocator and table index maps
+        return sorted(obj)
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    if hasattr(obj, 'jsonify'):
+        return obj.jsonify()
+    return {name: getattr(obj, name) for name in obj.__slots__}
+
+
+def load_json5(json_data: Union[str, dict]) -> dict:
+    ''' Load the test config params, from a JSON5 filename or an already parsed dict '''
     if type(json_data) == str:
         filename = json_data
         with open(filename) as f:
-            params = json5.load(f)
-    else:
-        params = json_data
+            return fastjson5.load(f)
+    return json_data
+
 
+def ContextFromParams(params: dict, keep_walks: bool = True) -> Context:
+    ''' Create the (empty) Context described by the top level of the test config '''
     satp_data = params.get('satp', {})
     if type(satp_data) == int:
         satp_data = { 'ppn' : satp_data }
@@ -445,68 +750,132 @@ def ContextFromJSON(json_data: Union[str, dict]) -> Context:
         global_satp = SATP(mode=params.get('mode'), asid=satp_data.get('asid'), ppn=satp_data['ppn'])
         # ppn = params.get('satp.ppn') or satp_data.get('ppn') or 0
 
-    mgr = Context(params.get('memory_size'), params.get('mode'), params.get('lower_bound', 0), params.get('pte_min', 0), params.get('pte_max'), global_satp)
+    return Context(params.get('memory_size'), params.get('mode'), params.get('lower_bound', 0), params.get('pte_min', 0), params.get('pte_max'), global_satp, keep_walks, params.get('seed'), params.get('pte_placement', 'random'))
 
-    test_cases = params.get('test_cases', [])
 
+# What a valid walk's resolve raises if it ends up on a PTE it faults on: the constraints couldn't be met
+WALK_ERRORS = (Errors.SuperPageNotCleared, Errors.InvalidConstraints, Errors.PTEMarkedInvalid, Errors.WriteNoReadError,
+               Errors.LeafMarkedAsPointer, Errors.UnexpectedLeaf, Errors.InvalidDAU, Errors.NonGlobalAfterGlobal,
+               Errors.OutOfMemory)
 
-    for test_case in test_cases:
-        # Handle the 'special' control
-
-        indices = []
-        special_args = {}
-
-        if special := test_case.get('special'):
-            indices = set(s.get('index') for s in special)
-            for case in special:
-                special_args[case.get('index')] = case
-
-        if rg := test_case.get('page_range'): # Walrus
-            # We do a  mapping of the first page address
-            start = rg.get('start', mgr.lower_bound)
-            end   = rg.get('end', mgr.memory_size)
-            step  = rg.get('step', None)
-            num_pages = rg.get('num_pages', None)
-            
-            current_addr = start
-            n_iters = 0
-            while current_addr < end and (num_pages is None or n_iters < num_pages):
-                if n_iters in indices:
-                    use_case = {**test_case, **special_args.get(n_iters, {})}
-                else:
-                    use_case = test_case
-                for i in range(ADD_CASE_MAX_ATTEMPTS): # how many failures we will try before we give up
-                    try:
-                        mgr.add_test_case(**use_case, pa=current_addr)
-                        break
-                    except (Errors.SuperPageNotCleared, Errors.InvalidConstraints):
-                        pass
-                else:
-                    raise Errors.InvalidConstraints(f"Couldn't satisfy constraints after {ADD_CASE_MAX_ATTEMPTS} tries (pg range)")
-                current_addr += step or PAGESIZE_INT_MAP[mgr.walks[-1].pagesize]
-                n_iters += 1
 
-        else:
-            for i in range(test_case.get('repeats', 1)):
-                if i in indices:
-                    use_case = {**test_case, **special_args.get(i, {})}
-                else:
-                    use_case = test_case
-                
-                for _ in range(ADD_CASE_MAX_ATTEMPTS):
-                    try:
-                        mgr.add_test_case(**use_case)
-                        break
-                    except (Errors.SuperPageNotCleared, Errors.InvalidConstraints):
-                        pass
-                else:
-                    raise Errors.InvalidConstraints(f"Couldn't satisfy constraints after {ADD_CASE_MAX_ATTEMPTS} tries (main flow)")
+def _add_case(mgr: Context, plan: CasePlan, flow: str, pa=None, va=None) -> TranslationWalk:
+    ''' Add a walk of a test case to the context. Constraints it can't meet fail it right away, with the reason '''
+    try:
+        return mgr.add_planned(plan, pa, va)
+    except WALK_ERRORS as e:
+        if mgr.stats is not None:
+            mgr.stats.count('failures')
+        raise Errors.InvalidConstraints(f"Couldn't satisfy constraints ({flow}): {str(e) or type(e).__name__}") from e
 
 
+def iter_walks(mgr: Context, params: dict, substreams: bool = True, only: Union[Set[int], None] = None) -> Iterator[TranslationWalk]:
+    '''
+    Generate the test cases of the config into the context, one at a time, yielding each walk as it's made.
+    Use with a Context that doesn't keep its walks to stream very large configs.
+    Each test case (and each of its special indices) is compiled once into a CasePlan, and repeated from that.
+    substreams = each test case draws from its own random stream (see Context.use_substream)
+    only = the indices of the test cases to generate (default: all)
+    '''
+    test_cases = params.get('test_cases', [])
 
+    for index, test_case in enumerate(test_cases):
+        if only is not None and index not in only:
+            continue
+        if substreams:
+            mgr.use_substream(index)
+
+        plan = CasePlan(test_case, mgr.mode)
+
+        # Handle the 'special' control: index -> plan of the test case with the special's overrides
+        special_plans = {}
+        for case in test_case.get('special') or ():
+            special_plans[case.get('index')] = CasePlan({**test_case, **case}, mgr.mode)
+
+        walks = _case_walks(mgr, test_case, plan, special_plans)
+        yield from walks if mgr.stats is None else mgr.stats.track(index, walks)
+
+
+def _count_fallback(mgr: Context):
+    if mgr.stats is not None:
+        mgr.stats.count('batch_fallbacks')
+
+
+def _case_walks(mgr: Context, test_case: dict, plan: CasePlan, special_plans: Dict[int, CasePlan]) -> Iterator[TranslationWalk]:
+    ''' The walks of a test case (see iter_walks) '''
+    if rg := test_case.get('page_range'): # Walrus
+        # We do a  mapping of the first page address
+        start = rg.get('start', mgr.lower_bound)
+        end   = rg.get('end', mgr.memory_size)
+        step  = rg.get('step', None)
+        num_pages = rg.get('num_pages', None)
+        va_start = rg.get('va', None)  # contiguous VAs from here, instead of random ones
+
+        if test_case.keys() <= PLAIN_CASE_KEYS | {'page_range'} and plan.pagesize[0] == FIXED \
+                and all(special.pagesize == plan.pagesize for special in special_plans.values()):
+            # Batches of pages, with the special indices going through the regular path
+            step = step or PAGESIZE_INT_MAP[plan.pagesize[1]]
+            pages = range(start, end, step)
+            count = len(pages) if num_pages is None else min(len(pages), num_pages)
+            vas = None if va_start is None else range(va_start, va_start + count * step, step)
+            i = 0
+            while i < count:
+                if i in special_plans:
+                    yield _add_case(mgr, special_plans[i], 'pg range', pa=pages[i], va=vas and vas[i])
+                    i += 1
+                    continue
+                stop = min([count, i + RANDOM_BATCH_SIZE] + [x for x in special_plans if x > i])
+                batch = mgr.add_random_walks(stop - i, plan.pagesize[1], pages[i:stop], vas and vas[i:stop])
+                for k, walk in enumerate(batch, i):
+                    if walk is None:
+                        _count_fallback(mgr)
+                        walk = _add_case(mgr, plan, 'pg range', pa=pages[k], va=vas and vas[k])
+                    yield walk
+                i = stop
+            return
+
+        current_addr = start
+        n_iters = 0
+        while current_addr < end and (num_pages is None or n_iters < num_pages):
+            va = None if va_start is None else va_start + current_addr - start
+            walk = _add_case(mgr, special_plans.get(n_iters, plan), 'pg range', pa=current_addr, va=va)
+            yield walk
+            current_addr += step or PAGESIZE_INT_MAP[walk.pagesize]
+            n_iters += 1
+
+    elif test_case.keys() <= PLAIN_CASE_KEYS and type(test_case.get('pagesize', '4K')) == str:
+        # Batches of random walks, with the special indices going through the regular path
+        repeats = test_case.get('repeats', 1)
+        i = 0
+        while i < repeats:
+            if i in special_plans:
+                yield _add_case(mgr, special_plans[i], 'main flow')
+                i += 1
+                continue
+            end = min([repeats, i + RANDOM_BATCH_SIZE] + [x for x in special_plans if x > i])
+            for walk in mgr.add_random_walks(end - i, test_case.get('pagesize', '4K')):
+                if walk is None:
+                    _count_fallback(mgr)
+                    walk = _add_case(mgr, plan, 'main flow')
+                yield walk
+            i = end
+
+    else:
+        for i in range(test_case.get('repeats', 1)):
+            yield _add_case(mgr, special_plans.get(i, plan), 'main flow')
+
+
+def ContextFromJSON(json_data: Union[str, dict], profile: bool = False) -> Context:
+    ''' Load a JSON5 test config. profile = record where the time goes, in mgr.stats (see Context.profile) '''
+    params = load_json5(json_data)
+    mgr = ContextFromParams(params)
+    if profile:
+        mgr.profile()
+    for _ in iter_walks(mgr, params):
+        pass
     return mgr
 
 def ContextFromJSON5(json5_data: str) -> Context:
     ''' Context from a JSON5 string '''
-    data = json5.loads(json5_data)
+    data = fastjson5.loads(json5_data)
     return ContextFromJSON(data)
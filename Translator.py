@@ -9,14 +9,18 @@ May 13th: Change to CR to allow for memory bounds
 
 import math
 import random
+import time
 
 from typing import List, Tuple, Union
 
 from core_types import PA, VA, PTE, SATP
+from layouts import shape
 
 from utils import num_hex_digits
 
 from ConstraintResolver import ConstraintResolver
+from constants import (ERROR_LEAF_AS_POINTER, ERROR_NON_GLOBAL_AFTER_GLOBAL, ERROR_PTE_INVALID, ERROR_SUPERPAGE_NOT_CLEARED,
+                       ERROR_WRITE_NO_READ)
 from simulator_errors import Errors
 
 arch = "RV32"
@@ -37,6 +41,7 @@ class TranslationWalk:
     # pa = PA()
     startLevel = 3
     endLevel = 0
+    valid = True  # walks can share its leaf
 
     # TODO: check pagesize valid
     def __init__(self,
@@ -52,25 +57,26 @@ class TranslationWalk:
         self.va = va
         self.pa = pa
         self.ptes = ptes
-        self.startLevel = self.calculateStartLevel(mode, pagesize)
-        self.endLevel = self.calculateEndLevel(mode, pagesize)
+        walk_shape = shape(mode, pagesize)
+        self.startLevel = walk_shape.start_level
+        self.endLevel = walk_shape.end_level
 
     def calculateStartLevel(self, mode, pagesize):
-        if mode == 32:
-            self.startLevel = 1
-        if mode == 39:
-            self.startLevel = 2
-        if mode == 48:
-            self.startLevel = 3
+        self.startLevel = shape(mode, pagesize).start_level
         return self.startLevel
 
     def calculateEndLevel(self, mode, pagesize):
-        if mode == 32:
-            self.endLevel = 0 if (pagesize == '4K') else 1
-        if mode == 39:
-            self.endLevel = 0 if (pagesize == '4K') else 1 if (pagesize == '2M') else 2
-        if mode == 48:
-            self.endLevel = 0 if (pagesize == '4K') else 1 if (pagesize == '2M') else 2 if (pagesize == '1G') else 3
+        self.endLevel = shape(mode, pagesize).end_level
+        return self.endLevel
+
+    def _packing_level(self, index: int) -> int:
+        '''
+        For the packed placement: the lowest level the walk can go down to through the existing tables, from ptes[index] on.
+        That's the leaf, unless a PTE further down has a pinned address -- the one above it has to be a new pointer.
+        '''
+        for i in range(index + 1, len(self.ptes)):
+            if self.ptes[i].address is not None:
+                return self.startLevel - i + 1
         return self.endLevel
 
     def resolve(self, CR: ConstraintResolver, pte_hashmap: Union[dict, None] = None):
@@ -89,7 +95,7 @@ class TranslationWalk:
 
         # global_flag = False # if this is set, then we need to assert that subsequent levels are marked as global, I think
         # First: Deal with SATP one
-        self.ptes[0].address = CR.resolve(self.satp, self.va, self.ptes[0].address, self.startLevel)
+        self.ptes[0].address = CR.resolve(self.satp, self.va, self.ptes[0].address, self.startLevel, self._packing_level(0), self)
         if self.ptes[0].address in pte_hashmap.keys():
             self.ptes[0] = pte_hashmap[self.ptes[0].address]
 
@@ -97,11 +103,10 @@ class TranslationWalk:
 
         # Intermediate PTEs
         for index, level in enumerate(range(self.startLevel - 1, self.endLevel - 1, -1)):
-            self.ptes[index + 1].address = CR.resolve(self.ptes[index], self.va, self.ptes[index + 1].address, level)
+            self.ptes[index + 1].address = CR.resolve(self.ptes[index], self.va, self.ptes[index + 1].address, level, self._packing_level(index + 1), self)
             if self.ptes[index + 1].address in pte_hashmap.keys():
                 self.ptes[index + 1] = pte_hashmap[self.ptes[index + 1].address]
-            else:
-                self.ptes[index].set_pointer()
+            self.ptes[index].set_pointer()  # also when the next one exists already (e.g. a new pointer to a reused table)
 
             # global_flag = self.ptes[index].assert_global(global_flag)
             self.ptes[index].assert_pointer()
@@ -113,8 +118,13 @@ class TranslationWalk:
 
         self.ptes[-1].validate_leaf()
 
+        stats = CR.stats
+        if stats is not None:
+            start = time.perf_counter()
         for i in range(len(self.ptes)):
-            self.ptes[i].finalize()
+            self.ptes[i].finalize(CR.rng)
+        if stats is not None:
+            stats.add('finalize', time.perf_counter() - start)
 
         # global_flag = self.ptes[-1].assert_global(global_flag)
         # assert self.va.data() != None, self.display()
@@ -133,40 +143,59 @@ class TranslationWalk:
         print('------------------------------------------------------------------------')
         print()
 
-    def jsonify(self):
+    def jsonify(self, pte_memo: Union[dict, None] = None):
+        '''
+        pte_memo = a dict shared by the walks of one pass over the context (see Context.jsonify), so that
+        the PTEs many walks go through (the upper levels) are converted once, and shared in the output.
+        '''
         d = {}
         d['mode'] = self.mode
         d['startLevel'] = self.startLevel
         d['endLevel'] = self.endLevel
-        d["ptes"] = [pte.jsonify() for pte in self.ptes]
+        if pte_memo is None:
+            d["ptes"] = [pte.jsonify() for pte in self.ptes]
+        else:
+            d["ptes"] = ptes = []
+            for pte in self.ptes:
+                pte_json = pte_memo.get(id(pte))
+                if pte_json is None:
+                    pte_json = pte_memo[id(pte)] = pte.jsonify()
+                ptes.append(pte_json)
         d['va'] = self.va.jsonify()
         d['pa'] = self.pa.jsonify()
         d['satp'] = self.satp.jsonify()
         return d
 
-    def jsonify_color(self, va_ref_counter: dict, pa_ref_counter: dict):
+    def jsonify_color(self, va_ref_counter: dict, pa_ref_counter: dict, pte_memo: Union[dict, None] = None):
+        ''' jsonify, with the reuse flags. The counters are only read (they're the context's, maybe still growing) '''
         d = {}
         d['mode'] = self.mode
         d['startLevel'] = self.startLevel
         d['endLevel'] = self.endLevel
-        d["ptes"] = [pte.jsonify() for pte in self.ptes]
-        d['va'] = self.va.jsonify()
-        d['pa'] = self.pa.jsonify()
+        d["ptes"] = ptes = []
+        for pte in self.ptes:
+            pte_json = pte_memo.get(id(pte)) if pte_memo is not None else None
+            if pte_json is None:
+                pte_json = pte.jsonify()
+                if pa_ref_counter.get(pte.address, 0) > 1:
+                    pte_json['reuse'] = True
+                if pte_memo is not None:
+                    pte_memo[id(pte)] = pte_json
+            ptes.append(pte_json)
+        d['va'] = va_json = self.va.jsonify()
+        d['pa'] = pa_json = self.pa.jsonify()
         d['satp'] = self.satp.jsonify()
 
-        if self.va.data() == self.pa.data():  # colorize VA = PA
-            d['va']['same_va_pa'] = True
-            d['pa']['same_va_pa'] = True
+        va, pa = va_json['data'], pa_json['data']
+        if va == pa:  # colorize VA = PA
+            va_json['same_va_pa'] = True
+            pa_json['same_va_pa'] = True
 
-        if va_ref_counter[self.va.data()] > 1:
-            d['va']['reuse'] = True
+        if va_ref_counter.get(va, 0) > 1:
+            va_json['reuse'] = True
 
-        if pa_ref_counter[self.pa.data()] > 1:
-            d['pa']['reuse'] = True
-
-        for pte in d['ptes']:
-            if pa_ref_counter[pte['address']] > 1:
-                pte['reuse'] = True
+        if pa_ref_counter.get(pa, 0) > 1:
+            pa_json['reuse'] = True
         return d
 
 
@@ -174,6 +203,7 @@ class InvalidTranslationWalk(TranslationWalk):
     '''
     Almost identical subclass of TranslationWalk, but has special handling of resolving junk, as well as error type support.
     '''
+    valid = False  # its leaf is where it faults: a PTE of its own
     def __init__(self, mode=None, pagesize=None, satp=None, va=None, pa=None, ptes=None, error_type=None):
         super().__init__(mode=mode, pagesize=pagesize, satp=satp, va=va, pa=pa, ptes=ptes)
         self.error_type = error_type
@@ -182,33 +212,46 @@ class InvalidTranslationWalk(TranslationWalk):
         try:
             super().resolve(CR, pte_hashmap=pte_hashmap)
         except Errors.SuperPageNotCleared:
-            self.error_type = 'Superpage not cleared'
+            self.error_type = ERROR_SUPERPAGE_NOT_CLEARED
         except Errors.PTEMarkedInvalid:
-            self.error_type = 'PTE is marked invalid'
+            self.error_type = ERROR_PTE_INVALID
         except Errors.WriteNoReadError:
-            self.error_type = 'R = 0 & W = 1'
+            self.error_type = ERROR_WRITE_NO_READ
         except Errors.LeafMarkedAsPointer:
-            self.error_type = 'Leaf marked as Ptr'
+            self.error_type = ERROR_LEAF_AS_POINTER
         except Errors.NonGlobalAfterGlobal:
-            self.error_type = 'G followed by non-G'
+            self.error_type = ERROR_NON_GLOBAL_AFTER_GLOBAL
         except:
             print('Unexpected error occurred in execution')
             raise
 
+        # Stopping early (e.g. on an uncleared superpage) can leave PPN fields unset.
+        # Fill them in (in the memory bounds), so every PTE has a full word in memory
+        for pte in self.ptes:
+            ppn = pte.ppn.copy()
+            if None in ppn:
+                backing_values = CR._chunk_address(CR._random_pa_address())
+                pte.ppn = [value if value is not None else backing for value, backing in zip(ppn, backing_values)]
+
         # Set defaults for unset fields in flag bits
+        stats = CR.stats
+        if stats is not None:
+            start = time.perf_counter()
         for i in range(len(self.ptes)):
-            self.ptes[i].finalize()
+            self.ptes[i].finalize(CR.rng)
+        if stats is not None:
+            stats.add('finalize', time.perf_counter() - start)
 
         # Set unset parts of the VA to something random
         # This should only ever occur in the invalid translation walks in cutoffs, in valid unneccessary.
-        self.va.randomize()
+        self.va.randomize(CR.rng)
 
-    def jsonify(self):
-        d = super().jsonify()
+    def jsonify(self, pte_memo: Union[dict, None] = None):
+        d = super().jsonify(pte_memo)
         d['error_type'] = self.error_type
         return d
 
-    def jsonify_color(self, va_ref_counter: dict, pa_ref_counter: dict):
-        d = super().jsonify_color(va_ref_counter, pa_ref_counter)
+    def jsonify_color(self, va_ref_counter: dict, pa_ref_counter: dict, pte_memo: Union[dict, None] = None):
+        d = super().jsonify_color(va_ref_counter, pa_ref_counter, pte_memo)
         d['error_type'] = self.error_type
         return d
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+'''
+Tracks which parts of the physical memory are taken by page tables and by the pages the leaves map,
+so new ones can be placed in free space instead of on top of each other.
+
+Memory is handled in naturally aligned regions of 2**shift bytes: the page sizes of the mode, and coarser
+levels above them up to the size of the physical memory. The map is sparse (only regions that have something
+in them are stored), so it costs the same for a 34 bit and a 56 bit physical memory. Per level it keeps
+- taken: the regions handed out at that size (a 4K table page, a 2M leaf page, ...)
+- used: how many 4K frames are taken inside each region, for the regions that have anything in them.
+  Only kept for the levels something has been drawn at (or searched through), since it's the bulk of the memory.
+
+Page tables are kept together (draw_table): in a region of the largest page size that tables are in already,
+while it has room, so the other regions stay whole for the huge pages. Leaf pages are kept together the same way,
+per page size (draw_leaf), in regions of the largest page size above theirs. Each random stream starts its own
+leaf groups (new_leaf_groups), so where a test case's leaves go doesn't depend on the cases before it.
+'''
+
+import random
+from typing import Dict, List, Set, Tuple, Union
+
+from constants import PA_BITS, PAGE_SHIFT
+from layouts import layout
+from simulator_errors import Errors
+from utils import addr_to_memsize
+
+DRAW_ATTEMPTS = 16  # random picks to try before searching the map for a free region
+
+
+class FrameAllocator:
+    '''
+    Free space map of the physical memory.
+    Regions drawn for the walk being resolved are held as pending (so the walk's own draws don't collide)
+    until they're marked as taken when the walk is registered, or dropped when it's abandoned.
+    '''
+    def __init__(self, mode: int):
+        # The page size shifts of the levels, then coarser ones to cover the whole physical memory
+        self.shifts = [shift for shift, _ in layout(mode).vpn_fields]
+        self.page_shifts = self.shifts[1:]  # of the pages bigger than a table
+        while self.shifts[-1] + 9 < PA_BITS[mode]:
+            self.shifts.append(self.shifts[-1] + 9)
+        self.taken: Dict[int, Set[int]] = {shift: set() for shift in self.shifts}
+        self.used: Dict[int, Dict[int, int]] = {}  # tracked levels only, see _track
+        self.pending: List[Tuple[int, int]] = []
+        self.table_regions: Dict[int, List[int]] = {}  # shift -> the regions of that size tables go in, current last
+        self.leaf_regions: Dict[Tuple[int, int], List[int]] = {}  # (region shift, page shift) -> likewise for leaf pages
+
+    def level_shift(self, level: int) -> int:
+        ''' The shift of the pages a leaf at this level maps '''
+        return self.shifts[level]
+
+    def _track(self, shift: int) -> Dict[int, int]:
+        ''' The used map of a level, built from the taken regions below it the first time it's needed '''
+        if shift not in self.used:
+            used = self.used[shift] = {}
+            for s in self.shifts:
+                if s < shift:
+                    for region in self.taken[s]:
+                        used[region >> (shift - s)] = used.get(region >> (shift - s), 0) + (1 << (s - PAGE_SHIFT))
+        return self.used[shift]
+
+    def is_free(self, address: int, shift: int) -> bool:
+        ''' Whether the region of 2**shift at address has nothing in it '''
+        if address >> shift in self.taken[shift]:
+            return False
+        if shift > PAGE_SHIFT and self._track(shift).get(address >> shift):
+            return False
+        return not any((address >> s) in self.taken[s] for s in self.shifts if s > shift)
+
+    def _covered(self, address: int, shift: int) -> bool:
+        return any((address >> s) in self.taken[s] for s in self.shifts if s >= shift)
+
+    def _update(self, address: int, shift: int, sign: int):
+        size = sign << (shift - PAGE_SHIFT)
+        for s, used in self.used.items():
+            if s <= shift:
+                continue
+            region = address >> s
+            frames = used.get(region, 0) + size
+            if frames:
+                used[region] = frames
+            else:
+                del used[region]
+
+    def _add(self, address: int, shift: int) -> bool:
+        if self._covered(address, shift):
+            return False
+        self.taken[shift].add(address >> shift)
+        self._update(address, shift, 1)
+        return True
+
+    def reserve(self, address: int, shift: int):
+        ''' Hold a region for the walk being resolved '''
+        if self._add(address, shift):
+            self.pending.append((address >> shift, shift))
+
+    def mark(self, address: int, shift: int):
+        '''
+        Record the region around address as taken.
+        Marking a region that's already taken (or inside one) is fine -- shared tables, aliased pages, pinned addresses.
+        '''
+        region = address >> shift
+        if (region, shift) in self.pending:
+            self.pending.remove((region, shift))
+        else:
+            self._add(region << shift, shift)
+
+    def mark_range(self, low: int, high: int):
+        ''' Mark all of [low, high) (page aligned) as taken, in as few regions as it fits in '''
+        while low < high:
+            shift = max(s for s in self.shifts if s == PAGE_SHIFT or (low % (1 << s) == 0 and low + (1 << s) <= high))
+            self.mark(low, shift)
+            low += 1 << shift
+
+    def drop_pending(self):
+        ''' Release the regions held for a walk that didn't use them (or didn't make it) '''
+        for region, shift in self.pending:
+            self.taken[shift].discard(region)
+            self._update(region << shift, shift, -1)
+        self.pending = []
+
+    def _bounds(self, shift: int, low: int, high: int) -> Tuple[int, int]:
+        ''' First and last region number in [low, high). InvalidConstraints if it can't hold a whole region '''
+        first, last = -(-low >> shift), (high >> shift) - 1
+        if first > last:
+            raise Errors.InvalidConstraints(f'A {addr_to_memsize(1 << shift, 0)} page does not fit in [{low:#x}, {high:#x})')
+        return first, last
+
+    def take(self, address: int, shift: int, low: int, high: int, rng: random.Random = random) -> int:
+        ''' Hold the region around address if it's free and in [low, high), otherwise draw another one '''
+        address = address >> shift << shift
+        first, last = self._bounds(shift, low, high)
+        if first <= address >> shift <= last and self.is_free(address, shift):
+            self.reserve(address, shift)
+            return address
+        return self.draw(shift, low, high, rng)
+
+    def draw(self, shift: int, low: int, high: int, rng: random.Random = random) -> int:
+        '''
+        Pick a random free region of 2**shift in [low, high), and hold it for the walk being resolved.
+        Returns its address. Raises OutOfMemory if there is none.
+        '''
+        first, last = self._bounds(shift, low, high)
+        for _ in range(DRAW_ATTEMPTS):  # almost always enough while the memory is sparse
+            address = rng.randint(first, last) << shift
+            if self.is_free(address, shift):
+                break
+        else:
+            address = self._search(len(self.shifts) - 1, None, shift, first << shift, (last + 1) << shift, rng)
+            if address is None:
+                raise Errors.OutOfMemory(f'No free {addr_to_memsize(1 << shift, 0)} region left in [{low:#x}, {high:#x})')
+        self.reserve(address, shift)
+        return address
+
+    def _group_shift(self, low: int, high: int, shift: int = PAGE_SHIFT) -> Union[int, None]:
+        '''
+        The size of the regions pages of 2**shift are kept together in: the largest page size above it
+        with room for more than one in [low, high)
+        '''
+        shifts = [s for s in self.page_shifts if s > shift and 2 << s <= high - low]
+        return shifts[-1] if shifts else None
+
+    def _draw_grouped(self, regions: List[int], group_shift: int, shift: int, low: int, high: int, rng: random.Random) -> int:
+        '''
+        Draw a region of 2**shift in the current group region (the last of regions) while it has room,
+        otherwise anywhere in [low, high), which makes its group region the current one.
+        '''
+        while regions:
+            region_low, region_high = max(low, regions[-1] << group_shift), min(high, (regions[-1] + 1) << group_shift)
+            if region_high - region_low >= 1 << shift and not self._covered(region_low, group_shift):
+                try:
+                    return self.draw(shift, region_low, region_high, rng)
+                except Errors.OutOfMemory:
+                    pass
+            regions.pop()  # full (or out of [low, high))
+        address = self.draw(shift, low, high, rng)
+        regions.append(address >> group_shift)
+        return address
+
+    def _take_grouped(self, regions: List[int], group_shift: int, address: int, shift: int, low: int, high: int,
+                      rng: random.Random) -> int:
+        ''' Like take: address moved into the current group region, drawn again (see _draw_grouped) if it's not free there '''
+        if regions:
+            address = (regions[-1] << group_shift | address & ((1 << group_shift) - 1)) >> shift << shift
+            if low <= address and address + (1 << shift) <= high and self.is_free(address, shift):
+                self.reserve(address, shift)
+                return address
+        return self._draw_grouped(regions, group_shift, shift, low, high, rng)
+
+    def draw_table(self, low: int, high: int, rng: random.Random = random) -> int:
+        ''' Draw a page for a page table, kept together with the other tables (see _draw_grouped) '''
+        shift = self._group_shift(low, high)
+        if shift is None:
+            return self.draw(PAGE_SHIFT, low, high, rng)
+        return self._draw_grouped(self.table_regions.setdefault(shift, []), shift, PAGE_SHIFT, low, high, rng)
+
+    def take_table(self, address: int, low: int, high: int, rng: random.Random = random) -> int:
+        ''' Like take, for a page table: kept together with the other tables '''
+        shift = self._group_shift(low, high)
+        if shift is None:
+            return self.draw(PAGE_SHIFT, low, high, rng)
+        return self._take_grouped(self.table_regions.setdefault(shift, []), shift, address, PAGE_SHIFT, low, high, rng)
+
+    def new_leaf_groups(self):
+        ''' Start new leaf groups: the next leaf of each size starts its own region (see Context.use_substream) '''
+        self.leaf_regions = {}
+
+    def draw_leaf(self, shift: int, low: int, high: int, rng: random.Random = random) -> int:
+        ''' Draw a leaf page of 2**shift, kept together with the other leaf pages of its size (see _draw_grouped) '''
+        group_shift = self._group_shift(low, high, shift)
+        if group_shift is None:
+            return self.draw(shift, low, high, rng)
+        regions = self.leaf_regions.setdefault((group_shift, shift), [])
+        return self._draw_grouped(regions, group_shift, shift, low, high, rng)
+
+    def take_leaf(self, address: int, shift: int, low: int, high: int, rng: random.Random = random) -> int:
+        ''' Like take, for a leaf page: kept together with the other leaf pages of its size '''
+        group_shift = self._group_shift(low, high, shift)
+        if group_shift is None:
+            return self.take(address, shift, low, high, rng)
+        regions = self.leaf_regions.setdefault((group_shift, shift), [])
+        return self._take_grouped(regions, group_shift, address, shift, low, high, rng)
+
+    def _search(self, k: int, region: Union[int, None], shift: int, low: int, high: int, rng: random.Random) -> Union[int, None]:
+        '''
+        Look for a free region of 2**shift in [low, high) inside the given region of level k (None = everything),
+        skipping the parts that are full. Starts from a random child each level, so it doesn't pile up on one end.
+        '''
+        level_shift = self.shifts[k]
+        if region is not None:
+            if region in self.taken[level_shift]:
+                return None
+            used = self._track(level_shift).get(region, 0) if level_shift > PAGE_SHIFT else 0
+            low, high = max(low, region << level_shift), min(high, (region + 1) << level_shift)
+            if not used:  # nothing in here, any spot will do
+                return rng.randint(low >> shift, (high >> shift) - 1) << shift
+            if level_shift == shift or used >= 1 << (level_shift - PAGE_SHIFT):
+                return None
+            k -= 1
+        child_shift = self.shifts[k]
+        first, last = low >> child_shift, (high - 1) >> child_shift
+        count = last - first + 1
+        start = rng.randrange(count)
+        for i in range(count):
+            found = self._search(k, first + (start + i) % count, shift, low, high, rng)
+            if found is not None:
+                return found
+        return None
+
+    def merge(self, other: 'FrameAllocator'):
+        ''' Mark everything the other allocator has taken (pending regions included) '''
+        for shift, regions in other.taken.items():
+            for region in regions:
+                self.mark(region << shift, shift)
+        for shift, regions in other.table_regions.items():
+            own = self.table_regions.setdefault(shift, [])
+            own[:0] = [region for region in regions if region not in own]  # after the current one
+        for key, regions in other.leaf_regions.items():
+            own = self.leaf_regions.setdefault(key, [])
+            own[:0] = [region for region in regions if region not in own]
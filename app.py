@@ -1,12 +1,20 @@
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, Response, send_from_directory, request, jsonify
 from Translator import TranslationWalk, InvalidTranslationWalk
 from Context import Context, ContextFromJSON, ContextFromJSON5
+from jobs import JobQueue, error_message, FINISHED, DONE, RESULT_PAGE_LIMIT
+from result_cache import DiskCache, MemoryCache, ResultCache, cache_key, cacheable
 from typing import Union
 from simulator_errors import Errors
+import json
+import fastjson5
 
 # import traceback
 # import benedict
 app = Flask(__name__)
+jobs = JobQueue()
+results = ResultCache(MemoryCache(), DiskCache())
+
+SSE_KEEPALIVE = 15  # seconds between keepalive comments on an idle event stream
 
 
 @app.route('/basic')
@@ -56,21 +64,118 @@ def simapi():
 @app.route('/api/json5', methods=['POST'])
 def json5api():
     try:
-        data = request.get_json()
-        data = data['code']
-        mgr = ContextFromJSON5(data)
-        d = mgr.jsonify_color()
-        return jsonify(d)
-    except Errors.InvalidConstraints:
-        return jsonify({'error': "Couldn't satisfy the provided constraints"})
-    except Errors.UnexpectedLeaf:
-        return jsonify({'error': "Constraints caused an unexpected leaf"})
-    except Errors.LeafMarkedAsPointer:
-        return jsonify({'error': "Constraints given caused a leaf to be used as a pointer"})
-    except ValueError:
-        return jsonify({'error': 'JSON5 syntax error'})
-    except:
-        return jsonify({'error': 'Unknown runtime error'})
+        params = fastjson5.loads(request.get_json()['code'])
+        if request.get_json().get('profile'):  # where the time went, under 'stats' (never cached)
+            mgr = ContextFromJSON(params, profile=True)
+            return jsonify({**mgr.jsonify_color(), 'stats': mgr.stats.jsonify()})
+        if not cacheable(params):
+            return jsonify(ContextFromJSON(params).jsonify_color())
+        key = cache_key(params, 'color')
+        data = results.get(key)
+        if data is None:
+            data = json.dumps(ContextFromJSON(params).jsonify_color()).encode()
+            results.put(key, data)
+        return Response(data, mimetype='application/json')
+    except Exception as e:
+        return jsonify({'error': error_message(e)})
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    ''' Queue a JSON5 config ({'code': ...}, like /api/json5) for generation. Returns the job id and status '''
+    try:
+        params = fastjson5.loads(request.get_json()['code'])
+    except Exception:
+        return jsonify({'error': 'JSON5 syntax error'}), 400
+    job = jobs.submit(params)
+    return jsonify(job.state()), 202
+
+
+def _job_or_404(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': 'No such job'}), 404)
+    return job, None
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job, error = _job_or_404(job_id)
+    return error or jsonify(job.state())
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'No such job'}), 404
+    return jsonify(job.state())
+
+
+@app.route('/api/jobs/<job_id>/walks', methods=['GET'])
+def job_walks(job_id):
+    '''
+    Stream the walks as they're generated (from ?since=N on), then the final job state.
+    NDJSON (one walk per line, the state on the last line), or Server-Sent Events
+    ('walk' events, then a 'done' event with the state) if the client accepts text/event-stream.
+    '''
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    since = request.args.get('since', 0, type=int)
+    if request.accept_mimetypes.best == 'text/event-stream' or request.args.get('format') == 'sse':
+        def events():
+            for walk in job.follow(since, SSE_KEEPALIVE):
+                if walk is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'event: walk\ndata: {json.dumps(walk.jsonify())}\n\n'
+            yield f'event: done\ndata: {json.dumps(job.state())}\n\n'
+        return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    def lines():
+        for walk in job.follow(since):
+            yield json.dumps(walk.jsonify()) + '\n'
+        yield json.dumps(job.state()) + '\n'
+    return Response(lines(), mimetype='application/x-ndjson')
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    ''' The whole output of a finished job, the same as /api/json5 returns '''
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    if job.status not in FINISHED:
+        return jsonify(job.state()), 409
+    if job.status != DONE:
+        return jsonify({'error': job.error or f'Job {job.status}'})
+    return jsonify(job.result())
+
+
+@app.route('/api/result/<job_id>', methods=['GET'])
+def result_window(job_id):
+    '''
+    A window of a job's walks (?offset=&limit=, at most RESULT_PAGE_LIMIT), colored like /api/json5,
+    with the job state and the context header. Works while the job is still running.
+    '''
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(0, request.args.get('limit', 100, type=int)), RESULT_PAGE_LIMIT)
+    return jsonify({
+        **job.state(),
+        **(job.mgr.jsonify_header() if job.mgr else {}),
+        'offset': offset,
+        'walks': job.window(offset, limit),
+    })
+
+
+@app.route('/api/result/<job_id>/summary', methods=['GET'])
+def result_summary(job_id):
+    job, error = _job_or_404(job_id)
+    return error or jsonify(job.summary())
 
 
 if __name__ == "__main__":
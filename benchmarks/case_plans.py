@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+'''
+Test case compilation: adds the walks of a config's test cases, scaled up to the given number of repeats,
+once through Context.add_test_case (the test case dict is read on every repeat) and once through
+Context.add_planned (compiled once into a CasePlan). Both make the same walks.
+Run from the repository root:
+
+    python3 benchmarks/case_plans.py examples/sample_2.json5 --repeats 1000000
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Context import ContextFromParams, load_json5  # noqa: E402
+from plans import CasePlan  # noqa: E402
+from simulator_errors import Errors  # noqa: E402
+
+# Repeating the fixed addresses of the examples breaks some walks: count those, in both paths
+GENERATION_ERRORS = tuple(error for error in vars(Errors).values() if isinstance(error, type) and issubclass(error, Exception))
+
+
+def scaled(params: dict, repeats: int) -> list:
+    ''' The test cases with their repeats scaled to add up to about repeats '''
+    cases = params.get('test_cases', [])
+    total = sum(case.get('repeats', 1) for case in cases)
+    return [(case, max(1, case.get('repeats', 1) * repeats // total)) for case in cases]
+
+
+def run(params: dict, cases: list, planned: bool) -> dict:
+    mgr = ContextFromParams({**params, 'seed': params.get('seed', 0)}, keep_walks=False)
+    walks = failures = 0
+    start = time.perf_counter()
+    compiling = 0.0
+    for index, (case, repeats) in enumerate(cases):
+        mgr.use_substream(index)
+        if planned:
+            t = time.perf_counter()
+            plan = CasePlan(case, mgr.mode)
+            compiling += time.perf_counter() - t
+            add = lambda: mgr.add_planned(plan)  # noqa: E731
+        else:
+            add = lambda: mgr.add_test_case(**case)  # noqa: E731
+        for _ in range(repeats):
+            try:
+                add()
+                walks += 1
+            except GENERATION_ERRORS:
+                failures += 1
+    return {'walks': walks, 'failures': failures, 'seconds': time.perf_counter() - start, 'compile': compiling}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time adding walks from test case dicts against compiled plans')
+    parser.add_argument('input', nargs='?', default='examples/sample_2.json5', help='JSON5 input (default: examples/sample_2.json5).')
+    parser.add_argument('--repeats', type=int, default=100000, help='Total repeats, spread over the test cases (default: 100000).')
+    args = parser.parse_args()
+
+    params = load_json5(args.input)
+    cases = scaled(params, args.repeats)
+    print(f'{"path":>6} {"walks":>8} {"failed":>8} {"seconds":>8} {"us/walk":>8} {"compile ms":>10}')
+    for name, planned in (('dict', False), ('plan', True)):
+        result = run(params, cases, planned)
+        print(f'{name:>6} {result["walks"]:>8} {result["failures"]:>8} {result["seconds"]:>8.2f} '
+              f'{result["seconds"] / max(1, result["walks"]) * 1e6:>8.1f} {result["compile"] * 1e3:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+'''
+Memory per walk: generates walks with tracemalloc on, and reports the bytes still held per walk.
+With --stream, the Context doesn't keep the walks (like runjson.py --stream), so what's left is the lookup
+structures: the PTEs by address, the VA and PA sets, the reuse / aliasing indexes and the allocator.
+Run from the repository root:
+
+    python3 benchmarks/memory.py --walks 20000 --mode 48
+    python3 benchmarks/memory.py --walks 20000 --mode 48 --stream
+
+--output writes the results to a JSON file, --baseline compares against one written earlier (e.g. by a checkout
+of an older commit, running this same script), and adds its B/walk and the change to the table.
+benchmarks/memory_baseline.json has the numbers from before the PTE / VA / PA fields were packed (0fa06c5).
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Context import ContextFromParams, iter_walks  # noqa: E402
+
+# The batch path takes plain test cases, anything else goes through the resolver
+CASES = {
+    'batch': {},
+    'resolver': {'same_va_pa': 0},
+}
+
+
+def measure(mode: int, walks: int, case: dict, stream: bool = False) -> dict:
+    params = {'mode': mode, 'seed': 1, 'test_cases': [{'repeats': walks, **case}]}
+    tracemalloc.start()
+    mgr = ContextFromParams(params, keep_walks=not stream)
+    made = 0
+    for _ in iter_walks(mgr, params):
+        made += 1
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'walks': made, 'ptes': len(mgr.ptes), 'bytes': current, 'peak': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory held per generated walk')
+    parser.add_argument('--walks', type=int, default=20000, help='Walks per run (default: 20000).')
+    parser.add_argument('--mode', type=int, choices=(32, 39, 48), action='append', help='Mode (can be repeated, default: all).')
+    parser.add_argument('--stream', action='store_true', help="Don't keep the walks, only the lookup structures.")
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare against the results in this JSON file.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            recorded = json.load(f)
+        if (recorded['walks'], recorded['stream']) != (args.walks, args.stream):
+            parser.error(f'the baseline is of {recorded["walks"]} walks (stream: {recorded["stream"]}), '
+                         f'run with the same --walks / --stream')
+        baseline = recorded['results']
+
+    results = {}
+    print(f'{"mode":>4} {"path":>8} {"walks":>8} {"ptes":>8} {"MiB":>8} {"peak MiB":>8} {"B/walk":>8}'
+          + (f' {"baseline":>8} {"change":>7}' if baseline else ''))
+    for mode in args.mode or (32, 39, 48):
+        for name, case in CASES.items():
+            result = measure(mode, args.walks, case, args.stream)
+            per_walk = result['per_walk'] = result['bytes'] // result['walks']
+            results[f'{name}/sv{mode}'] = result
+            line = (f'{mode:>4} {name:>8} {result["walks"]:>8} {result["ptes"]:>8} {result["bytes"] / 2**20:>8.1f} '
+                    f'{result["peak"] / 2**20:>8.1f} {per_walk:>8}')
+            before = baseline.get(f'{name}/sv{mode}')
+            if before is not None:
+                line += f' {before["per_walk"]:>8} {per_walk / before["per_walk"] - 1:>+7.0%}'
+            print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'walks': args.walks, 'stream': args.stream, 'python': platform.python_version(), 'results': results},
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+'''
+Benchmark suite: scripted scenarios (plain repeats, reuse_pte, aliasing, same_va_pa, errors, page_range and
+mixed page sizes) for each of Sv32 / Sv39 / Sv48. For each one: walks/s through ContextFromJSON, the time per
+TranslationWalk.resolve call, jsonify / jsonify_color / print_dump times and the peak RSS.
+Every scenario runs in its own process, so the peak RSS is its own.
+Run from the repository root:
+
+    python3 benchmarks/suite.py run --output bench.json
+    python3 benchmarks/suite.py compare baseline.json bench.json --tolerance 0.1
+
+compare exits with 1 if any metric got worse than the tolerance allows.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from constants import MODE_PAGESIZE_LEVEL_MAP  # noqa: E402
+
+MODES = (32, 39, 48)
+ERROR_TYPES = ['mark_invalid', 'write_no_read', 'leaf_as_pointer', 'uncleared_superpage']
+
+# metric -> whether higher is better
+METRICS = {
+    'walks_per_s': True,
+    'resolve_us': False,
+    'jsonify_s': False,
+    'jsonify_color_s': False,
+    'print_dump_s': False,
+    'peak_rss_mib': False,
+}
+
+
+def scenarios(mode: int, walks: int) -> dict:
+    ''' name -> test cases of about the given number of walks '''
+    warmup = max(1, walks // 5)  # walks for aliasing / reuse_pte to pick from
+    return {
+        'plain': [{'repeats': walks}],
+        'reuse_pte': [{'repeats': warmup}, {'repeats': walks - warmup, 'reuse_pte': 0.5}],
+        'aliasing': [{'repeats': warmup}, {'repeats': walks - warmup, 'aliasing': 0.5}],
+        'same_va_pa': [{'repeats': walks, 'same_va_pa': 0.5}],
+        'errors': [{'repeats': walks, 'errors': {'p': 0.5, 'types': ERROR_TYPES, 'weights': [1, 1, 1, 1]}}],
+        'page_range': [{'page_range': {'start': 0x40000000, 'num_pages': walks}}],
+        'mixed_pagesizes': [{'repeats': walks, 'pagesize': list(MODE_PAGESIZE_LEVEL_MAP[mode])}],
+    }
+
+
+@contextlib.contextmanager
+def timed_resolve(stats: dict):
+    ''' Time every TranslationWalk.resolve (and InvalidTranslationWalk.resolve) call into stats '''
+    from Translator import InvalidTranslationWalk, TranslationWalk
+    originals = {cls: cls.__dict__['resolve'] for cls in (TranslationWalk, InvalidTranslationWalk)}
+
+    def wrap(resolve):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return resolve(*args, **kwargs)
+            finally:
+                stats['calls'] += 1
+                stats['seconds'] += time.perf_counter() - start
+        return timed
+
+    for cls, resolve in originals.items():
+        cls.resolve = wrap(resolve)
+    try:
+        yield stats
+    finally:
+        for cls, resolve in originals.items():
+            cls.resolve = resolve
+
+
+def measure(name: str, mode: int, walks: int) -> dict:
+    ''' Run one scenario in this process '''
+    from Context import ContextFromJSON
+
+    params = {'mode': mode, 'seed': 1, 'test_cases': scenarios(mode, walks)[name]}
+    stats = {'calls': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    with timed_resolve(stats):
+        mgr = ContextFromJSON(params)
+    generate = time.perf_counter() - start
+
+    timings = {}
+    for method in ('jsonify', 'jsonify_color', 'print_dump'):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            getattr(mgr, method)()
+        timings[method] = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    return {
+        'walks': len(mgr.walks),
+        'seconds': generate,
+        'walks_per_s': len(mgr.walks) / generate,
+        'resolve_calls': stats['calls'],
+        'resolve_us': stats['seconds'] / stats['calls'] * 1e6 if stats['calls'] else None,
+        'jsonify_s': timings['jsonify'],
+        'jsonify_color_s': timings['jsonify_color'],
+        'print_dump_s': timings['print_dump'],
+        'peak_rss_mib': peak,
+    }
+
+
+def run(args):
+    names = args.scenario or list(scenarios(32, 1))
+    results = {}
+    print(f'{"scenario":>16} {"mode":>4} {"walks/s":>9} {"resolve us":>10} {"jsonify s":>9} {"color s":>8} {"dump s":>7} {"RSS MiB":>8}')
+    for mode in args.mode or MODES:
+        for name in names:
+            # a fresh process per scenario, for its own peak RSS
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), 'one', name, str(mode), str(args.walks)],
+                                 check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            result = results[f'{name}/sv{mode}'] = json.loads(out)
+            print(f'{name:>16} {mode:>4} {result["walks_per_s"]:>9.0f} {_fmt(result["resolve_us"], 10, 1)} '
+                  f'{result["jsonify_s"]:>9.3f} {result["jsonify_color_s"]:>8.3f} {result["print_dump_s"]:>7.3f} '
+                  f'{_fmt(result["peak_rss_mib"], 8, 1)}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'walks': args.walks, 'python': platform.python_version(), 'results': results}, f, indent=2)
+
+
+def _fmt(value, width: int, digits: int) -> str:
+    return f'{value:>{width}.{digits}f}' if value is not None else f'{"-":>{width}}'
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    print(f'{"scenario":>24} {"metric":>16} {"baseline":>10} {"current":>10} {"change":>8}')
+    for key in sorted(baseline.keys() & current.keys()):
+        for metric, higher_better in METRICS.items():
+            before, after = baseline[key].get(metric), current[key].get(metric)
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            worse = -change if higher_better else change
+            flag = ''
+            if worse > args.tolerance:
+                flag = ' REGRESSION'
+                regressions += 1
+            print(f'{key:>24} {metric:>16} {before:>10.3f} {after:>10.3f} {change:>+8.1%}{flag}')
+    for key in sorted(baseline.keys() ^ current.keys()):
+        print(f'{key:>24} only in {"the baseline" if key in baseline else "the current run"}')
+    print(f'{regressions} regression(s) over {args.tolerance:.0%}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generation, resolution and serialization over scripted scenarios')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the scenarios')
+    run_parser.add_argument('--walks', type=int, default=5000, help='Walks per scenario (default: 5000).')
+    run_parser.add_argument('--mode', type=int, choices=MODES, action='append', help='Mode (can be repeated, default: all).')
+    run_parser.add_argument('--scenario', action='append', help='Scenario (can be repeated, default: all).')
+    run_parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    compare_parser = commands.add_parser('compare', help='Compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative change for the worse (default: 0.1).')
+
+    one_parser = commands.add_parser('one')  # one scenario, results as JSON on stdout (used by run)
+    one_parser.add_argument('name')
+    one_parser.add_argument('mode', type=int)
+    one_parser.add_argument('walks', type=int)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        sys.exit(compare(args))
+    else:
+        print(json.dumps(measure(args.name, args.mode, args.walks)))
+
+
+if __name__ == '__main__':
+    main()
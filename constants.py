@@ -38,3 +38,14 @@ MODE_PAGESIZE_LEVEL_MAP = {
     },
 }
 PAGESIZE_INT_MAP = {'4K': 2**12, '2M': 2**22, '4M': 2**24, '1G': 2**30, '512G': 2**39}
+
+# Where new PTEs go: 'random' slots (tables only shared when the VPNs happen to match),
+# or 'packed' into the page tables that are already there (see indexes.TableIndex)
+PTE_PLACEMENTS = ('random', 'packed')
+
+# InvalidTranslationWalk.error_type values (also what the oracle reports for the matching faults)
+ERROR_SUPERPAGE_NOT_CLEARED = 'Superpage not cleared'
+ERROR_PTE_INVALID = 'PTE is marked invalid'
+ERROR_WRITE_NO_READ = 'R = 0 & W = 1'
+ERROR_LEAF_AS_POINTER = 'Leaf marked as Ptr'
+ERROR_NON_GLOBAL_AFTER_GLOBAL = 'G followed by non-G'
@@ -2,6 +2,7 @@ from typing import List, Tuple, Union
 
 from utils import safe_to_bin, field_to_string, num_hex_digits, safe_to_hex
 from constants import PA_BITS
+from layouts import layout, Field, ATTRIBUTE_FIELDS, FLAGS_MASK, OFFSET_FIELD, PTE_FLAG_BITS
 import math
 import random
 
@@ -9,16 +10,20 @@ from simulator_errors import Errors
 
 DEFAULT_FORMAT = 'b'
 
+POINTER_RESERVED_DAU = 0b11010000  # D, A and U are reserved in pointer PTEs
+POINTER_CLEARED = POINTER_RESERVED_DAU | 0b1110  # XWR too
+FLAG_V, FLAGS_XWR, FLAGS_AD = 0b1, 0b1110, 0b11000000
+XWR_CHOICES = (0b001, 0b011, 0b100, 0b101, 0b111)  # what PTE.finalize draws for a leaf with no XWR set
+AD_CHOICES = (0b00, 0b10, 0b11)
+
+# (name, shift, mask) of the flags, in the order PTE.jsonify lists them
+JSON_ATTRIBUTES = tuple((name, ATTRIBUTE_FIELDS[name][0], (1 << ATTRIBUTE_FIELDS[name][1]) - 1) for name in ['RSW', *'DAGUXWRV'])
+
 
 class SATP:
-    mode = 0
-    asid = 0  # Not used currently
-    ppn = None
-    ppn_isEmpty = False
+    __slots__ = ('mode', 'asid', 'ppn', 'ppn_isEmpty')
 
     def __init__(self, mode=32, asid=0, ppn_isEmpty=False, ppn=None, isLoad=False):
-        if isLoad:
-            return
         self.set(mode, asid, ppn_isEmpty, ppn)
 
     def set(self, mode, asid, ppn_isEmpty, ppn):
@@ -29,7 +34,7 @@ class SATP:
 
     @property
     def ppn_width(self):
-        return 22 if self.mode == 32 else 44
+        return layout(self.mode).ppn_bits
 
     def jsonify(self):
         return {'mode': self.mode, 'asid': self.asid, 'ppn': self.ppn}
@@ -52,34 +57,157 @@ class SATP:
         return f'SATP: (PPN={ppn_hex})\n{top_str}\n{main_str}'
 
 
-class PTE:
-    class ATTRIBUTES:
-        V = 1
-        R = None
-        W = None
-        X = None
-        U = None
-        G = None
-        A = None
-        D = None
-        RSW = 0  # hardwire to 0 for now
+class FieldView:
+    '''
+    List-like view of the fields (VPNs / PPNs) packed into the int of a VA, PA or PTE.
+    Reads and writes go through to the owner, so pte.ppn[i] = x and None in pte.ppn work as on a list.
+    Unset fields read as None.
+    '''
+    __slots__ = ('owner', 'fields')
+
+    def __init__(self, owner: 'Packed', fields: Tuple[Field, ...]):
+        self.owner = owner
+        self.fields = fields
+
+    def __getitem__(self, index):
+        if type(index) == slice:
+            return self.owner._get_fields(self.fields)[index]
+        return self.owner._get(*self.fields[index])
+
+    def __setitem__(self, index, value):
+        self.owner._set(*self.fields[index], value)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.owner._get_fields(self.fields))
+
+    def __contains__(self, value):
+        return value in self.owner._get_fields(self.fields)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, FieldView)):
+            return self.copy() == list(other)
+        return NotImplemented
 
-        defined = False
+    def __repr__(self):
+        return repr(self.copy())
 
-        def __init__(self):
-            pass
+    def copy(self) -> list:
+        return self.owner._get_fields(self.fields)
+
+
+class Packed:
+    '''
+    Base for the types that keep their fields packed in one int (bits), along with a mask of the bits
+    that have been set (known). Bits that aren't known are kept at 0.
+    Values wider than their field (or negative) raise InvalidConstraints, they aren't truncated.
+    '''
+    __slots__ = ('_layout', 'bits', 'known')
+
+    def __init__(self, mode: int):
+        self._layout = layout(mode)
+        self.bits = 0
+        self.known = 0
+
+    @property
+    def mode(self) -> int:
+        return self._layout.mode
+
+    def clone(self):
+        ''' A copy with the same fields set '''
+        other = self.__class__.__new__(self.__class__)
+        other._layout, other.bits, other.known = self._layout, self.bits, self.known
+        return other
+
+    def _get(self, shift: int, mask: int) -> Union[int, None]:
+        if (self.known >> shift) & mask != mask:
+            return None
+        return (self.bits >> shift) & mask
+
+    def _set(self, shift: int, mask: int, value: Union[int, None]):
+        field = mask << shift
+        self.bits &= ~field
+        if value is None:
+            self.known &= ~field
+        else:
+            if value & ~mask:
+                raise Errors.InvalidConstraints(f'{value:#x} does not fit in a {mask.bit_length()} bit field')
+            self.bits |= value << shift
+            self.known |= field
+
+    def _get_fields(self, fields: Tuple[Field, ...]) -> List[Union[int, None]]:
+        bits, known = self.bits, self.known
+        return [(bits >> shift) & mask if (known >> shift) & mask == mask else None for shift, mask in fields]
+
+    def _set_fields(self, fields: Tuple[Field, ...], values: Union[List[int], None]):
+        ''' Set the fields from a list, fields missing from the end are unset '''
+        values = values or []
+        if len(values) < len(fields):
+            values = list(values) + [None] * (len(fields) - len(values))
+        bits, known = self.bits, self.known
+        for (shift, mask), value in zip(fields, values):
+            field = mask << shift
+            bits &= ~field
+            if value is None:
+                known &= ~field
+            else:
+                if value & ~mask:
+                    raise Errors.InvalidConstraints(f'{value:#x} does not fit in a {mask.bit_length()} bit field')
+                bits |= value << shift
+                known |= field
+        self.bits, self.known = bits, known
+
+    def _packed(self, mask: int) -> Union[int, None]:
+        ''' The bits under the mask, if they're all known '''
+        if self.known & mask != mask:
+            return None
+        return self.bits & mask
+
+
+def _flag(name: str) -> property:
+    shift, width = ATTRIBUTE_FIELDS[name]
+    mask = (1 << width) - 1
+
+    def get(self):
+        return self.pte._get(shift, mask)
+
+    def set(self, value):
+        self.pte._set(shift, mask, value)
+
+    return property(get, set)
+
+
+class PTE(Packed):
+    '''
+    Page table entry. The fields live in the packed PTE word (see Packed), the ppn and attributes
+    properties are views into it.
+    '''
+    class ATTRIBUTES:
+        ''' View of the flag bits of the PTE word '''
+        __slots__ = ('pte', )
+
+        V = _flag('V')
+        R = _flag('R')
+        W = _flag('W')
+        X = _flag('X')
+        U = _flag('U')
+        G = _flag('G')
+        A = _flag('A')
+        D = _flag('D')
+        RSW = _flag('RSW')  # hardwire to 0 for now
+
+        def __init__(self, pte: 'PTE'):
+            self.pte = pte
+
+        @property
+        def defined(self) -> bool:
+            return self.pte.known & FLAGS_MASK == FLAGS_MASK
 
         def set(self, attributes):
-            self.defined = True
-            self.V = attributes & 0x1
-            self.R = (attributes >> 1) & 0x1
-            self.W = (attributes >> 2) & 0x1
-            self.X = (attributes >> 3) & 0x1
-            self.U = (attributes >> 4) & 0x1
-            self.G = (attributes >> 5) & 0x1
-            self.A = (attributes >> 6) & 0x1
-            self.D = (attributes >> 7) & 0x1
-            self.RSW = (attributes >> 8) & 0x3
+            self.pte.bits = (self.pte.bits & ~FLAGS_MASK) | (attributes & FLAGS_MASK)
+            self.pte.known |= FLAGS_MASK
 
         @property
         def flags(self):
@@ -94,92 +222,91 @@ class PTE:
                 s += safe_to_bin(field, 1)
             return s
 
-    mode = 0
-    address = None
-    ppn = [None, None, None, None]
-    # attributes = ATTRIBUTES()
-    isAddrEmpty = True
-    isDataEmpty = True
-    mode = 0
-    errorMessage = ""
-    level = 0
-
-    @property
-    def widths(self):
-        if self.mode == 32:
-            return [10, 12]
-        elif self.mode == 39:
-            return [9, 9, 17]
-        elif self.mode == 48:
-            return [9, 9, 9, 17]
-        return []
+    __slots__ = ('address', 'level')
 
     def __init__(self, level=0, mode=32, isLoad=False):
-        if isLoad:
-            return
-        self.mode = mode
+        super().__init__(mode)
+        self.address = None
         self.level = level
-        self.ppn = [None for i in self.widths if i]
-        self.attributes = self.ATTRIBUTES()
-        self.content_bits = 44 if mode != 32 else 22
-        self.address_bits = 34 if mode == 32 else 56
+        # V defaults to 1, RSW to 0, the rest of the flags start out unset
+        self.known = (1 << ATTRIBUTE_FIELDS['V'][0]) | (0b11 << ATTRIBUTE_FIELDS['RSW'][0])
+        self.bits = 1 << ATTRIBUTE_FIELDS['V'][0]
+
+    def clone(self) -> 'PTE':
+        other = super().clone()
+        other.address, other.level = self.address, self.level
+        return other
+
+    @property
+    def widths(self) -> Tuple[int, ...]:
+        return self._layout.ppn_widths
+
+    @property
+    def ppn(self) -> FieldView:
+        return FieldView(self, self._layout.pte_fields)
+
+    @ppn.setter
+    def ppn(self, values: List[int]):
+        self._set_fields(self._layout.pte_fields, values)
+
+    @property
+    def attributes(self) -> ATTRIBUTES:
+        return self.ATTRIBUTES(self)
+
+    @property
+    def content_bits(self) -> int:
+        return sum(self.widths)
+
+    @property
+    def address_bits(self) -> int:
+        return self._layout.pa_bits
 
     def broadcast_ppn(self, ppn: int, start_level=0):
-        for i in range(start_level):
-            self.ppn[i] = 0  # leaves are zeroed below the used portion of the ppn
-        for i, width in enumerate(self.widths[start_level:], start=start_level):
-            if not width:
-                return
-            self.ppn[i] = ppn & mask(width)
-            ppn >>= width  # shift off the bits that've been assigned
+        # The PPN fields are contiguous in the PTE word, from PPN[0] up
+        fields = self._layout.pte_fields
+        ppn_bits = self._layout.ppn_mask << PTE_FLAG_BITS
+        if start_level < len(fields):
+            shift = fields[start_level][0]
+            value = (ppn << shift) & (ppn_bits >> shift << shift)  # leaves are zeroed below the used portion of the ppn
+        else:
+            value = 0
+        self.bits = (self.bits & ~ppn_bits) | value
+        self.known |= ppn_bits
 
     # New: make it simpler to find whether it is a leaf
     @property
     def leaf(self):
-        return bool(self.attributes.X or self.attributes.W or self.attributes.R)
+        return bool(self.bits & 0b1110)  # X, W or R (unset bits are 0)
 
-    def finalize(self):
+    def finalize(self, rng: random.Random = random):
         ''' Finalize the PTE flags with reasonable defaults. If there's stuff
          specified within a group (= XWR, AD), you need to specify the whole
          thing or accept zeros filled in as defaults '''
+        # On the flag bits directly (unset bits are 0): this runs for every PTE of every walk
+        bits, known = self.bits, self.known
+        if not known & FLAG_V:
+            bits |= FLAG_V
 
-        if self.attributes.V is None:
-            self.attributes.V = 1
-
-        if self.attributes.X is None and self.attributes.W is None and self.attributes.R is None:
-            xwr = random.choice([0b001, 0b011, 0b100, 0b101, 0b111])
-            self.attributes.X = xwr >> 2
-            self.attributes.W = (xwr >> 1) & 1
-            self.attributes.R = xwr & 1
-
-        if self.attributes.D is None and self.attributes.A is None and self.leaf:
-            ad = random.choice([0b00, 0b10, 0b11])
-            self.attributes.A = ad >> 1
-            self.attributes.D = ad & 1
-
-        self.attributes.RSW = self.attributes.RSW or 0
-        self.attributes.D = self.attributes.D or 0
-        self.attributes.A = self.attributes.A or 0
-        self.attributes.G = self.attributes.G or 0
-        self.attributes.U = self.attributes.U or 0
-        self.attributes.X = self.attributes.X or 0
-        self.attributes.W = self.attributes.W or 0
-        self.attributes.R = self.attributes.R or 0
-        self.attributes.V = self.attributes.V or 0
+        if not known & FLAGS_XWR:
+            bits |= rng.choice(XWR_CHOICES) << 1  # XWR are bits 3..1
+
+        if not known & FLAGS_AD and bits & FLAGS_XWR:
+            ad = rng.choice(AD_CHOICES)
+            bits |= (ad >> 1) << 6 | (ad & 1) << 7  # A is bit 6, D bit 7
+
+        self.bits = bits
+        self.known = known | FLAGS_MASK  # the rest of the unset flags are 0
 
     def set_pointer(self):
         ''' Clear XWR (making this a pointer entry in the table). If they're set, raises an error '''
         ''' For non-leaf PTEs, the D, A, and U bits are reserved for future use and must be cleared by software for forward compatibility. '''
         if self.leaf:
             raise Errors.UnexpectedLeaf(f'PTE is a leaf and was used as a pointer')
-        if self.attributes.U or self.attributes.D or self.attributes.A:
-            raise Errors.InvalidDAU(f'Found DAU = {self.attributes.D}{self.attributes.A}{self.attributes.U}')
-        self.attributes.X = 0
-        self.attributes.W = 0
-        self.attributes.R = 0
-        self.attributes.D = 0
-        self.attributes.A = 0
-        self.attributes.U = 0
+        if self.bits & POINTER_RESERVED_DAU:
+            attributes = self.attributes
+            raise Errors.InvalidDAU(f'Found DAU = {attributes.D}{attributes.A}{attributes.U}')
+        self.bits &= ~POINTER_CLEARED
+        self.known |= POINTER_CLEARED
 
     def assert_pointer(self):
         if self.leaf:
@@ -201,44 +328,26 @@ class PTE:
             raise Errors.WriteNoReadError()
 
     def data(self):
-        # return None  # TODO: handle attrs so this can go through
-        pte = (self.attributes.V | (self.attributes.R << 1) | (self.attributes.W << 2) | (self.attributes.X << 3) |
-               (self.attributes.U << 4) | (self.attributes.G << 5) | (self.attributes.A << 6) | (self.attributes.D << 7)
-               | (self.attributes.RSW << 8))
-
-        ppn = self.get_ppn()
-        if ppn is None:
-            return None
-        return (ppn << 10) | pte
+        ''' The PTE word, None if any of it is unset '''
+        return self._packed(self._layout.pte_mask)
 
     def get_ppn(self):
-        if None in self.ppn:
-            return None
-        accumulated = 0
-        for width, ppn in zip(reversed(self.widths), reversed(self.ppn)):
-            accumulated |= ppn
-            accumulated <<= width
-
-        accumulated >>= width
-        return accumulated
-
-        # if self.mode == 32:
-        #     return (self.ppn[1] << 10) | self.ppn[0]
-        # elif self.mode == 39:
-        #     return (self.ppn[2] << 18) | (self.ppn[1] << 9) | self.ppn[0]
-        # elif self.mode == 48:
-        #     return (self.ppn[3] << 27) | (self.ppn[2] << 18) | (self.ppn[1] << 9) | self.ppn[0]
+        ppn = self._packed(self._layout.ppn_mask << PTE_FLAG_BITS)
+        return None if ppn is None else ppn >> PTE_FLAG_BITS
 
     def __str__(self):
         return self.__format__(DEFAULT_FORMAT)
 
     def jsonify(self):
+        # Straight from the packed word, this runs for every PTE of every walk in the output
+        bits, known = self.bits, self.known
         return {
             'address': self.address,
-            'ppn': self.ppn,
+            'ppn': self._get_fields(self._layout.pte_fields),
             'contents': self.get_ppn(),
             'data': self.data(),
-            'attributes': self.attributes.jsonify()
+            'attributes': {name: (bits >> shift) & mask if (known >> shift) & mask == mask else None
+                           for name, shift, mask in JSON_ATTRIBUTES}
         }
 
     def __format__(self, format_code=DEFAULT_FORMAT):
@@ -262,88 +371,66 @@ class PTE:
         return f'@{safe_to_hex(self.address, addr_digits)} -> {safe_to_hex(self.get_ppn(), ppn_digits)} ({self.attributes})'
 
 
-class VA:
-    vpn = []
-    offset = None
-    mode = 0
-    # isEmpty = True
-    errorMessage = ""
+class VA(Packed):
+    ''' Virtual address, packed (see Packed) '''
+    __slots__ = ()
 
     def __init__(self, data=None, mode=32, isLoad=False):
-        if isLoad:
-            return
-        self.mode = mode
-        if data == None:
-            # self.isEmpty = True
-            self.vpn = [None for i in self.widths if i]
-        else:
-            # self.isEmpty = False
+        super().__init__(mode)
+        if data != None:
             self.set(data)
 
     def set(self, data=0xFFFFFFFFFFFF):
-        self.offset = data & 0xFFF
-        # self.mode = mode
-        self.vpn = []
-
-        if self.mode == 32:
-            self.vpn.append((data >> 12) & 0x3FF)
-            self.vpn.append((data >> 22) & 0x3FF)
-        if self.mode == 39:
-            self.vpn.append((data >> 12) & 0x1FF)
-            self.vpn.append((data >> 21) & 0x1FF)
-            self.vpn.append((data >> 30) & 0x1FF)
-        if self.mode == 48:
-            self.vpn.append((data >> 12) & 0x1FF)
-            self.vpn.append((data >> 21) & 0x1FF)
-            self.vpn.append((data >> 30) & 0x1FF)
-            self.vpn.append((data >> 39) & 0x1FF)
-        # self.isEmpty = False
+        va_mask = self._layout.va_mask
+        if data & ~va_mask:
+            # Sv39 / Sv48 VAs can be given in their canonical 64 bit form, the top bit sign extended
+            sign_bit = va_mask.bit_length() - 1
+            if self.mode == 32 or data >> sign_bit != (1 << (64 - sign_bit)) - 1:
+                raise Errors.InvalidConstraints(f'VA {data:#x} does not fit in Sv{self.mode}')
+        self.bits = data & va_mask
+        self.known = va_mask
+
+    @property
+    def vpn(self) -> FieldView:
+        return FieldView(self, self._layout.vpn_fields)
+
+    @vpn.setter
+    def vpn(self, values: List[int]):
+        self._set_fields(self._layout.vpn_fields, values)
+
+    @property
+    def offset(self) -> Union[int, None]:
+        return self._get(*OFFSET_FIELD)
+
+    @offset.setter
+    def offset(self, value: Union[int, None]):
+        self._set(*OFFSET_FIELD, value)
 
     def get_big_page(self, level=3):
-        big_offset = self.offset
-        width = 0
-        for i in range(level):
-            width += self.widths[i]
-            segment = self.vpn[i]
-            big_offset |= segment << width
-        return big_offset
+        ''' The offset within a page at the given level (the page offset and the VPNs below the level) '''
+        return self._packed((1 << (12 + sum(self.widths[:level]))) - 1)
 
     def set_big_page(self, level, data):
-        self.offset = data & mask(12)
+        self.offset = data & 0xFFF
         data >>= 12
-        for i in range(level):
-            self.vpn[i] = data & mask(self.widths[i])
-            data >>= self.widths[i]  # shift off the bits that've been assigned
+        for shift, mask in self._layout.vpn_fields[:level]:
+            self._set(shift, mask, data & mask)
+            data >>= mask.bit_length()  # shift off the bits that've been assigned
 
     def data(self) -> Union[None, int]:
-        va = None
-        if None not in self.vpn and self.offset != None:
-            va = self.offset
-            if self.mode == 32:
-                va |= (self.vpn[0] << 12) | (self.vpn[1] << 22)
-            if self.mode == 39:
-                va |= (self.vpn[0] << 12) | (self.vpn[1] << 21) | (self.vpn[2] << 30)
-            if self.mode == 48:
-                va |= (self.vpn[0] << 12) | (self.vpn[1] << 21) | (self.vpn[2] << 30) | (self.vpn[3] << 39)
-        return va
+        return self._packed(self._layout.va_mask)
 
     @property
-    def widths(self):
-        if self.mode == 32:
-            return [10, 10, None, None]
-        elif self.mode == 39:
-            return [9, 9, 9, None]
-        elif self.mode == 48:
-            return [9, 9, 9, 9]
-        return [None, None, None, None]
-
-    def randomize(self):
+    def widths(self) -> Tuple[int, ...]:
+        return self._layout.vpn_widths
+
+    def randomize(self, rng: random.Random = random):
         ''' Set random values to unset fields of the VA '''
         for i, width in enumerate(self.widths):
             if self.vpn[i] is None:
-                self.vpn[i] = random.getrandbits(width)
+                self.vpn[i] = rng.getrandbits(width)
         if self.offset is None:
-            self.offset = random.getrandbits(12)
+            self.offset = rng.getrandbits(12)
 
     def __str__(self):
         return self.__format__()
@@ -362,68 +449,52 @@ class VA:
         return f'{header}\n{display_line}\n{val_line}'
 
     def jsonify(self):
-        return {'data': self.data(), 'offset': self.offset, 'vpn': self.vpn}
+        return {'data': self.data(), 'offset': self.offset, 'vpn': self.vpn.copy()}
 
 
-class PA:
-    ppn = []
-    offset = None
-    mode = 0
+class PA(Packed):
+    ''' Physical address, packed (see Packed) '''
+    __slots__ = ()
 
     def __init__(self, data=None, mode=32, isLoad=False):
-        if isLoad:
-            return
-        self.mode = mode
+        super().__init__(mode)
         if data:
             self.set(data)
-            # self.isEmpty = False
-        else:
-            self.ppn = [None for i in self.widths if i != None]
 
     def set(self, data=0x12345678):
-        self.ppn = []
-        self.offset = data & 0xFFF
-        if self.mode == 32:
-            self.ppn.append((data >> 12) & 0x3FF)
-            self.ppn.append((data >> 22) & 0x3FF)
-        if self.mode == 39:
-            self.ppn.append((data >> 12) & 0x1FF)
-            self.ppn.append((data >> 21) & 0x1FF)
-            self.ppn.append((data >> 30) & 0x1FF)
-        if self.mode == 48:
-            self.ppn.append((data >> 12) & 0x1FF)
-            self.ppn.append((data >> 21) & 0x1FF)
-            self.ppn.append((data >> 30) & 0x1FF)
-            self.ppn.append((data >> 39) & 0x1FFFF)
-        # self.isEmpty = False
+        if data & ~self._layout.pa_mask:
+            raise Errors.InvalidConstraints(f'PA {data:#x} does not fit in Sv{self.mode}')
+        self.bits = data
+        self.known = self._layout.pa_mask
+
+    @property
+    def ppn(self) -> FieldView:
+        return FieldView(self, self._layout.pa_fields)
+
+    @ppn.setter
+    def ppn(self, values: List[int]):
+        self._set_fields(self._layout.pa_fields, values)
+
+    @property
+    def offset(self) -> Union[int, None]:
+        return self._get(*OFFSET_FIELD)
+
+    @offset.setter
+    def offset(self, value: Union[int, None]):
+        self._set(*OFFSET_FIELD, value)
 
     def data(self):
-        pa = None
-        if None not in self.ppn and len(self.ppn):
-            pa = self.offset
-            if self.mode == 32:
-                pa |= (self.ppn[0] << 12) | (self.ppn[1] << 22)
-            if self.mode == 39:
-                pa |= (self.ppn[0] << 12) | (self.ppn[1] << 21) | (self.ppn[2] << 30)
-            if self.mode == 48:
-                pa |= (self.ppn[0] << 12) | (self.ppn[1] << 21) | (self.ppn[2] << 30) | (self.ppn[3] << 39)
-        return pa
+        return self._packed(self._layout.pa_mask)
 
     @property
-    def widths(self) -> List[int]:
-        if self.mode == 32:
-            return [10, 12, None, None]
-        elif self.mode == 39:
-            return [9, 9, 17, None]
-        elif self.mode == 48:
-            return [9, 9, 9, 17]
-        return [None, None, None, None]
+    def widths(self) -> Tuple[int, ...]:
+        return self._layout.ppn_widths
 
     def __str__(self):
         return self.__format__(DEFAULT_FORMAT)
 
     def jsonify(self):
-        return {'data': self.data(), 'ppn': self.ppn, 'offset': self.offset}
+        return {'data': self.data(), 'ppn': self.ppn.copy(), 'offset': self.offset}
 
     def __format__(self, format_code=DEFAULT_FORMAT):
         data_str = f'{self.data():x}' if self.data() != None else '???'
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+'''
+Fast loading of the JSON5 configs. The json5 package is pure Python, and takes seconds on configs with
+thousands of test cases. Plain JSON goes straight to the C json parser. JSON5 is first rewritten into JSON
+token by token (comments, unquoted keys, single quoted strings, hex and +/./trailing-dot numbers,
+trailing commas) and then parsed with json. Anything the rewrite doesn't handle -- or that json then
+rejects -- is parsed by json5 instead, so the result (and the errors) are the same as json5.loads.
+'''
+
+import json
+import re
+from typing import IO, Union
+
+import json5
+
+_TOKEN = re.compile(r'''
+    (?P<ws>[ \t\r\n]+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<dstr>"(?:[^"\\\n]|\\.)*")
+  | (?P<sstr>'(?:[^'\\\n]|\\.)*')
+  | (?P<hex>0[xX][0-9a-fA-F]+)  # json5 itself rejects signed hex
+  | (?P<num>[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<punct>[{}\[\]:,])
+''', re.VERBOSE | re.DOTALL)
+
+_SSTR_ESCAPES = re.compile(r'''\\(.)|"''', re.DOTALL)
+_BARE_DOT = re.compile(r'\.(?=$|[eE])')
+
+
+def _sstr(match: re.Match) -> str:
+    if match.group(1) is None:
+        return '\\"'
+    return "'" if match.group(1) == "'" else match.group(0)
+
+
+def _number(token: str) -> str:
+    sign = '-' if token[0] == '-' else ''
+    body = token.lstrip('+-')
+    if body[0] == '.':
+        body = '0' + body
+    return sign + _BARE_DOT.sub('.0', body)
+
+
+def to_json(text: str) -> Union[str, None]:
+    ''' The JSON5 text as JSON, None if it uses something the rewrite doesn't cover '''
+    out = []
+    last = -1  # index in out of the last token that isn't whitespace or a comment
+    last_kind = None
+    pos, end = 0, len(text)
+    match = _TOKEN.match
+    while pos < end:
+        m = match(text, pos)
+        if m is None:
+            return None
+        pos = m.end()
+        kind = m.lastgroup
+        token = m.group()
+        if kind == 'ws' or kind == 'comment':
+            continue
+        if kind == 'sstr':
+            token = '"' + _SSTR_ESCAPES.sub(_sstr, token[1:-1]) + '"'
+        elif kind == 'hex':
+            token = str(int(token, 16))
+        elif kind == 'num':
+            token = _number(token)
+        elif kind == 'punct':
+            if token == ':' and last_kind == 'ident':
+                out[last] = '"' + out[last] + '"'  # an unquoted key (only quoted in front of a colon)
+            elif token in '}]' and last_kind == 'punct' and out[last] == ',':
+                out[last] = ''  # trailing comma
+        out.append(token)
+        last, last_kind = len(out) - 1, kind
+    return ''.join(out)
+
+
+def loads(text: str):
+    ''' json5.loads, faster '''
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    converted = to_json(text)
+    if converted is not None:
+        try:
+            return json.loads(converted)
+        except ValueError:
+            pass
+    return json5.loads(text)
+
+
+def load(f: IO[str]):
+    return loads(f.read())
@@ -20,7 +20,8 @@ new Vue({
     methods: {
         process() {
             console.log('Processing data');
-            fetch('/api/json5', {
+            // Generated as a background job, DisplayPTWs pages through the walks
+            fetch('/api/jobs', {
                 method: 'POST', // or 'PUT'
                 headers: {
                     'Content-Type': 'application/json',
@@ -32,7 +33,7 @@ new Vue({
                     this.show_error = true;
                     return;
                 }
-                this.results.push(data);
+                this.results.push(data);  // the job state, with its id
                 // console.log(this.results);
                 // this.walksets.push(data.walks);
             })
@@ -50,8 +51,11 @@ new Vue({
             saveAs(blob, "code.json5");
         },
         download_results() {
-            var blob = new Blob([JSON.stringify(this.results, null, 4)], { type: "application/json;charset=utf-8" });
-            saveAs(blob, "results.json");
+            var results = this.results.map(job => fetch('/api/jobs/' + job.id + '/result').then(response => response.json()));
+            Promise.all(results).then(results => {
+                var blob = new Blob([JSON.stringify(results, null, 4)], { type: "application/json;charset=utf-8" });
+                saveAs(blob, "results.json");
+            });
         },
         prettify() {
             this.code = js_beautify(this.code, { brace_style: 'none,preserve-inline' });
@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+'''
+Lookup structures over what the Context has generated so far, kept up to date as walks are registered.
+'''
+
+import bisect
+import random
+from typing import Dict, List, Set, Tuple, Union
+
+from constants import PAGE_SHIFT
+
+PAGE_OFFSET_MASK = (1 << PAGE_SHIFT) - 1
+
+
+class TableIndex:
+    '''
+    The page table pages in use: table base address -> the slots (VPNs) taken in it,
+    and for the slots that point to a next level table, that table's base address.
+    Used by the packed PTE placement to put new walks into the existing tables.
+    Free slots handed out for the walk being resolved are held as pending (a table can come up twice in one walk,
+    e.g. with reuse_pte) until the walk is registered or dropped, like in the FrameAllocator.
+    '''
+    def __init__(self, slot_bits: int, alignment_bits: int):
+        self.slots = 1 << slot_bits  # slots per table
+        self.alignment_bits = alignment_bits
+        self.used: Dict[int, Set[int]] = {}
+        self.children: Dict[int, Dict[int, int]] = {}
+        self.pending: Set[int] = set()  # PTE addresses
+
+    def add(self, address: int, child: Union[int, None] = None):
+        ''' Record the PTE at address as taken, and if it's a pointer, the base of the table it points to '''
+        table = address & ~PAGE_OFFSET_MASK
+        slot = (address & PAGE_OFFSET_MASK) >> self.alignment_bits
+        self.used.setdefault(table, set()).add(slot)
+        if child is not None:
+            self.children.setdefault(table, {})[slot] = child
+
+    def drop_pending(self):
+        self.pending = set()
+
+    def is_open(self, table: int) -> bool:
+        ''' Whether the table has a free slot left '''
+        return len(self.used.get(table, ())) < self.slots
+
+    def open_child(self, table: int, allowed: Union[List[int], None] = None, rng: random.Random = random) -> Union[int, None]:
+        ''' A random slot of the table that points to a table with room left (None if there's none) '''
+        children = self.children.get(table, {})
+        candidates = [slot for slot, child in children.items() if self.is_open(child) and (allowed is None or slot in allowed)]
+        return rng.choice(candidates) if candidates else None
+
+    def free_slot(self, table: int, allowed: Union[List[int], None] = None, rng: random.Random = random) -> Union[int, None]:
+        ''' A random free slot of the table (None if it's full) '''
+        used = self.used.get(table, set())
+        if self.pending:
+            used = used | {(address & PAGE_OFFSET_MASK) >> self.alignment_bits for address in self.pending if address & ~PAGE_OFFSET_MASK == table}
+        for _ in range(8):  # quick tries while the table is still mostly empty
+            slot = rng.choice(allowed) if allowed else rng.randrange(self.slots)
+            if slot not in used:
+                break
+        else:
+            candidates = [slot for slot in (allowed or range(self.slots)) if slot not in used]
+            if not candidates:
+                return None
+            slot = rng.choice(candidates)
+        self.pending.add(table | slot << self.alignment_bits)
+        return slot
+
+    def merge(self, other: 'TableIndex'):
+        for table, slots in other.used.items():
+            self.used.setdefault(table, set()).update(slots)
+        for table, children in other.children.items():
+            self.children.setdefault(table, {}).update(children)
+
+
+REUSE_WEIGHTS = ('uniform', 'hot', 'cold')
+
+
+class _PrefixSums:
+    ''' Prefix sums (a Fenwick tree) over counts that only grow, and only get appended to '''
+    def __init__(self, counts: List[int] = ()):
+        self.tree = [0]  # 1-based: tree[i] is the sum of the counts in (i - lowbit(i), i]
+        self.total = 0
+        for count in counts:
+            self.append(count)
+
+    def append(self, count: int):
+        i = len(self.tree)
+        value, step = count, 1
+        while step < i & -i:
+            value += self.tree[i - step]
+            step <<= 1
+        self.tree.append(value)
+        self.total += count
+
+    def add(self, index: int, count: int):
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += count
+            i += i & -i
+        self.total += count
+
+    def find(self, value: int) -> int:
+        ''' The index of the count that value (0 <= value < total) falls in '''
+        position, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if position + step < len(self.tree) and self.tree[position + step] <= value:
+                position += step
+                value -= self.tree[position]
+            step >>= 1
+        return position
+
+    def prefix(self, index: int) -> int:
+        ''' The sum of the counts before index '''
+        total = 0
+        while index:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class _HotPool:
+    ''' A pool as the hot weighting draws from it: each PTE once per walk through it, as if listed that many times '''
+    def __init__(self, pool: List[int], sums: _PrefixSums):
+        self.pool = pool
+        self.sums = sums
+
+    def __len__(self) -> int:
+        return self.sums.total
+
+    def __getitem__(self, index: int) -> int:
+        return self.pool[self.sums.find(index)]
+
+Key = Tuple[int, bool, Union[int, None]]  # (level, leaf, root table), see ReuseIndex
+
+
+class ReuseIndex:
+    '''
+    The PTEs of the valid walks so far, for reuse_pte to pick from: by the level they're at and their role
+    (pointer or leaf), and at the top level also by root table, since only the PTEs in a walk's own root table
+    can start it. The page size of a walk decides which (level, role) pairs it can take, so that's all it takes.
+    For the leaves, the PA of a walk through them is kept too (aliasing along with reuse_pte takes that PA).
+
+    Picks are one draw from a list, for each of REUSE_WEIGHTS:
+    - uniform: every PTE once (pools)
+    - hot: a PTE once per walk through it, so the shared tables come up in proportion to how shared they are
+      (prefix sums of the counts, over the pool: made the first time a hot pick is asked for, kept up from then on)
+    - cold: the PTEs with the fewest walks through them so far (tiers: count -> PTEs, moved up a tier per walk)
+    '''
+    def __init__(self, top_level: int):
+        self.top_level = top_level
+        self.pools: Dict[Key, List[int]] = {}  # -> PTE addresses
+        self.pool_positions: Dict[int, int] = {}  # PTE address -> where it is in its pool
+        self.hot: Dict[Key, _PrefixSums] = {}  # -> the counts of the pool's PTEs, for the keys hot picks were asked for
+        self.tiers: Dict[Key, Dict[int, List[int]]] = {}
+        self.counts: Dict[int, int] = {}  # PTE address -> walks through it
+        self.keys: Dict[int, Key] = {}
+        self.positions: Dict[int, int] = {}  # PTE address -> where it is in its tier
+        self.leaf_pas: Dict[int, int] = {}
+
+    def _key(self, address: int, level: int, leaf: bool) -> Key:
+        return level, leaf, address & ~PAGE_OFFSET_MASK if level == self.top_level else None
+
+    def _count(self, address: int, key: Key, walks: int):
+        ''' Add walks to the count of the PTE, moving it up its tiers '''
+        tiers = self.tiers.setdefault(key, {})
+        count = self.counts.get(address, 0)
+        if count:  # out of its tier: the last one takes its place
+            tier = tiers[count]
+            position = self.positions[address]
+            last = tier.pop()
+            if last != address:
+                tier[position] = last
+                self.positions[last] = position
+            if not tier:
+                del tiers[count]
+        else:
+            pool = self.pools.setdefault(key, [])
+            self.pool_positions[address] = len(pool)
+            pool.append(address)
+            self.keys[address] = key
+        sums = self.hot.get(key)
+        if sums is not None:
+            if count:
+                sums.add(self.pool_positions[address], walks)
+            else:
+                sums.append(walks)
+        count += walks
+        self.counts[address] = count
+        tier = tiers.setdefault(count, [])
+        self.positions[address] = len(tier)
+        tier.append(address)
+
+    def add(self, address: int, level: int, leaf: bool, pa: Union[int, None] = None):
+        ''' Record a walk through the PTE at address '''
+        key = self.keys.get(address) or self._key(address, level, leaf)
+        self._count(address, key, 1)
+        if leaf:
+            self.leaf_pas.setdefault(address, pa)
+
+    def pool(self, level: int, leaf: bool, root: Union[int, None] = None) -> List[int]:
+        ''' The PTE addresses at the level with the role (in the root table at root, for the top level) '''
+        return self.pools.get((level, leaf, root if level == self.top_level else None), [])
+
+    def lists(self, keys: List[Key], weight: str = 'uniform') -> List[List[int]]:
+        ''' For each key, the list a pick with the weight draws from (see REUSE_WEIGHTS) '''
+        if weight == 'hot':
+            return [self._hot(key) for key in keys]
+        if weight == 'cold':
+            tiers = [self.tiers.get(key, {}) for key in keys]
+            lowest = min((min(tier) for tier in tiers if tier), default=0)
+            return [tier.get(lowest, []) for tier in tiers]
+        return [self.pools.get(key, []) for key in keys]
+
+    def _hot(self, key: Key) -> Union[_HotPool, list]:
+        pool = self.pools.get(key)
+        if not pool:
+            return []
+        sums = self.hot.get(key)
+        if sums is None:
+            sums = self.hot[key] = _PrefixSums([self.counts[address] for address in pool])
+        return _HotPool(pool, sums)
+
+    def merge(self, other: 'ReuseIndex'):
+        for address, walks in other.counts.items():
+            self._count(address, self.keys.get(address) or other.keys[address], walks)
+        for address, pa in other.leaf_pas.items():
+            self.leaf_pas.setdefault(address, pa)
+
+
+SORTED_BLOCK = 512  # values per block of a _SortedBlocks (split in two at twice that)
+
+
+class _SortedBlocks:
+    '''
+    Sorted values (each once) in blocks, with prefix sums over the block sizes:
+    an insert goes into one block, and a rank or an index finds its block in O(log n).
+    '''
+    def __init__(self, values: List[int]):
+        values = sorted(values)
+        self.blocks = [values[i:i + SORTED_BLOCK] for i in range(0, len(values), SORTED_BLOCK)]
+        self._index()
+
+    def _index(self):
+        self.mins = [block[0] for block in self.blocks]
+        self.sizes = _PrefixSums([len(block) for block in self.blocks])
+
+    def __len__(self) -> int:
+        return self.sizes.total
+
+    def add(self, value: int):
+        if not self.blocks:
+            self.blocks.append([value])
+            self._index()
+            return
+        i = max(0, bisect.bisect_right(self.mins, value) - 1)
+        block = self.blocks[i]
+        bisect.insort(block, value)
+        self.mins[i] = block[0]
+        if len(block) > 2 * SORTED_BLOCK:
+            self.blocks[i:i + 1] = [block[:SORTED_BLOCK], block[SORTED_BLOCK:]]
+            self._index()
+        else:
+            self.sizes.add(i, 1)
+
+    def rank(self, value: int) -> int:
+        ''' How many values are below value '''
+        i = bisect.bisect_left(self.mins, value) - 1
+        if i < 0:
+            return 0
+        return self.sizes.prefix(i) + bisect.bisect_left(self.blocks[i], value)
+
+    def __getitem__(self, index: int) -> int:
+        i = self.sizes.find(index)
+        return self.blocks[i][index - self.sizes.prefix(i)]
+
+
+class PAIndex:
+    '''
+    The PAs of the valid walks so far, for aliasing to pick from: in the order they were first mapped (like Context.pas),
+    and by the level of the leaf that mapped them first (its page size). A position map keeps every PA in once.
+    A pick in a region ranks the region's ends in a sorted copy of its pool (see _SortedBlocks). The copy is made
+    on the first such pick and kept up to date from then on, so configs without alias_region never pay for sorting.
+    '''
+    def __init__(self):
+        self.pas: List[int] = []
+        self.by_level: Dict[int, List[int]] = {}
+        self.positions: Dict[int, int] = {}  # PA -> where it is in pas
+        self.sorted: Dict[Union[int, None], _SortedBlocks] = {}  # level (None for all of pas) -> its pool, sorted
+
+    def __len__(self) -> int:
+        return len(self.pas)
+
+    def add(self, pa: int, level: int):
+        if pa in self.positions:
+            return
+        self.positions[pa] = len(self.pas)
+        self.pas.append(pa)
+        self.by_level.setdefault(level, []).append(pa)
+        self._sort_in(pa, level)
+
+    def _sort_in(self, pa: int, level: int):
+        for key in (None, level):
+            view = self.sorted.get(key)
+            if view is not None:
+                view.add(pa)
+
+    def _sorted(self, level: Union[int, None]) -> _SortedBlocks:
+        ''' The pool of level (or of all PAs) sorted, made the first time it's asked for '''
+        view = self.sorted.get(level)
+        if view is None:
+            view = self.sorted[level] = _SortedBlocks(self.pas if level is None else self.by_level.get(level, []))
+        return view
+
+    def pick(self, rng: random.Random, level: Union[int, None] = None, region: Union[Tuple[int, int], None] = None) -> Union[int, None]:
+        '''
+        A random PA, of the page size at level if given, in [start, end) of region if given (None if there's none).
+        '''
+        if region is None:
+            pool = self.pas if level is None else self.by_level.get(level, [])
+            return rng.choice(pool) if pool else None
+        pool = self._sorted(level)
+        low, high = pool.rank(region[0]), pool.rank(region[1])
+        return pool[low + rng.randrange(high - low)] if low < high else None
+
+    def merge(self, other: 'PAIndex'):
+        for level, pas in other.by_level.items():
+            for pa in pas:
+                if pa not in self.positions:
+                    self.by_level.setdefault(level, []).append(pa)
+                    view = self.sorted.get(level)
+                    if view is not None:
+                        view.add(pa)
+        for pa in other.pas:
+            if pa not in self.positions:
+                self.positions[pa] = len(self.pas)
+                self.pas.append(pa)
+                view = self.sorted.get(None)
+                if view is not None:
+                    view.add(pa)
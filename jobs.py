@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+'''
+Background generation jobs for the web API, so a large config doesn't run inside a request.
+A job generates its config on a worker thread, one walk at a time (iter_walks on a streaming Context),
+and keeps the walks as they come (in a WalkStore) so clients can follow along from any point, and cancel it.
+The summary counts are kept up to date as the walks come, so polling a running job doesn't go over all of them.
+
+Jobs only live in the memory of the process that runs them: serve the app from a single process
+(use threads for concurrency, like the Procfile does).
+'''
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Set, Union
+
+from Context import Context, ContextFromParams, iter_walks
+from Translator import TranslationWalk
+from simulator_errors import Errors
+from walk_store import WalkStore
+
+JOB_WORKERS = 2  # jobs generating at once, the rest wait in the queue
+JOB_HISTORY = 32  # finished jobs kept around for their results, oldest dropped first
+
+RESULT_PAGE_LIMIT = 500  # most walks handed out in one window
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def error_message(error: Exception) -> str:
+    ''' What to tell the API user about a failed generation '''
+    if isinstance(error, Errors.InvalidConstraints):
+        return str(error) or "Couldn't satisfy the provided constraints"
+    if isinstance(error, Errors.OutOfMemory):
+        return str(error) or 'Not enough free memory for the page tables and pages'
+    if isinstance(error, Errors.UnexpectedLeaf):
+        return "Constraints caused an unexpected leaf"
+    if isinstance(error, Errors.LeafMarkedAsPointer):
+        return "Constraints given caused a leaf to be used as a pointer"
+    if isinstance(error, ValueError):
+        return 'JSON5 syntax error'
+    return 'Unknown runtime error'
+
+
+def expected_walks(params: dict) -> Union[int, None]:
+    ''' How many walks the config makes, None if it can't be told up front (page ranges without num_pages) '''
+    total = 0
+    for test_case in params.get('test_cases', []):
+        if rg := test_case.get('page_range'):
+            if rg.get('num_pages') is None:
+                return None
+            total += rg['num_pages']
+        else:
+            total += test_case.get('repeats', 1)
+    return total
+
+
+class _Shared:
+    '''
+    Which walks reference a key (VA, PA or PTE address) that counter has at more than one, as the walks come.
+    The counter is the Context's; every key a walk adds to it is one the walk references, so a key only has to be
+    looked at when a walk referencing it comes. Until it's shared, the walks referencing it wait on it.
+    '''
+    def __init__(self, counter: dict):
+        self.counter = counter
+        self.waiting: Dict[int, List[int]] = {}  # key not shared yet -> the walks referencing it
+        self.shared: Set[int] = set()
+        self.flagged = bytearray()  # per walk
+        self.count = 0  # walks flagged
+
+    def _flag(self, index: int):
+        if not self.flagged[index]:
+            self.flagged[index] = 1
+            self.count += 1
+
+    def add(self, index: int, keys: Iterable[Union[int, None]]):
+        ''' Walk index (the next one) references keys '''
+        self.flagged.append(0)
+        for key in keys:
+            if key is None:
+                continue
+            if key in self.shared:
+                self._flag(index)
+                continue
+            self.waiting.setdefault(key, []).append(index)
+            if self.counter.get(key, 0) > 1:
+                self.shared.add(key)
+                for waiting in self.waiting.pop(key):
+                    self._flag(waiting)
+
+
+class Job:
+    '''
+    One config being generated. walks grows as they're made; status goes
+    queued -> running -> done / failed / cancelled. Readers wait on changed for new walks.
+    '''
+    def __init__(self, params: dict):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = QUEUED
+        self.error: Union[str, None] = None
+        self.total = expected_walks(params)
+        self.walks = WalkStore(params.get('mode'))
+        self.mgr: Union[Context, None] = None
+        # the summary counts, see _count
+        self.pagesizes: Dict[str, int] = {}
+        self.error_types: Dict[str, int] = {}
+        self.same_va_pa = 0
+        self.va_shared = self.pa_shared = self.pte_shared = None
+        self.created = time.time()
+        self.finished: Union[float, None] = None
+        self.cancelled = threading.Event()
+        self.changed = threading.Condition()
+        self._summary: Union[dict, None] = None  # once finished
+
+    def _finish(self, status: str, error: Union[str, None] = None):
+        with self.changed:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self.changed.notify_all()
+
+    def run(self):
+        if self.cancelled.is_set():
+            self._finish(CANCELLED)
+            return
+        with self.changed:
+            self.status = RUNNING
+        try:
+            self.mgr = mgr = ContextFromParams(self.params, keep_walks=False)
+            with self.changed:
+                self.va_shared = _Shared(mgr.va_reference_counter)
+                self.pa_shared = _Shared(mgr.reference_counter)
+                self.pte_shared = _Shared(mgr.reference_counter)
+            for walk in iter_walks(mgr, self.params):
+                if self.cancelled.is_set():
+                    self._finish(CANCELLED)
+                    return
+                with self.changed:
+                    self._count(walk)
+                    self.walks.append(walk)
+                    self.changed.notify_all()
+        except Exception as e:
+            self._finish(FAILED, error_message(e))
+            return
+        self._finish(DONE)
+
+    def _count(self, walk: TranslationWalk):
+        ''' Add the walk (the next one, with the Context's counters already counting it) to the summary counts '''
+        index = len(self.walks)
+        self.pagesizes[walk.pagesize] = self.pagesizes.get(walk.pagesize, 0) + 1
+        error_type = getattr(walk, 'error_type', None) or 'none'
+        self.error_types[error_type] = self.error_types.get(error_type, 0) + 1
+        va, pa = walk.va.data(), walk.pa.data()
+        self.same_va_pa += va == pa
+        self.va_shared.add(index, (va,))
+        self.pa_shared.add(index, (pa,))
+        self.pte_shared.add(index, (pte.address for pte in walk.ptes))
+
+    def cancel(self):
+        ''' Stops at the next walk (a queued job doesn't start) '''
+        self.cancelled.set()
+
+    def state(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'walks': len(self.walks),
+            'total': self.total,
+            'seed': self.mgr.seed if self.mgr else self.params.get('seed'),
+            'elapsed': (self.finished or time.time()) - self.created,
+        }
+
+    def follow(self, since: int = 0, timeout: Union[float, None] = None) -> Iterator[Union[TranslationWalk, None]]:
+        '''
+        The walks from index since on, waiting for new ones until the job finishes.
+        With a timeout, yields None when nothing came for that long (to send keepalives).
+        '''
+        index = since
+        while True:
+            with self.changed:
+                if index >= len(self.walks) and self.status not in FINISHED:
+                    self.changed.wait(timeout)
+                walks = self.walks[index:]
+                finished = self.status in FINISHED
+            if not walks and not finished:
+                yield None
+            for walk in walks:
+                yield walk
+            index += len(walks)
+            if finished and index >= len(self.walks):
+                return
+
+    def window(self, offset: int, limit: int) -> List[dict]:
+        '''
+        Walks [offset, offset + limit) as Context.jsonify_color has them. The reuse flags are
+        as of the walks generated so far, so they can still change while the job runs.
+        '''
+        mgr = self.mgr
+        if mgr is None:
+            return []
+        pte_memo = {}
+        return [walk.jsonify_color(mgr.va_reference_counter, mgr.reference_counter, pte_memo)
+                for walk in self.walks[offset:offset + limit]]
+
+    def result(self) -> dict:
+        ''' The same document as Context.jsonify_color, for a finished job '''
+        return {**self.mgr.jsonify_header(), 'walks': self.window(0, len(self.walks))}
+
+    def summary(self) -> dict:
+        '''
+        Walk counts by page size, by error type ('none' for valid walks), and of the walks
+        jsonify_color flags: VA = PA, VA used by other walks, PA used by other walks (aliases),
+        PTEs shared with other walks.
+        '''
+        if self._summary is not None:
+            return self._summary
+        with self.changed:
+            finished = self.status in FINISHED
+            flags = {'same_va_pa': self.same_va_pa, 'va_reuse': 0, 'pa_reuse': 0, 'pte_reuse': 0}
+            if self.va_shared is not None:
+                flags.update(va_reuse=self.va_shared.count, pa_reuse=self.pa_shared.count, pte_reuse=self.pte_shared.count)
+            summary = {**self.state(), 'pagesize': dict(self.pagesizes), 'error_type': dict(self.error_types), 'flags': flags}
+        if finished:
+            self._summary = summary
+        return summary
+
+
+class JobQueue:
+    ''' The jobs of the process, run on a thread pool '''
+    def __init__(self, workers: int = JOB_WORKERS, history: int = JOB_HISTORY):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.history = history
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, params: dict) -> Job:
+        job = Job(params)
+        with self.lock:
+            self._forget()
+            self.jobs[job.id] = job
+        self.pool.submit(job.run)
+        return job
+
+    def _forget(self):
+        ''' Drop the oldest finished jobs past the history size '''
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.history + 1)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Union[Job, None]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Union[Job, None]:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+'''
+Bit layouts of the translation types, per mode: the field widths, and the (shift, mask) pairs that
+pull the fields out of the packed ints the types store. Computed once here, instead of on every access.
+The shapes of the walks, per mode and page size, likewise (see WalkShape).
+Everything per mode comes from the tables below, so a new mode (e.g. Sv57) is a new entry in each.
+'''
+
+from typing import Dict, Tuple
+
+from constants import MODE_PAGESIZE_LEVEL_MAP, PAGE_SHIFT
+
+Field = Tuple[int, int]  # (shift, mask)
+
+# Flag bits at the bottom of the PTE word, below the PPN: name -> (shift, width)
+ATTRIBUTE_FIELDS = {
+    'V': (0, 1),
+    'R': (1, 1),
+    'W': (2, 1),
+    'X': (3, 1),
+    'U': (4, 1),
+    'G': (5, 1),
+    'A': (6, 1),
+    'D': (7, 1),
+    'RSW': (8, 2),
+}
+PTE_FLAG_BITS = 10
+FLAGS_MASK = (1 << PTE_FLAG_BITS) - 1
+
+OFFSET_FIELD: Field = (0, (1 << PAGE_SHIFT) - 1)
+
+VPN_WIDTHS = {32: (10, 10), 39: (9, 9, 9), 48: (9, 9, 9, 9)}
+# Shared by the PTE and the PA
+PPN_WIDTHS = {32: (10, 12), 39: (9, 9, 26), 48: (9, 9, 9, 17)}
+PTE_SIZES = {32: 4, 39: 8, 48: 8}  # bytes in memory
+
+
+def _fields(widths: Tuple[int, ...], shift: int) -> Tuple[Field, ...]:
+    ''' (shift, mask) of each field, packed from the given bit up '''
+    fields = []
+    for width in widths:
+        fields.append((shift, (1 << width) - 1))
+        shift += width
+    return tuple(fields)
+
+
+class Layout:
+    ''' The precomputed tables for one mode '''
+    __slots__ = ('mode', 'vpn_widths', 'ppn_widths', 'vpn_fields', 'pa_fields', 'pte_fields', 'va_mask', 'pa_mask',
+                 'ppn_mask', 'pte_mask', 'pte_size', 'alignment_bits', 'slot_bits', 'pa_bits', 'ppn_bits', 'top_level')
+
+    def __init__(self, mode: int):
+        self.mode = mode
+        self.vpn_widths = VPN_WIDTHS[mode]
+        self.ppn_widths = PPN_WIDTHS[mode]
+        self.vpn_fields = _fields(self.vpn_widths, PAGE_SHIFT)  # in the VA
+        self.pa_fields = _fields(self.ppn_widths, PAGE_SHIFT)  # in the PA
+        self.pte_fields = _fields(self.ppn_widths, PTE_FLAG_BITS)  # in the PTE word
+        self.va_mask = (1 << (PAGE_SHIFT + sum(self.vpn_widths))) - 1
+        self.pa_mask = (1 << (PAGE_SHIFT + sum(self.ppn_widths))) - 1
+        self.ppn_mask = (1 << sum(self.ppn_widths)) - 1
+        self.pte_mask = (self.ppn_mask << PTE_FLAG_BITS) | FLAGS_MASK
+        self.pte_size = PTE_SIZES[mode]
+        self.alignment_bits = self.pte_size.bit_length() - 1  # of a PTE address
+        self.slot_bits = self.vpn_widths[0]  # of a VPN: the slots of a table
+        self.ppn_bits = sum(self.ppn_widths)  # also the width of the SATP PPN
+        self.pa_bits = PAGE_SHIFT + self.ppn_bits
+        self.top_level = len(self.vpn_widths) - 1
+
+    @property
+    def levels(self) -> int:
+        return len(self.vpn_widths)
+
+    def __reduce__(self):
+        # Pickle (e.g. going to/from worker processes) as a reference to the shared table
+        return layout, (self.mode,)
+
+
+LAYOUTS: Dict[int, Layout] = {mode: Layout(mode) for mode in PPN_WIDTHS}
+
+
+def layout(mode: int) -> Layout:
+    return LAYOUTS[mode]
+
+
+class WalkShape:
+    '''
+    The precomputed tables for the walks of one mode and page size: the levels they go through (top first),
+    and the bits of the page the leaf maps.
+    '''
+    __slots__ = ('mode', 'pagesize', 'start_level', 'end_level', 'levels', 'num_ptes', 'page_shift', 'page_mask')
+
+    def __init__(self, mode: int, pagesize: str):
+        self.mode = mode
+        self.pagesize = pagesize
+        self.start_level = LAYOUTS[mode].top_level
+        self.end_level = MODE_PAGESIZE_LEVEL_MAP[mode][pagesize]
+        self.levels = tuple(range(self.start_level, self.end_level - 1, -1))
+        self.num_ptes = len(self.levels)
+        self.page_shift = LAYOUTS[mode].vpn_fields[self.end_level][0]  # the bits below go straight from the VA to the PA
+        self.page_mask = (1 << self.page_shift) - 1
+
+    def __reduce__(self):
+        return shape, (self.mode, self.pagesize)
+
+
+SHAPES: Dict[Tuple[int, str], WalkShape] = {(mode, pagesize): WalkShape(mode, pagesize)
+                                           for mode in LAYOUTS for pagesize in MODE_PAGESIZE_LEVEL_MAP[mode]}
+
+
+def shape(mode: int, pagesize: str) -> WalkShape:
+    return SHAPES[mode, pagesize]
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+'''
+Memory images of the generated page tables: every PTE's data() at its address, little endian,
+4 bytes wide in Sv32 and 8 in Sv39/48. Built in one pass over the Context's PTEs, straight into 4K page buffers.
+
+Formats:
+- pages: a list of the populated pages. A header (magic, mode, page size, page count), then per page
+  its address (u64) and its 4096 bytes, in address order. Read back with PageImage (mmap backed).
+- raw: a flat image of the memory from the lowest populated page on, written as a sparse file
+  (only the populated pages take up space on disk). Only practical when the tables are close together
+  (pte_min / pte_max, or the packed placement) -- the file is as long as the span of the tables.
+- hex: $readmemh text, one PTE word per line, with an @ word address before every discontinuity.
+- elf: an ELF64 (EM_RISCV) with one PT_LOAD segment per populated page, at its physical address.
+'''
+
+import mmap
+import struct
+from typing import BinaryIO, Dict, IO, Iterable, Iterator, Tuple
+
+from constants import PAGE_SHIFT
+from core_types import PTE
+from layouts import layout
+
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+PAGES_MAGIC = b'T4VPAGES'
+PAGES_HEADER = struct.Struct('<8sIIQ')  # magic, mode, page size, page count
+PAGE_ADDRESS = struct.Struct('<Q')
+
+PTE_FORMATS = {4: '<I', 8: '<Q'}
+
+# ELF64
+EM_RISCV = 243
+ET_EXEC = 2
+PT_LOAD = 1
+PF_W, PF_R = 2, 4
+PN_XNUM = 0xffff  # more segments than e_phnum holds, the count goes in the first section header
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+PROGRAM_HEADER = struct.Struct('<IIQQQQQQ')
+SECTION_HEADER = struct.Struct('<IIQQQQIIQQ')
+
+
+def build_pages(ptes: Iterable[PTE], mode: int) -> Dict[int, bytearray]:
+    ''' Page address -> page contents, for the pages with PTEs in them. PTEs that aren't fully defined are left as 0 '''
+    pte_format = PTE_FORMATS[layout(mode).pte_size]
+    page_mask = PAGE_SIZE - 1
+    pages: Dict[int, bytearray] = {}
+    for pte in ptes:
+        data = pte.data()
+        if data is None or pte.address is None:
+            continue
+        base = pte.address & ~page_mask
+        page = pages.get(base)
+        if page is None:
+            page = pages[base] = bytearray(PAGE_SIZE)
+        struct.pack_into(pte_format, page, pte.address & page_mask, data)
+    return pages
+
+
+def write_pages(f: BinaryIO, pages: Dict[int, bytearray], mode: int):
+    f.write(PAGES_HEADER.pack(PAGES_MAGIC, mode, PAGE_SIZE, len(pages)))
+    for address in sorted(pages):
+        f.write(PAGE_ADDRESS.pack(address))
+        f.write(pages[address])
+
+
+def write_raw(f: BinaryIO, pages: Dict[int, bytearray]) -> int:
+    ''' Seeks over the gaps, so they're holes in the file. Returns the address the image starts at '''
+    base = min(pages, default=0)
+    for address in sorted(pages):
+        f.seek(address - base)
+        f.write(pages[address])
+    return base
+
+
+def write_readmemh(f: IO[str], ptes: Iterable[PTE], mode: int):
+    ''' The @ addresses are in PTE words, as $readmemh expects for a memory of PTE wide words '''
+    size = layout(mode).pte_size
+    words = []
+    for pte in ptes:
+        data = pte.data()
+        if data is not None and pte.address is not None:
+            words.append((pte.address, data))
+    words.sort()
+    expected = None
+    for address, data in words:
+        if address != expected:
+            f.write(f'@{address // size:x}\n')
+        f.write(f'{data:0{size * 2}x}\n')
+        expected = address + size
+
+
+def write_elf(f: BinaryIO, pages: Dict[int, bytearray]):
+    count = len(pages)
+    phoff = ELF_HEADER.size
+    shoff = phoff + count * PROGRAM_HEADER.size
+    data_offset = -(-(shoff + SECTION_HEADER.size) // PAGE_SIZE) * PAGE_SIZE  # segments are page aligned in the file
+    ident = b'\x7fELF' + bytes([2, 1, 1]) + bytes(9)  # 64 bit, little endian, version 1
+    f.write(ELF_HEADER.pack(ident, ET_EXEC, EM_RISCV, 1, 0, phoff, shoff, 0, ELF_HEADER.size, PROGRAM_HEADER.size,
+                            min(count, PN_XNUM), SECTION_HEADER.size, 1, 0))
+    addresses = sorted(pages)
+    for i, address in enumerate(addresses):
+        f.write(PROGRAM_HEADER.pack(PT_LOAD, PF_R | PF_W, data_offset + i * PAGE_SIZE, address, address, PAGE_SIZE,
+                                    PAGE_SIZE, PAGE_SIZE))
+    f.write(SECTION_HEADER.pack(0, 0, 0, 0, 0, 0, 0, count if count >= PN_XNUM else 0, 0, 0))
+    f.seek(data_offset)
+    for address in addresses:
+        f.write(pages[address])
+
+
+IMAGE_FORMATS = ('pages', 'raw', 'hex', 'elf')
+
+
+def write_image(filename: str, ptes: Iterable[PTE], mode: int, image_format: str = 'pages'):
+    ''' Write the memory image of the PTEs (e.g. Context.ptes.values()) in one of IMAGE_FORMATS '''
+    if image_format == 'hex':
+        with open(filename, 'w') as f:
+            write_readmemh(f, ptes, mode)
+        return
+    pages = build_pages(ptes, mode)
+    with open(filename, 'wb') as f:
+        if image_format == 'pages':
+            write_pages(f, pages, mode)
+        elif image_format == 'raw':
+            write_raw(f, pages)
+        elif image_format == 'elf':
+            write_elf(f, pages)
+        else:
+            raise ValueError(f'Unknown image format {image_format!r}, expected one of {IMAGE_FORMATS}')
+
+
+class PageImage:
+    '''
+    A pages format image, memory mapped. Only the page addresses are read up front (to index the pages),
+    the contents are read from the file as they're accessed.
+
+        with PageImage('image.bin') as image:
+            image.read_pte(address)
+    '''
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.mode, page_size, count = PAGES_HEADER.unpack_from(self.map, 0)
+        if magic != PAGES_MAGIC or page_size != PAGE_SIZE:
+            self.close()
+            raise ValueError(f'{filename} is not a pages memory image')
+        self.pte_format = PTE_FORMATS[layout(self.mode).pte_size]
+        stride = PAGE_ADDRESS.size + PAGE_SIZE
+        offsets = range(PAGES_HEADER.size, PAGES_HEADER.size + count * stride, stride)
+        self.offsets: Dict[int, int] = {PAGE_ADDRESS.unpack_from(self.map, offset)[0]: offset + PAGE_ADDRESS.size
+                                        for offset in offsets}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __contains__(self, address: int) -> bool:
+        ''' Whether the page around address is in the image '''
+        return address & ~(PAGE_SIZE - 1) in self.offsets
+
+    def page(self, address: int) -> bytes:
+        ''' The contents of the page around address. Raises KeyError if it's not in the image '''
+        offset = self.offsets[address & ~(PAGE_SIZE - 1)]
+        return self.map[offset:offset + PAGE_SIZE]
+
+    def pages(self) -> Iterator[Tuple[int, bytes]]:
+        for address in self.offsets:
+            yield address, self.page(address)
+
+    def read_pte(self, address: int) -> int:
+        ''' The PTE word at address (0 in a populated page where nothing was written) '''
+        offset = self.offsets[address & ~(PAGE_SIZE - 1)]
+        return struct.unpack_from(self.pte_format, self.map, offset + (address & (PAGE_SIZE - 1)))[0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+'''
+Reference page table walker: translates a VA the way the hardware does (the RISC-V privileged spec,
+"Virtual Address Translation Process"), reading the PTE words from a memory image only.
+It doesn't know how the walks were generated, so it can be used to cross check the generator:
+verify_context re-translates every walk of a Context and reports the ones that don't match.
+
+Faults are reported with the InvalidTranslationWalk.error_type strings:
+- V = 0 (including an address nothing was written to): ERROR_PTE_INVALID
+- R = 0 and W = 1: ERROR_WRITE_NO_READ
+- a pointer (XWR = 0) at the last level: ERROR_LEAF_AS_POINTER
+- a superpage leaf with the PPN bits below its level set: ERROR_SUPERPAGE_NOT_CLEARED
+Permission, A/D and U checks depend on the access, and are not done here.
+'''
+
+import struct
+from typing import Callable, Dict, List, Tuple, Union
+
+from constants import (ERROR_LEAF_AS_POINTER, ERROR_PTE_INVALID, ERROR_SUPERPAGE_NOT_CLEARED, ERROR_WRITE_NO_READ,
+                       PAGE_SHIFT)
+from layouts import PTE_FLAG_BITS, layout
+from memory_image import PAGE_SIZE, PTE_FORMATS, PageImage, build_pages
+
+Memory = Union[Dict[int, bytearray], PageImage]  # build_pages output, or an image read back from a file
+
+PAGE_OFFSET_MASK = PAGE_SIZE - 1
+
+
+class Translation:
+    ''' The result of a walk: the PA, or the fault and the level it happened at. addresses = the PTEs read, top first '''
+    __slots__ = ('pa', 'fault', 'level', 'addresses')
+
+    def __init__(self, pa: Union[int, None], fault: Union[str, None], level: int, addresses: List[int]):
+        self.pa = pa
+        self.fault = fault
+        self.level = level
+        self.addresses = addresses
+
+    def __repr__(self):
+        result = f'fault={self.fault!r}' if self.fault else f'pa={self.pa:#x}'
+        return f'Translation({result}, level={self.level}, addresses=[{", ".join(f"{a:#x}" for a in self.addresses)}])'
+
+
+def _reader(memory: Memory, mode: int) -> Callable[[int], int]:
+    ''' address -> the PTE word there (0 where nothing was written) '''
+    if isinstance(memory, PageImage):
+        offsets, data = memory.offsets, memory.map
+    else:
+        offsets, data = None, memory
+    unpack_from = struct.Struct(PTE_FORMATS[layout(mode).pte_size]).unpack_from
+
+    def read(address: int) -> int:
+        base = address & ~PAGE_OFFSET_MASK
+        if offsets is None:
+            page = data.get(base)
+            return unpack_from(page, address & PAGE_OFFSET_MASK)[0] if page is not None else 0
+        offset = offsets.get(base)
+        return unpack_from(data, offset + (address & PAGE_OFFSET_MASK))[0] if offset is not None else 0
+    return read
+
+
+def _walker(memory: Memory, mode: int) -> Callable[[int, int], Translation]:
+    ''' The walk for the mode over the memory, as a function of (SATP PPN, VA) '''
+    read = _reader(memory, mode)
+    mode_layout = layout(mode)
+    pte_size = mode_layout.pte_size
+    vpn_fields = mode_layout.vpn_fields
+    ppn_mask = mode_layout.ppn_mask
+    top = mode_layout.levels - 1
+
+    def walk(satp_ppn: int, va: int) -> Translation:
+        table = satp_ppn << PAGE_SHIFT
+        addresses = []
+        for level in range(top, -1, -1):
+            shift, mask = vpn_fields[level]
+            address = table + ((va >> shift) & mask) * pte_size
+            addresses.append(address)
+            word = read(address)
+            if not word & 0b1:  # V
+                return Translation(None, ERROR_PTE_INVALID, level, addresses)
+            if word & 0b110 == 0b100:  # W without R
+                return Translation(None, ERROR_WRITE_NO_READ, level, addresses)
+            page = ((word >> PTE_FLAG_BITS) & ppn_mask) << PAGE_SHIFT
+            if word & 0b1010:  # R or X: a leaf
+                low = (1 << shift) - 1  # the part of the VA that carries on into the PA
+                if page & low:
+                    return Translation(None, ERROR_SUPERPAGE_NOT_CLEARED, level, addresses)
+                return Translation(page | (va & low), None, level, addresses)
+            table = page
+        return Translation(None, ERROR_LEAF_AS_POINTER, 0, addresses)
+    return walk
+
+
+def translate(memory: Memory, satp: int, va: int, mode: int) -> Translation:
+    '''
+    Translate the VA with the page tables in the memory (see memory_image), starting from the SATP PPN.
+    For many translations over the same memory, translate_all is faster.
+    '''
+    return _walker(memory, mode)(satp, va)
+
+
+def translate_all(memory: Memory, requests: List[Tuple[int, int]], mode: int) -> List[Translation]:
+    ''' Translate a list of (SATP PPN, VA) '''
+    walk = _walker(memory, mode)
+    return [walk(satp, va) for satp, va in requests]
+
+
+def _check(walk, result: Translation) -> Union[str, None]:
+    ''' What's wrong with the walk according to the oracle, None if they agree '''
+    expected = [pte.address for pte in walk.ptes]
+    error_type = getattr(walk, 'error_type', None)
+    if error_type == ERROR_LEAF_AS_POINTER and result.fault and result.addresses[:len(expected)] == expected:
+        return None  # the hardware takes it as a pointer, so it goes on until it faults further down (or at the last level)
+    if result.addresses != expected:
+        return f'walk went through [{", ".join(f"{a:#x}" for a in result.addresses)}]'
+    if result.fault != error_type:
+        return f'{result.fault or "no fault"} instead of {error_type or "no fault"}'
+    if not result.fault and result.pa != walk.pa.data():
+        return f'translates to {result.pa:#x} instead of {walk.pa.data():#x}'
+    return None
+
+
+def verify_context(mgr, memory: Union[Memory, None] = None) -> List[Tuple[int, str]]:
+    '''
+    Translate every walk of the Context with the oracle, and compare: the PTEs read, the PA, and for
+    invalid walks, the fault. memory = the image to walk (default: built from the Context's PTEs).
+    Returns (walk index, what's wrong) for the walks that don't match.
+    '''
+    if memory is None:
+        memory = build_pages(mgr.ptes.values(), mgr.mode)
+    hardware_walk = _walker(memory, mgr.mode)
+    mismatches = []
+    for index, walk in enumerate(mgr.walks):
+        problem = _check(walk, hardware_walk(walk.satp.ppn, walk.va.data()))
+        if problem:
+            mismatches.append((index, problem))
+    return mismatches
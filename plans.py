@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+'''
+Compiled test cases. A test case dict from the config is read once into a CasePlan: the probability flags
+sorted into fixed values / chances / choices, the SATP forms resolved, VA / PA dicts built into templates,
+PTE attribute dicts turned into bit masks, and the errors spec into its weighted pick or its flags.
+Context.add_planned runs a plan, repeat after repeat, without going back to the dict.
+
+Running a plan makes the same random draws, in the same order, as the dict path did, so seeds give the same walks.
+'''
+
+import random
+from typing import Any, List, Tuple, Union
+
+from constants import MODE_PAGESIZE_LEVEL_MAP, PA_BITS
+from core_types import PA, VA
+from indexes import REUSE_WEIGHTS
+from layouts import ATTRIBUTE_FIELDS
+from simulator_errors import Errors
+
+# Flag kinds (see typeutils.resolve_flag): used as is, 1 with a probability, or picked from a list
+FIXED, CHANCE, CHOICE = 0, 1, 2
+Flag = Tuple[int, Any]
+
+ERROR_KINDS = ('mark_invalid', 'write_no_read', 'leaf_as_pointer', 'uncleared_superpage')
+
+
+def compile_flag(value) -> Flag:
+    if type(value) == float:
+        return (CHANCE, value)
+    if type(value) == list:
+        return (CHOICE, value)
+    return (FIXED, value)
+
+
+def draw(flag: Flag, rng: random.Random) -> Any:
+    ''' resolve_flag for a compiled flag '''
+    kind, value = flag
+    if kind == FIXED:
+        return value
+    if kind == CHANCE:
+        return int(rng.random() < value)
+    return rng.choice(value)
+
+
+class PTETemplate:
+    '''
+    One entry of a test case's ptes. The attributes that are fixed become masks applied in one go,
+    the random ones are kept in order, to be drawn per repeat.
+    '''
+    __slots__ = ('address', 'ppns', 'clear', 'bits', 'known', 'random_flags')
+
+    def __init__(self, spec: dict):
+        address = spec.get('address')
+        self.address: Flag = (CHOICE, address) if type(address) == list else (FIXED, address)  # as resolve_int
+        self.ppns = spec.get('ppns')
+        clear = bits = known = 0
+        random_flags = []
+        for name, value in spec.get('attributes', {}).items():
+            if name not in ATTRIBUTE_FIELDS:
+                raise Errors.InvalidConstraints(f'Unknown PTE attribute {name!r}')
+            shift, width = ATTRIBUTE_FIELDS[name]
+            mask = (1 << width) - 1
+            flag = compile_flag(value)
+            if flag[0] != FIXED:
+                random_flags.append((shift, mask, flag))
+                continue
+            clear |= mask << shift
+            if value is not None:
+                if value & ~mask:
+                    raise Errors.InvalidConstraints(f'PTE attribute {name} = {value!r} does not fit in {width} bit(s)')
+                bits |= value << shift
+                known |= mask << shift
+        self.clear, self.bits, self.known = ~clear, bits, known
+        self.random_flags = tuple(random_flags)
+
+    def apply_flags(self, pte, rng: random.Random):
+        pte.bits = (pte.bits & self.clear) | self.bits
+        pte.known = (pte.known & self.clear) | self.known
+        for shift, mask, flag in self.random_flags:
+            pte._set(shift, mask, draw(flag, rng))
+
+
+class CasePlan:
+    '''
+    A test case dict (the arguments of Context.add_test_case), compiled for the given mode.
+    Keys the test case loop uses (repeats, special, page_range, ...) are ignored.
+    Plans are shared between repeats: nothing in them is changed by running them.
+    '''
+    __slots__ = ('same_va_pa', 'aliasing', 'reuse_pte', 'reuse_weight', 'alias_level', 'alias_region', 'satp', 'pagesize', 'pa', 'pa_template', 'va', 'va_template',
+                 'ptes', 'error_pick', 'error_flags')
+
+    def __init__(self, case: dict, mode: int):
+        self.same_va_pa = compile_flag(case.get('same_va_pa', 0))
+        self.aliasing = compile_flag(case.get('aliasing', 0))
+        # what aliasing picks from: the PAs of the walks of a page size, in a region [start, end)
+        self.alias_level: Union[int, None] = None
+        if alias_pagesize := case.get('alias_pagesize'):
+            if alias_pagesize not in MODE_PAGESIZE_LEVEL_MAP[mode]:
+                raise Errors.InvalidConstraints(f'Unknown alias_pagesize {alias_pagesize!r} for Sv{mode}')
+            self.alias_level = MODE_PAGESIZE_LEVEL_MAP[mode][alias_pagesize]
+        self.alias_region: Union[Tuple[int, int], None] = None
+        if region := case.get('alias_region'):
+            self.alias_region = (region.get('start', 0), region.get('end', 1 << PA_BITS[mode]))
+        self.reuse_pte = compile_flag(case.get('reuse_pte', 0))
+        self.reuse_weight: str = case.get('reuse_weight', 'uniform')
+        if self.reuse_weight not in REUSE_WEIGHTS:
+            raise Errors.InvalidConstraints(f'Unknown reuse_weight {self.reuse_weight!r}, expected one of {", ".join(REUSE_WEIGHTS)}')
+
+        # (ppn, asid) of the test case's own SATP, None to use the global one
+        satp_data = case.get('satp', {})
+        if type(satp_data) == int:
+            satp_data = {'ppn': satp_data}
+        satp_data = dict(satp_data)
+        if ppn := case.get('satp.ppn'):
+            satp_data['ppn'] = ppn
+        self.satp: Union[Tuple[Union[int, None], int], None] = None
+        if satp_data:
+            self.satp = (satp_data.get('ppn'), case.get('satp.asid') or satp_data.get('asid') or 0)
+
+        self.pagesize = compile_flag(case.get('pagesize', '4K'))  # a string, or a list to choose from
+
+        # PA / VA: a dict is a template, copied for every repeat. Anything else is used as is
+        pa = case.get('pa')
+        self.pa_template: Union[PA, None] = None
+        if type(pa) == dict:
+            self.pa_template = PA(mode=mode)
+            self.pa_template.offset = pa.get('offset')
+            self.pa_template.ppn = pa.get('ppn')
+            pa = None
+        self.pa = pa
+        va = case.get('va')
+        self.va_template: Union[VA, None] = None
+        if type(va) == dict:
+            self.va_template = VA(mode=mode)
+            self.va_template.offset = va.get('offset')
+            self.va_template.vpn = list(va.get('vpn', []))
+            va = None
+        self.va = va
+
+        self.ptes: Tuple[PTETemplate, ...] = tuple(PTETemplate(spec) for spec in case.get('ptes') or ())
+
+        # errors: a weighted pick of one error kind with probability p, or a flag per error kind
+        errors = case.get('errors')
+        self.error_pick: Union[Tuple[Flag, List[str], Union[List[float], None]], None] = None
+        self.error_flags: Tuple[Flag, ...] = ()
+        if errors:
+            if p := errors.get('p'):
+                self.error_pick = (compile_flag(p), errors.get('types'), errors.get('weights'))
+            else:
+                self.error_flags = tuple(compile_flag(errors.get(kind)) for kind in ERROR_KINDS)
+
+    def draw_errors(self, rng: random.Random) -> Tuple[Any, ...]:
+        ''' The resolved flag of each of ERROR_KINDS for one repeat, () for a test case without errors '''
+        if self.error_pick is None:
+            return tuple(draw(flag, rng) for flag in self.error_flags)
+        p, types, weights = self.error_pick
+        if not draw(p, rng):
+            return (None, ) * len(ERROR_KINDS)
+        picked = rng.choices(types, weights, k=1)[0]
+        return tuple(int(kind == picked) for kind in ERROR_KINDS)
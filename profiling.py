@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+'''
+Where the time of a generation goes. Off unless asked for (Context.profile()): then the stages of that one
+Context are wrapped with timers -- test case runs, constraint checks, the resolver stages, PTE finalize, the
+batch path, serialization -- and the fallbacks the generator takes when a random choice doesn't fit are
+counted, per test case index. With it off nothing is wrapped, and the fallbacks only check Context.stats.
+'''
+
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, Union
+
+# The stages of a Context that get a timer: owner ('context' or its 'resolver') -> method names
+TIMED = {
+    'context': ('add_planned', 'add_random_walks', 'jsonify', 'jsonify_color'),
+    'resolver': ('check', 'resolve', 'resolve_leaf', 'draw_batch'),
+}
+
+# Counters the generator bumps, and what they count
+COUNTERS = {
+    'walks': 'walks made',
+    'failures': "walks that couldn't be made (the run stops at the first)",
+    'batch_fallbacks': 'walks of the batch path that ran into an existing PTE and went through the resolver instead',
+    'reuse_fallbacks': 'reuse_pte picks that had to be made again among the PTEs that fit',
+    'slot_redraws': 'slots drawn onto an existing PTE the walk could not go through, drawn again among the ones it can',
+    'identity_moves': 'VA = PA addresses that had to move off an existing PTE',
+}
+
+
+class Stats:
+    ''' Timers (calls and seconds) and counters, in total and per test case index '''
+    def __init__(self):
+        self.timers: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.cases: Dict[int, Dict[str, Union[int, float]]] = {}
+        self.case: Union[int, None] = None  # the test case index being generated
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+        if self.case is not None:
+            case = self.cases[self.case]
+            case[name] = case.get(name, 0) + n
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        timer = self.timers[name]
+        timer[0] += calls
+        timer[1] += seconds
+
+    def timed(self, name: str, func: Callable) -> Callable:
+        ''' func, timed into the timer of the name '''
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def track(self, index: int, walks: Iterator) -> Iterator:
+        ''' Pass on the walks of the test case at index, counting them and the time they take to make '''
+        case = self.cases.setdefault(index, {'walks': 0, 'seconds': 0.0})
+        walks = iter(walks)
+        while True:
+            self.case = index
+            start = time.perf_counter()
+            try:
+                walk = next(walks)
+            except StopIteration:
+                return
+            finally:
+                case['seconds'] += time.perf_counter() - start
+                self.case = None
+            self.counters['walks'] += 1
+            case['walks'] += 1
+            yield walk
+
+    def jsonify(self) -> dict:
+        return {
+            'timers': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.timers.items()},
+            'counters': dict(self.counters),
+            'cases': {str(index): case for index, case in sorted(self.cases.items())},
+        }
+
+    def report(self) -> str:
+        ''' The stats as text '''
+        lines = [f'{"stage":>24} {"calls":>9} {"seconds":>9} {"us/call":>9}']
+        for name, (calls, seconds) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{name:>24} {calls:>9} {seconds:>9.3f} {seconds / calls * 1e6 if calls else 0:>9.1f}')
+        lines.append('')
+        for name, n in self.counters.items():
+            lines.append(f'{name:>24} {n:>9}  {COUNTERS.get(name, "")}')
+        lines.append('')
+        names = [name for name in COUNTERS if name != 'walks' and any(name in case for case in self.cases.values())]
+        lines.append(f'{"test case":>9} {"walks":>9} {"seconds":>9} ' + ' '.join(f'{name:>15}' for name in names))
+        for index, case in sorted(self.cases.items()):
+            lines.append(f'{index:>9} {case["walks"]:>9} {case["seconds"]:>9.3f} ' + ' '.join(f'{case.get(name, 0):>15}' for name in names))
+        return '\n'.join(lines)
+
+
+def attach(mgr, stats: Stats):
+    ''' Wrap the stages of the Context (and its ConstraintResolver) with timers into stats (see TIMED) '''
+    for owner, names in TIMED.items():
+        target = mgr if owner == 'context' else mgr.CR
+        for name in names:
+            setattr(target, name, stats.timed(name, getattr(target, name)))
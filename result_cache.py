@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+'''
+Cache of generated outputs, keyed by a hash of the config. The same config with the same seed always
+generates the same walks, so the serialized output can be kept and handed back instead of regenerating it.
+Configs without a seed ask for a fresh random run, and are never cached.
+
+Two tiers: MemoryCache (per process, for the web app) and DiskCache (a directory, shared between the
+web app and runjson.py). Both evict the least recently used entries once over their size budget.
+The key includes a hash of the generator's source, so entries from older code are never used.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Union
+
+CACHE_DIR = os.environ.get('T4V_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'table4v')
+MEMORY_BUDGET = 64 << 20  # bytes
+DISK_BUDGET = 1 << 30
+ENTRY_FRACTION = 8  # entries bigger than budget / this aren't stored, so one big run can't flush everything else
+
+# Everything the output depends on
+GENERATOR_MODULES = ('Context', 'Translator', 'ConstraintResolver', 'core_types', 'constants', 'layouts',
+                     'allocator', 'indexes', 'plans', 'typeutils', 'utils', 'sharding', 'writers', 'walk_store')
+
+_version = None
+
+
+def generator_version() -> str:
+    ''' Hash of the generator's source files '''
+    global _version
+    if _version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for module in GENERATOR_MODULES:
+            with open(os.path.join(here, module + '.py'), 'rb') as f:
+                digest.update(f.read())
+        _version = digest.hexdigest()
+    return _version
+
+
+def cacheable(params: dict) -> bool:
+    ''' Only seeded configs generate the same thing every time '''
+    return params.get('seed') is not None
+
+
+def cache_key(params: dict, kind: str) -> str:
+    '''
+    Key of the output of the config. kind tells the outputs of the same config apart
+    (e.g. 'color' for jsonify_color, or the writer format and options for runjson.py).
+    '''
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{generator_version()}\n{kind}\n{canonical}'.encode()).hexdigest()
+
+
+class MemoryCache:
+    ''' LRU of key -> bytes, bounded by the total size of the values. Thread safe (the app serves on threads) '''
+    def __init__(self, budget: int = MEMORY_BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Union[bytes, None]:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.budget // ENTRY_FRACTION:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskCache:
+    '''
+    One file per entry, under directory/<first 2 hex digits of the key>/. Reads bump the file's mtime,
+    and eviction removes the oldest files first. Writes go through a rename, so concurrent processes
+    never see a partial entry.
+    '''
+    def __init__(self, directory: str = CACHE_DIR, budget: int = DISK_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.size: Union[int, None] = None  # counted on the first write
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Union[bytes, None]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.budget // ENTRY_FRACTION:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += len(data)
+        if self.size > self.budget:
+            self.evict()
+
+    def _entries(self):
+        ''' (mtime, size, path) of every entry '''
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # evicted by another process
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        ''' Remove the least recently used entries until under the budget (other processes write here too, so recount) '''
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+
+class ResultCache:
+    ''' The memory tier (if any) in front of the disk tier (if any). Disk hits are copied to memory '''
+    def __init__(self, memory: Union[MemoryCache, None] = None, disk: Union[DiskCache, None] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Union[bytes, None]:
+        data = self.memory.get(key) if self.memory else None
+        if data is None and self.disk:
+            data = self.disk.get(key)
+            if data is not None and self.memory:
+                self.memory.put(key, data)
+        return data
+
+    def fits(self, size: int) -> bool:
+        ''' Whether an entry of this size would be stored by any of the tiers '''
+        return any(tier and size <= tier.budget // ENTRY_FRACTION for tier in (self.memory, self.disk))
+
+    def put(self, key: str, data: bytes):
+        if self.memory:
+            self.memory.put(key, data)
+        if self.disk:
+            try:
+                self.disk.put(key, data)
+            except OSError:
+                pass  # a read only or full disk only costs the caching
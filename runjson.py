@@ -1,20 +1,104 @@
 #!venv/bin/python3
 
-from Context import Context, ContextFromJSON
+from Context import Context, ContextFromJSON, ContextFromParams, iter_walks, load_json5
+from sharding import ShardedContextFromJSON
+from writers import WRITERS
+from memory_image import IMAGE_FORMATS, write_image
+from oracle import verify_context
+from result_cache import CACHE_DIR, DiskCache, ResultCache, cache_key, cacheable
+import os
 import sys
 import json
+import time
 import argparse
 
 parser = argparse.ArgumentParser(description='Run a JSON5 input')
 parser.add_argument('input', help='JSON5 input file.')
 parser.add_argument('output', help='JSON output filename. If omitted, prints to console.', nargs='?')
+parser.add_argument('--format', choices=WRITERS.keys(), default='json',
+                    help='Output format (default: json). columns, msgpack, npz and parquet are column formats, '
+                         'with each PTE stored once; normalized is JSON with every PTE and SATP once (see writers.py).')
+parser.add_argument('--stream', action='store_true',
+                    help='Write each walk as it is generated instead of holding them all in memory. Requires an output file.')
+parser.add_argument('--jobs', '-j', type=int, default=1, help='Generate on this many processes (default: 1).')
+parser.add_argument('--seed', type=lambda x: int(x, 0), help='Random seed. Overrides the seed in the input.')
+parser.add_argument('--case', type=int, action='append',
+                    help='Only generate the test case with this index (can be repeated). Use with --seed to regenerate a case.')
+parser.add_argument('--image', help='Also write a memory image of the page tables to this file.')
+parser.add_argument('--image-format', choices=IMAGE_FORMATS, default='pages',
+                    help='Memory image format (default: pages). See memory_image.py.')
+parser.add_argument('--verify', action='store_true',
+                    help='Check every walk against the reference page table walker (oracle.py). Not with --stream.')
+parser.add_argument('--cache', nargs='?', const=CACHE_DIR, metavar='DIR',
+                    help=f'Reuse the output of an earlier run of the same seeded config, from this cache directory '
+                         f'(default: {CACHE_DIR}). Only for runs with an output file and no --image / --verify.')
+parser.add_argument('--profile', action='store_true',
+                    help='Print where the time went (stages, fallbacks, per test case) to stderr. See profiling.py.')
 args = parser.parse_args()
 
-fn = args.input
-mgr = ContextFromJSON(fn)
+if args.stream and not args.output:
+    parser.error('--stream requires an output file')
+if args.jobs > 1 and (args.stream or args.case):
+    parser.error('--jobs can not be used with --stream or --case')
+if args.profile and args.jobs > 1:
+    parser.error('--profile can not be used with --jobs')
+if args.verify and args.stream:
+    parser.error('--verify needs the walks, it can not be used with --stream')
+if missing := WRITERS[args.format].missing():
+    parser.error(f'--format {args.format} needs {", ".join(missing)} installed')
 
+params = load_json5(args.input)
+if args.seed is not None:
+    params['seed'] = args.seed
+
+cache = key = None
+if (args.cache and args.output and cacheable(params) and WRITERS[args.format].single_file
+        and not (args.image or args.verify or args.profile)):
+    cache = ResultCache(disk=DiskCache(args.cache))
+    # The walk order depends on how they were generated, so the options that change it are part of the key
+    key = cache_key(params, f'{args.format} jobs={args.jobs} stream={args.stream} case={sorted(args.case or [])}')
+    data = cache.get(key)
+    if data is not None:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        sys.exit(0)
+
+if args.jobs > 1:
+    mgr = ShardedContextFromJSON(params, args.jobs)
+    walks = mgr.walks
+else:
+    mgr = ContextFromParams(params, keep_walks=not args.stream)
+    if args.profile:
+        mgr.profile()
+    walks = iter_walks(mgr, params, only=args.case and set(args.case))
+    if not args.stream:
+        for _ in walks:
+            pass
+        walks = mgr.walks
+
+start = time.perf_counter()
 if args.output:
-    with open(args.output, 'w') as f:
-        json.dump(mgr.jsonify(), f)
+    writer_class = WRITERS[args.format]
+    with open(args.output, 'wb' if writer_class.binary else 'w') as f, writer_class(f, mgr) as writer:
+        for walk in walks:
+            writer.write(walk)
+    if key and cache.fits(os.path.getsize(args.output)):
+        with open(args.output, 'rb') as f:
+            cache.put(key, f.read())
 else:
     mgr.print_dump()
+if args.profile:
+    # with --stream, this includes generating the walks
+    mgr.stats.add('output' if not args.stream else 'generate + output', time.perf_counter() - start)
+    print(mgr.stats.report(), file=sys.stderr)
+
+if args.image:
+    write_image(args.image, mgr.ptes.values(), mgr.mode, args.image_format)
+
+if args.verify:
+    mismatches = verify_context(mgr)
+    for index, problem in mismatches:
+        print(f'walk {index}: {problem}', file=sys.stderr)
+    print(f'Verified {len(mgr.walks)} walks, {len(mismatches)} mismatches', file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
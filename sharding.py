@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+'''
+Multi-process generation. The test cases are split into units (chunks of repeats / page_range iterations),
+which are handed out to a process pool. Each worker gets its own disjoint slice of the physical memory
+for PTEs and PAs, and its own set of root table slots, so what they generate can't collide.
+The results are merged back in test case order.
+
+Test cases that pin things down (va, pa, PTE addresses, same_va_pa), in themselves or in one of their
+special entries, are not split, and run together in the parent first. So do test cases that pick from what was generated before (aliasing, reuse_pte),
+along with every test case before them.
+'''
+
+import math
+from multiprocessing import Pool
+from typing import List, Tuple, Union, Dict
+
+from Context import Context, ContextFromParams, iter_walks, load_json5
+from Translator import TranslationWalk
+from core_types import SATP
+from constants import PAGESIZE_INT_MAP, PAGE_SHIFT
+
+# Keys that pin down parts of the walk
+PINNED_KEYS = ('va', 'pa', 'same_va_pa')
+# Keys that pick from the previously generated walks
+HISTORY_KEYS = ('aliasing', 'reuse_pte')
+
+UnitKey = Tuple[int, int]  # (test case index, chunk index)
+
+
+def _uses(case: dict, keys: Tuple[str, ...]) -> bool:
+    return any(case.get(key) for key in keys) or any(_uses(special, keys) for special in case.get('special') or [])
+
+
+def _pins_ptes(case: dict) -> bool:
+    return any(pte.get('address') is not None for pte in case.get('ptes') or [])
+
+
+def _is_pinned(case: dict) -> bool:
+    if _uses(case, PINNED_KEYS):
+        return True
+    return _pins_ptes(case) or any(_pins_ptes(special) for special in case.get('special') or [])
+
+
+def _bounds(low: int, high: int, parts: int) -> List[int]:
+    ''' Split [low, high) into parts, page aligned. Returns the parts + 1 boundaries '''
+    span = high - low
+    inner = [((low + span * k // parts) >> PAGE_SHIFT) << PAGE_SHIFT for k in range(1, parts)]
+    return [low] + [max(low, x) for x in inner] + [high]
+
+
+def _chunk(test_case: dict, first: int, count: int) -> dict:
+    ''' The test case restricted to iterations [first, first + count), with the special indices shifted to match '''
+    chunk = {**test_case}
+    if special := test_case.get('special'):
+        chunk['special'] = [{**s, 'index': s.get('index') - first} for s in special
+                            if first <= s.get('index', -1) < first + count]
+    if rg := test_case.get('page_range'):
+        step = rg.get('step') or PAGESIZE_INT_MAP[test_case.get('pagesize', '4K')]
+        chunk['page_range'] = {**rg, 'start': rg.get('start') + first * step, 'num_pages': count}
+    else:
+        chunk['repeats'] = count
+    return chunk
+
+
+def _split(test_case: dict, mgr: Context, jobs: int) -> List[dict]:
+    ''' Split a test case into up to jobs chunks '''
+    if rg := test_case.get('page_range'):
+        if rg.get('step') is None and type(test_case.get('pagesize', '4K')) != str:
+            return [test_case]  # each page's size decides where the next starts
+        rg = {'start': mgr.lower_bound, 'end': mgr.memory_size, **rg}  # pin the defaults, the shards have other bounds
+        test_case = {**test_case, 'page_range': rg}
+        step = rg.get('step') or PAGESIZE_INT_MAP[test_case.get('pagesize', '4K')]
+        total = max(0, math.ceil((rg['end'] - rg['start']) / step))
+        if rg.get('num_pages') is not None:
+            total = min(total, rg['num_pages'])
+    else:
+        total = test_case.get('repeats', 1)
+
+    parts = max(1, min(jobs, total))
+    bounds = [total * k // parts for k in range(parts + 1)]
+    return [_chunk(test_case, bounds[k], bounds[k + 1] - bounds[k]) for k in range(parts) if bounds[k + 1] > bounds[k]]
+
+
+def _run(mgr: Context, units: List[Tuple[UnitKey, dict]]) -> Dict[UnitKey, List[TranslationWalk]]:
+    results = {}
+    for (index, chunk), test_case in units:
+        # The first chunk continues the test case's own stream, so it matches an unsharded run as far as it can
+        mgr.use_substream(*((index, chunk) if chunk else (index,)))
+        results[index, chunk] = list(iter_walks(mgr, {'test_cases': [test_case]}, substreams=False))
+    return results
+
+
+def _run_shard(shard: dict) -> Tuple[dict, Dict[UnitKey, List[TranslationWalk]]]:
+    ''' Worker entry point. Sends back the Context's lookup_tables() (not the whole Context) and the walks '''
+    params = shard['params']
+    satp = shard['global_satp']
+    mgr = Context(shard['memory_size'], params.get('mode'), shard['lower_bound'], params.get('pte_min', 0),
+                  params.get('pte_max'), SATP(mode=satp['mode'], asid=satp['asid'], ppn=satp['ppn']), keep_walks=False, seed=shard['seed'],
+                  pte_placement=params.get('pte_placement', 'random'))
+    mgr.CR.pte_low, mgr.CR.pte_high = shard['pte_range']
+    mgr.CR.root_vpns = shard['root_vpns']
+    mgr.CR.allocator.merge(shard['allocator'])  # stay out of what the serial part placed in this shard's range
+    for low, high in shard['other_pte_ranges']:  # and out of the other shards' page tables
+        mgr.CR.allocator.mark_range(low, high + 1)
+    results = _run(mgr, shard['units'])
+    return mgr.lookup_tables(), results
+
+
+def ShardedContextFromJSON(json_data: Union[str, dict], jobs: int) -> Context:
+    ''' Like ContextFromJSON, but generating on a pool of jobs processes '''
+    params = load_json5(json_data)
+    mgr = ContextFromParams(params)
+
+    test_cases = params.get('test_cases', [])
+    last_history = max((i for i, test_case in enumerate(test_cases) if _uses(test_case, HISTORY_KEYS)), default=-1)
+
+    serial_units = []
+    shard_units = [[] for _ in range(jobs)]
+    for i, test_case in enumerate(test_cases):
+        if i <= last_history or _is_pinned(test_case):
+            serial_units.append(((i, 0), test_case))
+        else:
+            for k, chunk in enumerate(_split(test_case, mgr, jobs)):
+                shard_units[k].append(((i, k), chunk))
+
+    # The serial part runs first, in the full memory range, so the shards can stay out of its root table slots
+    serial = Context(mgr.memory_size, mgr.mode, mgr.lower_bound, mgr.pte_min, params.get('pte_max'), mgr.global_satp, seed=mgr.seed,
+                     pte_placement=mgr.pte_placement)
+    results = _run(serial, serial_units)
+    used_root_vpns = {walk.va.vpn[mgr.levels - 1] for walks in results.values() for walk in walks}
+    root_vpns = [vpn for vpn in range(2**mgr.CR.va_bits) if vpn not in used_root_vpns]
+
+    shard_units = [units for units in shard_units if units]
+    jobs = min(len(shard_units), len(root_vpns))
+    if not jobs:  # the serial part took every root slot, no room to keep shards apart
+        results.update(_run(serial, sorted(unit for units in shard_units for unit in units)))
+        shard_units = []
+    elif jobs < len(shard_units):  # more shards than free root slots, fold the extra ones in
+        for k, units in enumerate(shard_units[jobs:]):
+            shard_units[k % jobs] += units
+        shard_units = shard_units[:jobs]
+
+    pa_bounds = _bounds(mgr.lower_bound, mgr.memory_size, jobs)
+    pte_bounds = _bounds(mgr.CR.pte_low, mgr.CR.pte_high + 1, jobs)
+    shards = [{
+        'params': {key: value for key, value in params.items() if key != 'test_cases'},
+        'global_satp': mgr.global_satp.jsonify(),
+        'seed': mgr.seed,
+        'lower_bound': pa_bounds[k],
+        'memory_size': pa_bounds[k + 1],
+        'pte_range': (pte_bounds[k], pte_bounds[k + 1] - 1),
+        'root_vpns': root_vpns[k::jobs],
+        'allocator': serial.CR.allocator,
+        'other_pte_ranges': [(pte_bounds[j], pte_bounds[j + 1] - 1) for j in range(jobs) if j != k],
+        'units': units,
+    } for k, units in enumerate(shard_units)]
+
+    mgr.merge(serial.lookup_tables())
+    if shards:
+        with Pool(jobs) as pool:
+            for shard_tables, shard_results in pool.map(_run_shard, shards):
+                mgr.merge(shard_tables)
+                results.update(shard_results)
+
+    for key in sorted(results):
+        for walk in results[key]:
+            mgr._keep(walk)
+    return mgr
@@ -39,6 +39,9 @@ class Errors:
     class InvalidDAU(Exception):
         pass  # this may be worth moving to a warning if we foresee this being valid?
 
+    class OutOfMemory(Exception):
+        pass  # no free region left for a new page table or leaf page
+
     # TranslatorError = TranslatorError
     # InvalidConstraints = InvalidConstraints
     # SuperPageNotCleared = SuperPageNotCleared
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+'''
+TLB and page walk cache (PWC) model, to see how much a suite exercises them before running it on an MMU.
+The walks are replayed in order (from Context.walks, or as they're generated): each one looks up the TLB
+of its page size first, and on a miss walks the page tables, looking up every pointer PTE in the PWC of
+its level (keyed by the PTE address) and reading memory for the ones that miss, then fills the TLB.
+Invalid walks aren't put in the TLB.
+
+Run from the repository root to generate a config and replay it as it's generated:
+
+    python3 tlb.py input.json5 --policy plru --tlb 4K=16x4 --pwc 2=1x16
+'''
+
+import argparse
+import random
+from typing import Dict, Iterable, List, Tuple
+
+from Context import ContextFromParams, iter_walks, load_json5
+from constants import MODE_PAGESIZE_LEVEL_MAP, PT_LEVEL_MAP
+from layouts import layout
+
+# (sets, ways)
+DEFAULT_TLB = {'4K': (16, 4), '2M': (8, 4), '4M': (8, 4), '1G': (1, 4), '512G': (1, 2)}
+DEFAULT_PWC = (1, 16)  # each pointer level
+
+ASID_SHIFT = 64  # TLB keys: the ASID above the virtual page number
+
+
+class Cache:
+    '''
+    Set associative cache of int keys, for the replacement policies to fill in. The set is the key modulo the
+    number of sets, so keys should vary in the low bits (page numbers, PTE addresses without the alignment bits).
+    lookup counts a hit or a miss (and on a hit, updates the replacement state), fill inserts after a miss.
+    '''
+    def __init__(self, sets: int, ways: int, rng: random.Random = random):
+        self.sets = sets
+        self.ways = ways
+        self.rng = rng
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key: int) -> bool:
+        raise NotImplementedError
+
+    def fill(self, key: int):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self.sets * self.ways,
+            'lookups': lookups,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0,
+        }
+
+
+class LRUCache(Cache):
+    ''' Least recently used: each set is a dict in use order, oldest first '''
+    def __init__(self, sets: int, ways: int, rng: random.Random = random):
+        super().__init__(sets, ways, rng)
+        self.lines: List[Dict[int, None]] = [{} for _ in range(sets)]
+
+    def lookup(self, key: int) -> bool:
+        lines = self.lines[key % self.sets]
+        if key in lines:
+            del lines[key]
+            lines[key] = None
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def fill(self, key: int):
+        lines = self.lines[key % self.sets]
+        if len(lines) >= self.ways:
+            del lines[next(iter(lines))]
+            self.evictions += 1
+        lines[key] = None
+
+
+class PLRUCache(Cache):
+    '''
+    Tree pseudo LRU (ways must be a power of 2): per set, a bit per tree node points to the half to evict from next.
+    Node n's children are 2n and 2n + 1, the root is 1. Touching a way and finding the victim are precomputed.
+    '''
+    def __init__(self, sets: int, ways: int, rng: random.Random = random):
+        if ways & (ways - 1):
+            raise ValueError(f'PLRU needs a power of 2 ways, got {ways}')
+        super().__init__(sets, ways, rng)
+        self.depth = ways.bit_length() - 1
+        self.where: List[Dict[int, int]] = [{} for _ in range(sets)]  # key -> way
+        self.keys: List[List] = [[None] * ways for _ in range(sets)]
+        self.bits = [0] * sets
+        # Per way, the bits on its path to clear and to set, pointing them away from it
+        self.touches = [self._path(way) for way in range(ways)]
+        self.victims = [self._victim(bits) for bits in range(1 << ways)] if ways <= 16 else None
+
+    def _path(self, way: int) -> Tuple[int, int]:
+        clear, set_, node = 0, 0, 1
+        for level in range(self.depth - 1, -1, -1):
+            side = (way >> level) & 1
+            if side:
+                clear |= 1 << node
+            else:
+                set_ |= 1 << node
+            node = 2 * node + side
+        return ~clear, set_
+
+    def _victim(self, bits: int) -> int:
+        node = 1
+        for _ in range(self.depth):
+            node = 2 * node + ((bits >> node) & 1)
+        return node - self.ways
+
+    def lookup(self, key: int) -> bool:
+        index = key % self.sets
+        way = self.where[index].get(key)
+        if way is None:
+            self.misses += 1
+            return False
+        keep, set_ = self.touches[way]
+        self.bits[index] = (self.bits[index] & keep) | set_
+        self.hits += 1
+        return True
+
+    def fill(self, key: int):
+        index = key % self.sets
+        where, keys = self.where[index], self.keys[index]
+        bits = self.bits[index]
+        if len(where) < self.ways:
+            way = keys.index(None)
+        else:
+            way = self.victims[bits] if self.victims is not None else self._victim(bits)
+            del where[keys[way]]
+            self.evictions += 1
+        keys[way] = key
+        where[key] = way
+        keep, set_ = self.touches[way]
+        self.bits[index] = (bits & keep) | set_
+
+
+class RandomCache(Cache):
+    ''' Evicts a random way '''
+    def __init__(self, sets: int, ways: int, rng: random.Random = random):
+        super().__init__(sets, ways, rng)
+        self.where: List[Dict[int, int]] = [{} for _ in range(sets)]  # key -> way
+        self.keys: List[List] = [[None] * ways for _ in range(sets)]
+
+    def lookup(self, key: int) -> bool:
+        if key in self.where[key % self.sets]:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def fill(self, key: int):
+        index = key % self.sets
+        where, keys = self.where[index], self.keys[index]
+        if len(where) < self.ways:
+            way = keys.index(None)
+        else:
+            way = int(self.rng.random() * self.ways)
+            del where[keys[way]]
+            self.evictions += 1
+        keys[way] = key
+        where[key] = way
+
+
+POLICIES = {
+    'lru': LRUCache,
+    'plru': PLRUCache,
+    'random': RandomCache,
+}
+
+
+class TranslationCaches:
+    '''
+    A TLB per page size and a PWC per pointer level (levels 1 and up; level 0 PTEs are always leaves).
+    tlb = page size -> (sets, ways), pwc = level -> (sets, ways). Missing ones get the defaults.
+    '''
+    def __init__(self, mode: int, tlb: Dict[str, Tuple[int, int]] = None, pwc: Dict[int, Tuple[int, int]] = None,
+                 policy: str = 'lru', seed: int = 0):
+        self.mode = mode
+        cache = POLICIES[policy]
+        self.rng = random.Random(seed)
+        tlb, pwc = tlb or {}, pwc or {}
+        self.tlbs = {pagesize: cache(*tlb.get(pagesize, DEFAULT_TLB[pagesize]), self.rng)
+                     for pagesize in MODE_PAGESIZE_LEVEL_MAP[mode]}
+        self.pwcs = {level: cache(*pwc.get(level, DEFAULT_PWC), self.rng) for level in range(1, PT_LEVEL_MAP[mode])}
+        vpn_fields = layout(mode).vpn_fields
+        self.page_shifts = {pagesize: vpn_fields[level][0] for pagesize, level in MODE_PAGESIZE_LEVEL_MAP[mode].items()}
+        self.align_bits = layout(mode).pte_size.bit_length() - 1
+        self.walks = 0
+        self.faults = 0
+        self.memory_reads = 0  # PTEs read from memory (PWC misses and leaves)
+
+    def replay(self, walks: Iterable):
+        ''' Run the walks through the caches, in order. Takes any iterable, e.g. iter_walks on a streaming Context '''
+        tlbs, pwcs, page_shifts, align_bits = self.tlbs, self.pwcs, self.page_shifts, self.align_bits
+        reads = faults = count = 0
+        for walk in walks:
+            count += 1
+            va = walk.va.data()
+            tlb = tlbs[walk.pagesize]
+            key = ((walk.satp.asid or 0) << ASID_SHIFT) | (va >> page_shifts[walk.pagesize])
+            if tlb.lookup(key):
+                continue
+            ptes = walk.ptes
+            level = walk.startLevel
+            for pte in ptes[:-1]:
+                pwc = pwcs[level]
+                address = pte.address >> align_bits
+                if not pwc.lookup(address):
+                    pwc.fill(address)
+                    reads += 1
+                level -= 1
+            reads += 1  # the leaf
+            if getattr(walk, 'error_type', None):
+                faults += 1
+            else:
+                tlb.fill(key)
+        self.walks += count
+        self.faults += faults
+        self.memory_reads += reads
+
+    def report(self) -> dict:
+        return {
+            'walks': self.walks,
+            'faults': self.faults,
+            'memory_reads': self.memory_reads,
+            'reads_per_walk': self.memory_reads / self.walks if self.walks else 0,
+            'tlb': {pagesize: tlb.stats() for pagesize, tlb in self.tlbs.items()},
+            'pwc': {level: pwc.stats() for level, pwc in self.pwcs.items()},
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f'{report["walks"]} walks, {report["faults"]} faults, {report["memory_reads"]} PTE reads '
+                 f'({report["reads_per_walk"]:.2f} per walk)',
+                 f'{"cache":>10} {"entries":>8} {"lookups":>10} {"hits":>10} {"misses":>10} {"evictions":>10} {"hit rate":>8}']
+        rows = [(f'TLB {pagesize}', stats) for pagesize, stats in report['tlb'].items()]
+        rows += [(f'PWC L{level}', stats) for level, stats in sorted(report['pwc'].items(), reverse=True)]
+        for name, stats in rows:
+            lines.append(f'{name:>10} {stats["entries"]:>8} {stats["lookups"]:>10} {stats["hits"]:>10} {stats["misses"]:>10} '
+                         f'{stats["evictions"]:>10} {stats["hit_rate"]:>8.1%}')
+        return '\n'.join(lines)
+
+
+def _geometry(value: str) -> Tuple[str, Tuple[int, int]]:
+    ''' NAME=SETSxWAYS '''
+    name, _, size = value.partition('=')
+    sets, _, ways = size.partition('x')
+    return name, (int(sets), int(ways))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the walks of a JSON5 input through a TLB / page walk cache model')
+    parser.add_argument('input', help='JSON5 input file.')
+    parser.add_argument('--seed', type=lambda x: int(x, 0), help='Random seed. Overrides the seed in the input.')
+    parser.add_argument('--policy', choices=POLICIES.keys(), default='lru', help='Replacement policy (default: lru).')
+    parser.add_argument('--tlb', type=_geometry, action='append', default=[],
+                        help='TLB of a page size, as PAGESIZE=SETSxWAYS (e.g. 4K=16x4). Can be repeated.')
+    parser.add_argument('--pwc', type=_geometry, action='append', default=[],
+                        help='PWC of a level, as LEVEL=SETSxWAYS (e.g. 2=1x16). Can be repeated.')
+    args = parser.parse_args()
+
+    params = load_json5(args.input)
+    if args.seed is not None:
+        params['seed'] = args.seed
+    mgr = ContextFromParams(params, keep_walks=False)
+    caches = TranslationCaches(mgr.mode, dict(args.tlb), {int(level): size for level, size in args.pwc}, args.policy)
+    caches.replay(iter_walks(mgr, params))
+    print(caches.format_report())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,15 @@ from typing import Union, Tuple, List
 import random
 
 
-def resolve_int(value: Union[int, List[int]]) -> int:
+def resolve_int(value: Union[int, List[int]], rng: random.Random = random) -> int:
     if type(value) == list:
-        return random.choice(value)
+        return rng.choice(value)
     return value
 
 
-def resolve_flag(flag: Union[int, float, None, List[int]]) -> int:
+def resolve_flag(flag: Union[int, float, None, List[int]], rng: random.Random = random) -> int:
     if type(flag) == float:
-        return int(random.random() < flag)
+        return int(rng.random() < flag)
     elif type(flag) == list:
-        return random.choice(flag)
+        return rng.choice(flag)
     return flag
\ No newline at end of file
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+'''
+Normalized storage of the walks a Context keeps. Instead of a TranslationWalk (with its VA, PA, SATP and list of
+PTEs) per walk: a PTE table and a SATP table, each entry once, and a walk table of compact arrays --
+VA / PA (their bits and known masks), SATP id, page size and kind codes, and the ids of the walk's PTEs.
+Indexing the store makes the TranslationWalk (or InvalidTranslationWalk) back, on the PTE objects of the table.
+'''
+
+from array import array
+from typing import Dict, Iterator, List, Tuple, Union
+
+from core_types import PA, PTE, SATP, VA
+from layouts import layout
+from Translator import InvalidTranslationWalk, TranslationWalk
+
+Kind = Tuple[bool, Union[str, None]]  # (invalid walk, error type)
+
+
+def _unpack(cls, mode: int, bits: int, known: int):
+    value = cls(mode=mode)
+    value.bits, value.known = bits, known
+    return value
+
+
+class WalkStore:
+    '''
+    The walks, in the order they were added. Supports len, iteration and indexing (ints and slices) like the list
+    it replaces. PTEs are interned by identity: walks through the same PTE object share its row, and an invalid
+    walk's PTE that differs from the one a valid walk put at the same address has its own. SATPs are interned by value.
+    '''
+    def __init__(self, mode: int):
+        self.mode = mode
+        self.ptes: List[PTE] = []
+        self.satps: List[SATP] = []
+        self.pagesizes: List[str] = []
+        self.kinds: List[Kind] = [(False, None)]  # code 0: a valid walk
+        self._pte_ids: Dict[int, int] = {}  # id(PTE) -> its row
+        self._satp_ids: Dict[Tuple[Union[int, None], Union[int, None]], int] = {}  # (ppn, asid) -> its row
+        self._codes: Dict[Union[str, Kind], int] = {(False, None): 0}
+        # the walk table
+        self.va_bits, self.va_known = array('Q'), array('Q')
+        self.pa_bits, self.pa_known = array('Q'), array('Q')
+        self.satp = array('I')
+        self.pagesize = array('B')
+        self.kind = array('B')
+        self.pte_start = array('Q', [0])  # walk i goes through pte_ids[pte_start[i]:pte_start[i + 1]], top first
+        self.pte_ids = array('I')
+
+    def _code(self, value, table: list) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(table)
+            table.append(value)
+        return code
+
+    def append(self, walk: TranslationWalk):
+        satp_key = (walk.satp.ppn, walk.satp.asid)
+        satp_id = self._satp_ids.get(satp_key)
+        if satp_id is None:
+            satp_id = self._satp_ids[satp_key] = len(self.satps)
+            self.satps.append(walk.satp)
+        pte_ids = self._pte_ids
+        for pte in walk.ptes:
+            row = pte_ids.get(id(pte))
+            if row is None:
+                row = pte_ids[id(pte)] = len(self.ptes)
+                self.ptes.append(pte)
+            self.pte_ids.append(row)
+        self.pte_start.append(len(self.pte_ids))
+        self.va_bits.append(walk.va.bits)
+        self.va_known.append(walk.va.known)
+        self.pa_bits.append(walk.pa.bits)
+        self.pa_known.append(walk.pa.known)
+        self.satp.append(satp_id)
+        self.pagesize.append(self._code(walk.pagesize, self.pagesizes))
+        invalid = isinstance(walk, InvalidTranslationWalk)
+        self.kind.append(self._code((invalid, walk.error_type if invalid else None), self.kinds))
+
+    def __len__(self) -> int:
+        return len(self.satp)
+
+    def walk(self, i: int) -> TranslationWalk:
+        ''' The walk at index i, made back from the tables '''
+        mode = self.mode
+        ptes = [self.ptes[row] for row in self.pte_ids[self.pte_start[i]:self.pte_start[i + 1]]]
+        va = _unpack(VA, mode, self.va_bits[i], self.va_known[i])
+        pa = _unpack(PA, mode, self.pa_bits[i], self.pa_known[i])
+        satp, pagesize = self.satps[self.satp[i]], self.pagesizes[self.pagesize[i]]
+        invalid, error_type = self.kinds[self.kind[i]]
+        if invalid:
+            return InvalidTranslationWalk(mode, pagesize, satp, va, pa, ptes, error_type)
+        return TranslationWalk(mode, pagesize, satp, va, pa, ptes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.walk(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('walk index out of range')
+        return self.walk(index)
+
+    def __iter__(self) -> Iterator[TranslationWalk]:
+        for i in range(len(self)):
+            yield self.walk(i)
+
+    def jsonify(self) -> dict:
+        '''
+        The normalized JSON form: every PTE and SATP once, and the walks referring to them by index. A walk's VA / PA
+        is its address (the fields follow from it and the mode), or the TranslationWalk.jsonify dict if it's only
+        partly known. The levels follow from the page size. error_type only on invalid walks.
+        '''
+        mode, masks = self.mode, (layout(self.mode).va_mask, layout(self.mode).pa_mask)
+        walks = []
+        for i in range(len(self)):
+            d = {
+                'pagesize': self.pagesizes[self.pagesize[i]],
+                'satp': self.satp[i],
+                'ptes': self.pte_ids[self.pte_start[i]:self.pte_start[i + 1]].tolist(),
+            }
+            for name, cls, bits, known, mask in (('va', VA, self.va_bits[i], self.va_known[i], masks[0]),
+                                                 ('pa', PA, self.pa_bits[i], self.pa_known[i], masks[1])):
+                d[name] = bits if known == mask else _unpack(cls, mode, bits, known).jsonify()
+            invalid, error_type = self.kinds[self.kind[i]]
+            if invalid:
+                d['error_type'] = error_type
+            walks.append(d)
+        return {
+            'satps': [satp.jsonify() for satp in self.satps],
+            'ptes': [pte.jsonify() for pte in self.ptes],
+            'walks': walks,
+        }
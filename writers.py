@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+'''
+Incremental writers for the generated walks, so output can be written as the walks are made
+instead of building the whole Context.jsonify() dict first.
+
+json and ndjson write the Context.jsonify() walks, normalized the Context.jsonify_normalized() document
+(every PTE once, the walks refer to them by index). The column formats (columns, msgpack, npz, parquet)
+keep one array per field instead, and every PTE once: see ColumnarWalkWriter.
+
+json and ndjson keep the full PTEs in every walk on purpose: they're the Context.jsonify() document the
+frontend, /api/json5 and the other tools read. Use normalized or a column format for shared PTEs stored once.
+'''
+
+import json
+import os
+from typing import IO, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # the JSON formats fall back to the standard json module
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from Context import Context
+from Translator import TranslationWalk
+from walk_store import WalkStore
+
+OPTIONAL_MODULES = {'msgpack': msgpack, 'numpy': np, 'pyarrow': pyarrow}
+
+# Bits of the flags column: what jsonify_color marks on the walk
+WALK_FLAGS = {'same_va_pa': 1, 'va_reuse': 2, 'pa_reuse': 4, 'pte_reuse': 8}
+
+
+def _dumps(obj) -> str:
+    ''' json.dumps, with orjson if it's installed (compact, and several times faster) '''
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+class WalkWriter:
+    '''
+    Base writer. Use as a context manager:
+
+        with JSONWalkWriter(f, mgr) as writer:
+            for walk in iter_walks(mgr, params):
+                writer.write(walk)
+    '''
+    binary = False  # the file is opened in binary mode
+    single_file = True  # everything goes in the output file
+    requires: Tuple[str, ...] = ()  # OPTIONAL_MODULES it needs
+
+    def __init__(self, f: IO, mgr: Context):
+        self.f = f
+        self.mgr = mgr
+        self.count = 0
+
+    @classmethod
+    def missing(cls) -> List[str]:
+        ''' The modules this format needs that aren't installed '''
+        return [name for name in cls.requires if OPTIONAL_MODULES[name] is None]
+
+    def open(self):
+        pass
+
+    def write(self, walk: TranslationWalk):
+        raise NotImplementedError
+
+    def close(self, exc_type=None):
+        ''' Finish the output. exc_type is the exception that stopped the walks, if any: then nothing is finished '''
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type)
+
+
+class JSONWalkWriter(WalkWriter):
+    ''' Writes the same document as json.dump(mgr.jsonify()), one walk at a time '''
+    def open(self):
+        header = json.dumps(self.mgr.jsonify_header())
+        self.f.write(header[:-1] + ', "walks": [')
+
+    def write(self, walk: TranslationWalk):
+        if self.count:
+            self.f.write(', ')
+        self.f.write(_dumps(walk.jsonify()))
+        self.count += 1
+
+    def close(self, exc_type=None):
+        if exc_type is None:  # a document cut short doesn't get its closing brackets
+            self.f.write(']}')
+
+
+class NDJSONWalkWriter(WalkWriter):
+    ''' Newline delimited JSON: the context header on the first line, then one walk per line '''
+    def open(self):
+        self.f.write(json.dumps(self.mgr.jsonify_header()) + '\n')
+
+    def write(self, walk: TranslationWalk):
+        self.f.write(_dumps(walk.jsonify()) + '\n')
+        self.count += 1
+
+
+class NormalizedJSONWriter(WalkWriter):
+    ''' Writes the same document as json.dump(mgr.jsonify_normalized()): every PTE and SATP once, the walks by index '''
+    def open(self):
+        self.store = WalkStore(self.mgr.mode)
+
+    def write(self, walk: TranslationWalk):
+        self.store.append(walk)
+        self.count += 1
+
+    def close(self, exc_type=None):
+        if exc_type is None:
+            self.f.write(_dumps({**self.mgr.jsonify_header(), **self.store.jsonify()}))
+
+
+class ColumnarWalkWriter(WalkWriter):
+    '''
+    Base of the column formats. Collects the walks into columns as they come, and writes them all on close:
+
+        header: Context.jsonify_header()
+        walks: va, pa, pagesize, satp_ppn, asid, error_type (None for valid walks),
+               flags (WALK_FLAGS, from the reference counts of the whole run),
+               pte_start + ptes: walk i goes through ptes[pte_start[i]:pte_start[i + 1]], top level first,
+               which are rows of the PTE table
+        ptes: address, data (the PTE word, with the flags in the low 10 bits)
+
+    A PTE shared by many walks (the upper levels) is one row. Rows are by address and word, so an invalid walk's
+    PTE that doesn't match what a valid walk put at the same address still gets its own.
+    '''
+    binary = True
+
+    def open(self):
+        self.pte_rows: Dict[Tuple[int, int], int] = {}
+        self.walks: Dict[str, list] = {name: [] for name in ('va', 'pa', 'pagesize', 'satp_ppn', 'asid', 'error_type')}
+        self.pte_start = [0]
+        self.walk_ptes: List[int] = []
+        self.pte_address: List[int] = []
+        self.pte_data: List[int] = []
+
+    def write(self, walk: TranslationWalk):
+        walks = self.walks
+        walks['va'].append(walk.va.data())
+        walks['pa'].append(walk.pa.data())
+        walks['pagesize'].append(walk.pagesize)
+        walks['satp_ppn'].append(walk.satp.ppn)
+        walks['asid'].append(walk.satp.asid)
+        walks['error_type'].append(getattr(walk, 'error_type', None))
+        pte_rows, walk_ptes = self.pte_rows, self.walk_ptes
+        for pte in walk.ptes:
+            key = (pte.address, pte.data())
+            row = pte_rows.get(key)
+            if row is None:
+                row = pte_rows[key] = len(self.pte_address)
+                self.pte_address.append(key[0])
+                self.pte_data.append(key[1])
+            walk_ptes.append(row)
+        self.pte_start.append(len(walk_ptes))
+        self.count += 1
+
+    def _flags(self) -> List[int]:
+        va_counter, pa_counter = self.mgr.va_reference_counter, self.mgr.reference_counter
+        shared_ptes = [pa_counter.get(address, 0) > 1 for address in self.pte_address]
+        flags = []
+        pte_start, walk_ptes = self.pte_start, self.walk_ptes
+        for i, (va, pa) in enumerate(zip(self.walks['va'], self.walks['pa'])):
+            walk_flags = WALK_FLAGS['same_va_pa'] if va == pa else 0
+            if va_counter.get(va, 0) > 1:
+                walk_flags |= WALK_FLAGS['va_reuse']
+            if pa_counter.get(pa, 0) > 1:
+                walk_flags |= WALK_FLAGS['pa_reuse']
+            if any(shared_ptes[row] for row in walk_ptes[pte_start[i]:pte_start[i + 1]]):
+                walk_flags |= WALK_FLAGS['pte_reuse']
+            flags.append(walk_flags)
+        return flags
+
+    def columns(self) -> dict:
+        return {
+            'header': self.mgr.jsonify_header(),
+            'walks': {**self.walks, 'flags': self._flags(), 'pte_start': self.pte_start, 'ptes': self.walk_ptes},
+            'ptes': {'address': self.pte_address, 'data': self.pte_data},
+        }
+
+    def close(self, exc_type=None):
+        if exc_type is None:
+            self.dump(self.columns())
+
+    def dump(self, columns: dict):
+        raise NotImplementedError
+
+
+class ColumnsJSONWriter(ColumnarWalkWriter):
+    ''' The columns as one JSON document (with orjson if it's installed) '''
+    def dump(self, columns: dict):
+        if orjson is not None:
+            self.f.write(orjson.dumps(columns))
+        else:
+            self.f.write(json.dumps(columns, separators=(',', ':')).encode())
+
+
+class MsgpackWalkWriter(ColumnarWalkWriter):
+    ''' The columns as one MessagePack map '''
+    requires = ('msgpack', )
+
+    def dump(self, columns: dict):
+        msgpack.pack(columns, self.f)
+
+
+def _codes(values: list, names: List[str]) -> list:
+    ''' Strings to indices into names (extended with the new ones), None to 0 if names starts with '' '''
+    index = {name: i for i, name in enumerate(names)}
+    codes = []
+    for value in values:
+        value = '' if value is None else value
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(names)
+            names.append(value)
+        codes.append(code)
+    return codes
+
+
+class NPZWalkWriter(ColumnarWalkWriter):
+    '''
+    The columns as NumPy arrays in a .npz (np.load reads them back): walks_<column> and ptes_<column>.
+    Integer columns are uint64, with NONE_U64 for unset values (asid: uint32, NONE_U32).
+    pagesize and error_type are uint8 codes into the pagesizes / error_types arrays ('' = no error).
+    The header is a JSON string in header.
+    '''
+    requires = ('numpy', )
+    NONE_U64 = (1 << 64) - 1
+    NONE_U32 = (1 << 32) - 1
+
+    def dump(self, columns: dict):
+        walks, ptes = columns['walks'], columns['ptes']
+
+        def u64(values):
+            return np.array([self.NONE_U64 if value is None else value for value in values], dtype=np.uint64)
+
+        pagesizes, error_types = [], ['']
+        arrays = {
+            'header': np.array(json.dumps(columns['header'])),
+            'walks_va': u64(walks['va']),
+            'walks_pa': u64(walks['pa']),
+            'walks_pagesize': np.array(_codes(walks['pagesize'], pagesizes), dtype=np.uint8),
+            'walks_satp_ppn': u64(walks['satp_ppn']),
+            'walks_asid': np.array([self.NONE_U32 if asid is None else asid for asid in walks['asid']], dtype=np.uint32),
+            'walks_error_type': np.array(_codes(walks['error_type'], error_types), dtype=np.uint8),
+            'walks_flags': np.array(walks['flags'], dtype=np.uint8),
+            'walks_pte_start': np.array(walks['pte_start'], dtype=np.uint64),
+            'walks_ptes': np.array(walks['ptes'], dtype=np.uint32),
+            'ptes_address': u64(ptes['address']),
+            'ptes_data': u64(ptes['data']),
+        }
+        arrays['pagesizes'] = np.array(pagesizes)
+        arrays['error_types'] = np.array(error_types)
+        np.savez(self.f, **arrays)
+
+
+class ParquetWalkWriter(ColumnarWalkWriter):
+    '''
+    The walks table in the output file (ptes is a list column of rows of the PTE table), and the PTE table
+    in a second file next to it, <output>.ptes.parquet. The header is in the walks table's metadata, as JSON.
+    '''
+    requires = ('pyarrow', )
+    single_file = False
+
+    def dump(self, columns: dict):
+        walks, ptes = columns['walks'], columns['ptes']
+        u64, u32, u8 = pyarrow.uint64(), pyarrow.uint32(), pyarrow.uint8()
+        walk_ptes = pyarrow.ListArray.from_arrays(pyarrow.array(walks['pte_start'], pyarrow.int32()),
+                                                  pyarrow.array(walks['ptes'], u32))
+        table = pyarrow.table({
+            'va': pyarrow.array(walks['va'], u64),
+            'pa': pyarrow.array(walks['pa'], u64),
+            'pagesize': pyarrow.array(walks['pagesize']).dictionary_encode(),
+            'satp_ppn': pyarrow.array(walks['satp_ppn'], u64),
+            'asid': pyarrow.array(walks['asid'], u32),
+            'error_type': pyarrow.array(walks['error_type'], pyarrow.string()).dictionary_encode(),
+            'flags': pyarrow.array(walks['flags'], u8),
+            'ptes': walk_ptes,
+        }).replace_schema_metadata({'header': json.dumps(columns['header'])})
+        pyarrow.parquet.write_table(table, self.f)
+        pte_table = pyarrow.table({'address': pyarrow.array(ptes['address'], u64), 'data': pyarrow.array(ptes['data'], u64)})
+        pyarrow.parquet.write_table(pte_table, self.pte_filename(self.f.name))
+
+    @staticmethod
+    def pte_filename(filename: str) -> str:
+        return os.path.splitext(filename)[0] + '.ptes.parquet'
+
+
+WRITERS = {
+    'json': JSONWalkWriter,
+    'ndjson': NDJSONWalkWriter,
+    'normalized': NormalizedJSONWriter,
+    'columns': ColumnsJSONWriter,
+    'msgpack': MsgpackWalkWriter,
+    'npz': NPZWalkWriter,
+    'parquet': ParquetWalkWriter,
+}